@@ -2,114 +2,250 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import json
+import io
+import gzip
+import base64
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Rust-based XLSX reader for pd.read_excel; openpyxl (the pandas default) otherwise
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None
+
+# Arrow-backed strings with NaN for missing values, so text columns behave like object columns
+try:
+    import pyarrow  # noqa: F401
+    ARROW_STRING_DTYPE = pd.StringDtype("pyarrow", na_value=np.nan)
+except (ImportError, TypeError):
+    ARROW_STRING_DTYPE = None
+
+# Tree JSON above this many bytes is embedded gzipped + base64 and inflated with pako in the browser
+TREE_JSON_GZIP_MIN_BYTES = 1_000_000
+
+# In "Auto" renderer mode, trees with more nodes than this are drawn on a canvas instead of SVG
+CANVAS_NODE_THRESHOLD = 1000
+
 st.set_page_config(layout="wide")
 st.title("📊 Decomposition Tree")
 
-def convert_pandas_to_json_serializable(obj):
-    """Convert pandas objects to JSON serializable format"""
-    if obj is None:
-        return None
-    elif isinstance(obj, list):
-        return [convert_pandas_to_json_serializable(item) for item in obj]
-    elif isinstance(obj, dict):
-        return {k: convert_pandas_to_json_serializable(v) for k, v in obj.items()}
-    elif isinstance(obj, pd.Timestamp):
-        return obj.isoformat()
-    elif isinstance(obj, (pd.Series, pd.DataFrame)):
-        return obj.to_dict('records')
-    elif isinstance(obj, (np.integer, np.floating)):
-        return float(obj)
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    elif isinstance(obj, (str, int, float, bool)):
-        return obj
+def frame_to_records_json(frame):
+    """Serialize a DataFrame to a JSON records string (ISO dates, missing values as null)"""
+    return frame.to_json(orient='records', date_format='iso', default_handler=str)
+
+def frame_to_row_json(frame):
+    """Serialize each row of a DataFrame to its own JSON object string, as an object array (one to_json call)"""
+    # JSON text never holds a raw newline, so the lines output splits cleanly per row
+    lines = frame.to_json(orient='records', lines=True, date_format='iso', default_handler=str).splitlines()
+    return np.array(lines, dtype=object)
+
+def dumps_json(obj):
+    """Serialize to UTF-8 JSON bytes that are safe to inline in a <script> (orjson when installed)"""
+    if orjson is not None:
+        data = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
     else:
-        # For any other type, try pd.isna() only on scalar values
-        try:
-            if pd.isna(obj):
-                return None
-        except (ValueError, TypeError):
-            pass
-        # Convert to string as fallback
-        return str(obj)
+        data = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+    # Escape closing tags on the encoded bytes, in one C-level pass
+    return data.replace(b'</', b'<\\/')
 
-def kpi_panel(df, time_comparison="Day"):
-    # Create a copy of the dataframe to avoid modifying the original
-    df_copy = df.copy()
+def flatten_tree(tree):
+    """Flatten a nested tree into one column per node field plus each node's parent index (preorder)"""
+    parents = []
+    columns = {}
+    stack = [(tree, -1)]
+    while stack:
+        node, parent = stack.pop()
+        i = len(parents)
+        parents.append(parent)
+        filled = 0
+        for key, value in node.items():
+            if key == "children":
+                continue
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * i
+            column.append(value)
+            filled += 1
+        # Fields this node doesn't have stay null (nodes normally share one field set, so this is rare)
+        if filled != len(columns):
+            for column in columns.values():
+                if len(column) == i:
+                    column.append(None)
+        stack.extend((child, i) for child in reversed(node.get("children") or []))
+    return {"parents": parents, "columns": columns}
+
+def pack_raw_rows(flat):
+    """Move the nodes' raw_data JSON text out of a flattened tree into one text block.
+
+    Each string is replaced by [start, end) offsets in a raw_rows column, so the rows
+    aren't escaped a second time as JSON strings. "<" is written as \\u003c so the block
+    can sit in an HTML <script> as is.
+    """
+    column = flat["columns"].get("raw_data") or []
+    spans = [None] * len(column)
+    parts = []
+    pos = 0
+    for i, rows in enumerate(column):
+        if isinstance(rows, str):
+            rows = rows.replace("<", "\\u003c")
+            spans[i] = [pos, pos + len(rows)]
+            column[i] = None
+            parts.append(rows)
+            pos += len(rows)
+    if parts:
+        flat["columns"]["raw_rows"] = spans
+    return "".join(parts)
+
+def _unique_csv(values):
+    """Join the sorted distinct string forms of values, skipping blanks and 'nan'"""
+    if pd.api.types.is_datetime64_any_dtype(values) or pd.api.types.is_timedelta64_dtype(values):
+        # pandas picks the date format from the values themselves, so keep its formatting
+        strs = pd.Series(values).astype(str).to_numpy(dtype=str)
+    else:
+        strs = np.asarray(values, dtype=object).astype(str)
+    # np.unique sorts and de-duplicates in one C call
+    return ", ".join([v for v in np.unique(strs).tolist() if v and v != "nan"])
+
+def _label_codes(values):
+    """Sorted distinct string forms of values, and each row's index into them.
+
+    Blanks, 'nan' and missing values get -1, as _unique_csv leaves them out. Only the
+    distinct values are stringified.
+    """
+    codes, uniques = pd.factorize(values)
+    if isinstance(uniques.dtype, pd.StringDtype):
+        # Arrow/string columns already hold str; copy them out without boxing each one
+        strs = uniques.to_numpy(dtype=str)
+    else:
+        strs = np.asarray(uniques, dtype=object).astype(str)
+    labels, label_of_code = np.unique(strs, return_inverse=True)
+    shown = (labels != "") & (labels != "nan")
+    label_of_code = np.where(shown[label_of_code], label_of_code, -1)
+    if len(label_of_code) == 0:
+        return labels, np.full(len(codes), -1)
+    return labels, np.where(codes >= 0, label_of_code[codes], -1)
+
+def _distinct_per_group(codes, group_ids, ngroups, ncodes):
+    """Sorted distinct non-negative codes of every group, from one np.unique over (group, code) pairs"""
+    keep = codes >= 0
+    pairs = np.unique(group_ids[keep].astype(np.int64) * max(ncodes, 1) + codes[keep])
+    pair_groups, pair_codes = np.divmod(pairs, max(ncodes, 1))
+    bounds = np.searchsorted(pair_groups, np.arange(ngroups + 1))
+    return [pair_codes[bounds[i]:bounds[i + 1]] for i in range(ngroups)]
+
+def _display_values(series):
+    """Sorted distinct values of a column as strings, with "No Data" for missing ones"""
+    # De-duplicate first (one hashed pass), so only the distinct values are stringified
+    distinct = series.drop_duplicates()
+    values = set()
+    # Missing values are found with one vectorized isna() instead of a pd.isna call per value
+    for v, missing in zip(distinct.tolist(), distinct.isna().tolist()):
+        v = "No Data" if missing else str(v)
+        values.add("No Data" if v in ("None", "nan", "NaT") else v)
+    return sorted(values)
+
+def as_numeric(series):
+    """A column as numbers with non-numeric cells as NaN; already-numeric columns are returned as is"""
+    # read_excel gives numeric columns a numeric dtype, so this skips a full pd.to_numeric pass
+    if pd.api.types.is_numeric_dtype(series):
+        return series
+    return pd.to_numeric(series, errors='coerce')
+
+def _status_counts(series):
+    """Count Early/On-Time/Delayed/Pending values in a single pass"""
+    counts = series.value_counts()
+    return (
+        int(counts.get('Early', 0)),
+        int(counts.get('On-Time', 0)),
+        int(counts.get('Delayed', 0)),
+        int(counts.get('Pending', 0))
+    )
+
+@st.cache_data(max_entries=8)
+def compute_kpis(df, time_comparison="Day"):
+    """Compute the KPI stats and time insights text, cached so display-only reruns skip them"""
+    stats = {"period_status": None}
+    time_insights = ""
     if all(col in df.columns for col in ["Status", "Delay_Days"]) and len(df) > 0:
         total_sites = len(df)
         
-        # Convert Delay_Days to numeric, handling errors
-        df_copy['Delay_Days_Numeric'] = pd.to_numeric(df_copy['Delay_Days'], errors='coerce')
+        # Convert Delay_Days to numeric, handling errors (kept off the frame, no copy needed)
+        delay_num = as_numeric(df['Delay_Days'])
         
         # Calculate status counts based on time comparison method
         if time_comparison == "Week (Monday start)":
             # For week comparison, group by week and calculate status
-            if 'Planned_Week_Label' in df_copy.columns and 'Actual_Week_Label' in df_copy.columns:
+            if 'Planned_Week_Label' in df.columns and 'Actual_Week_Label' in df.columns:
                 # Create week-based status calculation
-                df_copy['Week_Status'] = df_copy.apply(lambda row: calculate_week_status(row), axis=1)
-                early = len(df_copy[df_copy['Week_Status'] == 'Early'])
-                on_time = len(df_copy[df_copy['Week_Status'] == 'On-Time'])
-                delayed = len(df_copy[df_copy['Week_Status'] == 'Delayed'])
-                pending = len(df_copy[df_copy['Week_Status'] == 'Pending'])
+                stats["period_status"] = calculate_period_status(df['Planned_Week_Label'], df['Actual_Week_Label'])
+                early, on_time, delayed, pending = _status_counts(stats["period_status"])
             else:
                 # Fallback to original status if week columns not available
-                early = len(df_copy[df_copy['Status'] == 'Early'])
-                on_time = len(df_copy[df_copy['Status'] == 'On-Time'])
-                delayed = len(df_copy[df_copy['Status'] == 'Delayed'])
-                pending = len(df_copy[df_copy['Status'] == 'Pending'])
+                early, on_time, delayed, pending = _status_counts(df['Status'])
                 
         elif time_comparison == "Month":
             # For month comparison, group by month and calculate status
-            if 'Planned_Month_Label' in df_copy.columns and 'Actual_Month_Label' in df_copy.columns:
+            if 'Planned_Month_Label' in df.columns and 'Actual_Month_Label' in df.columns:
                 # Create month-based status calculation
-                df_copy['Month_Status'] = df_copy.apply(lambda row: calculate_month_status(row), axis=1)
-                early = len(df_copy[df_copy['Month_Status'] == 'Early'])
-                on_time = len(df_copy[df_copy['Month_Status'] == 'On-Time'])
-                delayed = len(df_copy[df_copy['Month_Status'] == 'Delayed'])
-                pending = len(df_copy[df_copy['Month_Status'] == 'Pending'])
+                stats["period_status"] = calculate_period_status(df['Planned_Month_Label'], df['Actual_Month_Label'])
+                early, on_time, delayed, pending = _status_counts(stats["period_status"])
             else:
                 # Fallback to original status if month columns not available
-                early = len(df_copy[df_copy['Status'] == 'Early'])
-                on_time = len(df_copy[df_copy['Status'] == 'On-Time'])
-                delayed = len(df_copy[df_copy['Status'] == 'Delayed'])
-                pending = len(df_copy[df_copy['Status'] == 'Pending'])
+                early, on_time, delayed, pending = _status_counts(df['Status'])
         else:
             # Day comparison - use original status
-            early = len(df_copy[df_copy['Status'] == 'Early'])
-            on_time = len(df_copy[df_copy['Status'] == 'On-Time'])
-            delayed = len(df_copy[df_copy['Status'] == 'Delayed'])
-            pending = len(df_copy[df_copy['Status'] == 'Pending'])
-        
-        # Calculate average delay (only for delayed items)
-        delayed_data = df_copy.loc[(df_copy['Delay_Days_Numeric'] > 0) & (df_copy['Delay_Days_Numeric'].notna()), 'Delay_Days_Numeric']
-        avg_delay = delayed_data.mean() if not delayed_data.empty else 0
+            early, on_time, delayed, pending = _status_counts(df['Status'])
         
-        # Calculate max delay
-        max_delay_data = df_copy.loc[(df_copy['Delay_Days_Numeric'] > 0) & (df_copy['Delay_Days_Numeric'].notna()), 'Delay_Days_Numeric']
-        max_delay = max_delay_data.max() if not max_delay_data.empty else 0
-        
-        # Calculate average early completion (negative delay days)
-        early_data = df_copy.loc[(df_copy['Delay_Days_Numeric'] < 0) & (df_copy['Delay_Days_Numeric'].notna()), 'Delay_Days_Numeric']
+        # Delay/early aggregates from one mask each (comparisons are already False for NaN)
+        delayed_data = delay_num[delay_num > 0]
+        if delayed_data.empty:
+            avg_delay = max_delay = 0
+        else:
+            avg_delay, max_delay = delayed_data.mean(), delayed_data.max()
+        early_data = delay_num[delay_num < 0]
         avg_early = early_data.mean() if not early_data.empty else 0
         
         # Add time-based insights based on comparison method
-        time_insights = ""
         if time_comparison == "Week (Monday start)":
-            if 'Planned_Week_Label' in df_copy.columns:
-                week_distribution = df_copy['Planned_Week_Label'].value_counts().head(5)
+            if 'Planned_Week_Label' in df.columns:
+                week_distribution = df['Planned_Week_Label'].value_counts().head(5)
                 time_insights = f"\n**Top 5 Planned Weeks:**\n"
                 for week, count in week_distribution.items():
                     time_insights += f"• {week}: {count} sites\n"
         elif time_comparison == "Month":
-            if 'Planned_Month_Label' in df_copy.columns:
-                month_distribution = df_copy['Planned_Month_Label'].value_counts().head(5)
+            if 'Planned_Month_Label' in df.columns:
+                month_distribution = df['Planned_Month_Label'].value_counts().head(5)
                 time_insights = f"\n**Top 5 Planned Months:**\n"
                 for month, count in month_distribution.items():
                     time_insights += f"• {month}: {count} sites\n"
         
+        stats.update({
+            "total_sites": total_sites,
+            "early": early,
+            "on_time": on_time,
+            "delayed": delayed,
+            "pending": pending,
+            "avg_delay": avg_delay,
+            "max_delay": max_delay,
+            "avg_early": avg_early
+        })
+    
+    return stats, time_insights
+
+def kpi_panel(df, time_comparison="Day"):
+    """Show the KPI summary and return its stats, including any week/month status Series"""
+    stats, time_insights = compute_kpis(df, time_comparison)
+    if "total_sites" in stats:
+        total_sites = stats["total_sites"]
+        early, on_time, delayed, pending = stats["early"], stats["on_time"], stats["delayed"], stats["pending"]
+        avg_delay, max_delay, avg_early = stats["avg_delay"], stats["max_delay"], stats["avg_early"]
+        
         st.header(f"🔎 Project KPIs & On-Air Status Summary ({time_comparison})")
         
         # Create conditional display for delay and early metrics
@@ -128,248 +264,348 @@ def kpi_panel(df, time_comparison="Day"):
         {max_delay_text}{time_insights}
         """)
     
-    return df_copy
-
-def calculate_week_status(row):
-    """Calculate status based on week comparison"""
-    if pd.isna(row['Planned_Week_Label']) or pd.isna(row['Actual_Week_Label']):
-        return 'Pending'
-    
-    try:
-        # Convert week labels to comparable format
-        planned_week = str(row['Planned_Week_Label']).split(' ')[0]  # Get "2024-W01" part
-        actual_week = str(row['Actual_Week_Label']).split(' ')[0]    # Get "2024-W01" part
-        
+    return stats
 
-        
-        if planned_week == actual_week:
-            return 'On-Time'
-        elif actual_week < planned_week:  # Earlier week
-            return 'Early'
-        else:  # Later week
-            return 'Delayed'
-    except Exception as e:
-        print(f"Error in calculate_week_status: {e}")
-        return 'Pending'
+def _period_keys(labels):
+    """Parse "2024-W01 ..." / "2024-01 ..." labels to year*100+period ints, or None if any label doesn't fit"""
+    # Labels repeat heavily (one per week/month), so only the distinct ones go through the regex
+    codes, uniques = pd.factorize(labels)
+    parts = pd.Series(uniques, dtype=object).astype(str).str.extract(r'^(\d{4})-W?(\d{1,2})(?:\s|$)')
+    if parts[0].isna().any():
+        return None
+    keys = (pd.to_numeric(parts[0]) * 100 + pd.to_numeric(parts[1])).to_numpy(dtype=np.int64)
+    # Missing labels (code -1) pick the trailing -100 (year -1, period 0)
+    return np.append(keys, -100)[codes]
 
-def calculate_month_status(row):
-    """Calculate status based on month comparison"""
-    if pd.isna(row['Planned_Month_Label']) or pd.isna(row['Actual_Month_Label']):
-        return 'Pending'
-    
-    try:
-        # Convert month labels to comparable format
-        planned_month = str(row['Planned_Month_Label']).split(' ')[0]  # Get "2024-01" part
-        actual_month = str(row['Actual_Month_Label']).split(' ')[0]    # Get "2024-01" part
-        
+def calculate_period_status(planned_labels, actual_labels):
+    """Calculate status for whole columns of week/month labels"""
+    # Compare integer period keys; fall back to the leading label text for unusual formats
+    planned = _period_keys(planned_labels)
+    actual = _period_keys(actual_labels)
+    if planned is None or actual is None:
+        # Missing labels become '' so the text compares stay str vs str; pending overrides them
+        planned = planned_labels.astype(str).str.split(' ', n=1).str[0].fillna('').to_numpy()
+        actual = actual_labels.astype(str).str.split(' ', n=1).str[0].fillna('').to_numpy()
+    pending = (planned_labels.isna() | actual_labels.isna()).to_numpy()
+    status = np.select(
+        [pending, planned == actual, actual < planned],
+        ['Pending', 'On-Time', 'Early'],
+        default='Delayed'
+    )
+    return pd.Series(status, index=planned_labels.index)
 
-        
-        if planned_month == actual_month:
-            return 'On-Time'
-        elif actual_month < planned_month:  # Earlier month
-            return 'Early'
-        else:  # Later month
-            return 'Delayed'
-    except Exception as e:
-        print(f"Error in calculate_month_status: {e}")
-        return 'Pending'
+def _make_node(col, val_str, level, value, total_count, tooltip_data, color):
+    """Build one tree node dict with its percentage of the total"""
+    # Calculate percentage
+    percentage_raw = (value / total_count) * 100 if total_count > 0 else 0
+    # Format percentage: always show as whole number
+    percentage = round(percentage_raw)
 
-def node_color(status):
-    return '#3B82F6'
+    return {
+        "name": f"{col}: {val_str}",
+        "children": [],
+        "value": value,
+        "percentage": percentage,
+        "level": level,
+        "column": col,
+        "node_value": val_str,
+        "tooltip_data": tooltip_data,
+        "color": color,
+        "raw_data": []
+    }
 
 def build_tree(df, hierarchy, value_col=None, tooltip_cols=None, time_comparison="Day", color_mode="Uniform", uniform_color="#3B82F6", level_colors=None, per_node_colors=None, display_filters=None):
     # Calculate total for percentage calculation
     total_count = len(df)
     
-    def add_node(level, parent, df_sub):
-        if level >= len(hierarchy):
-            return
-        col = hierarchy[level]
-        for val, group in df_sub.groupby(col):
-            val_str = "No Data" if pd.isna(val) else str(val)
-            # Visibility-only filtering: skip nodes not selected for display
-            if isinstance(display_filters, dict) and col in display_filters:
-                allowed_set = display_filters.get(col)
-                if isinstance(allowed_set, set) and allowed_set and val_str not in allowed_set:
-                    continue
-            value = int(group[value_col].sum()) if value_col else int(len(group))
-            
-            # Calculate percentage
-            percentage_raw = (value / total_count) * 100 if total_count > 0 else 0
-            # Format percentage: always show as whole number
-            percentage = round(percentage_raw)
-            
-            tooltip_data = {}
-            if tooltip_cols:
-                for tcol in tooltip_cols:
-                    if tcol in group.columns:
-                        tdata = group[tcol]
-                        vals = list(sorted(set(tdata.astype(str))))
-                        tooltip_data[tcol] = ", ".join([v for v in vals if v and v != "nan"])
-            # Always include these if present
-            for dcol in ["Status","Delay_Days","PIC","Delay_Reason","Planned_OnAir_Date","Actual_OnAir_Date"]:
-                if dcol in group.columns and dcol not in (tooltip_data.keys()):
-                    vals = list(sorted(set(group[dcol].astype(str))))
-                    tooltip_data[dcol] = ", ".join([v for v in vals if v and v != "nan"])
-            
-            # Add time-based status columns to tooltip based on comparison method
-            if time_comparison == "Week (Monday start)" and 'Week_Status' in group.columns:
-                vals = list(sorted(set(group['Week_Status'].astype(str))))
-                tooltip_data['Week_Status'] = ", ".join([v for v in vals if v and v != "nan"])
-            elif time_comparison == "Month" and 'Month_Status' in group.columns:
-                vals = list(sorted(set(group['Month_Status'].astype(str))))
-                tooltip_data['Month_Status'] = ", ".join([v for v in vals if v and v != "nan"])
-            # Safely get the mode status based on time comparison
-            status_mode = ""
-            if time_comparison == "Week (Monday start)" and 'Week_Status' in group.columns and not group.empty:
-                mode_result = group['Week_Status'].mode()
-                if len(mode_result) > 0:
-                    status_mode = mode_result[0]
-
-            elif time_comparison == "Month" and 'Month_Status' in group.columns and not group.empty:
-                mode_result = group['Month_Status'].mode()
-                if len(mode_result) > 0:
-                    status_mode = mode_result[0]
-
-            elif 'Status' in group.columns and not group.empty:
-                mode_result = group['Status'].mode()
-                if len(mode_result) > 0:
-                    status_mode = mode_result[0]
-
-            
-            # Resolve node color
-            node_color_value = uniform_color
-            if color_mode == "By Level" and isinstance(level_colors, dict) and level in level_colors:
-                node_color_value = level_colors.get(level, uniform_color)
-            if isinstance(per_node_colors, dict) and (col, val_str) in per_node_colors:
-                node_color_value = per_node_colors[(col, val_str)]
-
-            node = {
-                "name": f"{col}: {val_str}",
-                "children": [],
-                "value": value,
-                "percentage": percentage,
-                "level": level,
-                "column": col,
-                "node_value": val_str,
-                "tooltip_data": tooltip_data,
-                "color": node_color_value,
-                "raw_data": convert_pandas_to_json_serializable(group.to_dict('records'))
-            }
-            add_node(level + 1, node, group)
-            if not node["children"]:
-                node.pop("children")
-            parent["children"].append(node)
-    root_nodes = []
-    
-    # Safety check for empty hierarchy
-    if not hierarchy:
+    # Safety check for empty hierarchy or data
+    if not hierarchy or df.empty:
         return []
-    
-    col = hierarchy[0]
-    for val, group in df.groupby(col):
-        val_str = "No Data" if pd.isna(val) else str(val)
-        # Visibility-only filtering for root level
+
+    # Factorize each hierarchy column once (sorted, missing -> -1) and group on the
+    # integer codes instead of rehashing the values at every level
+    codes_by_level = []
+    values_by_level = []
+    for c in hierarchy:
+        codes, values = pd.factorize(df[c], sort=True)
+        codes_by_level.append(codes)
+        values_by_level.append(values)
+
+    # Tooltip columns in display order: selected ones, always-included ones, then the period status
+    tip_cols = []
+    for tcol in (tooltip_cols or []):
+        if tcol in df.columns and tcol not in tip_cols:
+            tip_cols.append(tcol)
+    for dcol in ["Status","Delay_Days","PIC","Delay_Reason","Planned_OnAir_Date","Actual_OnAir_Date"]:
+        if dcol in df.columns and dcol not in tip_cols:
+            tip_cols.append(dcol)
+    if time_comparison == "Week (Monday start)" and 'Week_Status' in df.columns and 'Week_Status' not in tip_cols:
+        tip_cols.append('Week_Status')
+    elif time_comparison == "Month" and 'Month_Status' in df.columns and 'Month_Status' not in tip_cols:
+        tip_cols.append('Month_Status')
+
+    # One groupby over the full hierarchy path; every shallower node is assembled
+    # from the leaf groups under it instead of re-grouping the frame per level.
+    # The keys are plain integer codes, so Categorical hierarchy columns can't expand
+    # into the product of all categories; observed=True keeps that explicit. sort stays
+    # on because node order follows the sorted codes
+    grouped = df.groupby(codes_by_level, observed=True)
+    sizes = grouped.size()
+    # Hierarchy codes of every leaf group, one row per group in sorted (lexicographic) order
+    leaf_codes = np.column_stack([sizes.index.get_level_values(level).to_numpy() for level in range(len(hierarchy))])
+    group_ids = grouped.ngroup().to_numpy()
+    # Row counts, or the sum of value_col with non-numeric cells as 0 (coerced here rather
+    # than written back to the frame as a helper column)
+    if value_col:
+        weights = as_numeric(df[value_col]).fillna(0).to_numpy(dtype=float)
+        leaf_values = np.bincount(group_ids, weights=weights, minlength=len(sizes))
+    else:
+        leaf_values = sizes.to_numpy()
+    # Running totals of the leaf values: leaves sharing a path prefix are contiguous in
+    # sorted key order, so any node's value is a difference of two entries
+    leaf_totals = np.concatenate(([0], np.cumsum(leaf_values)))
+    # Row positions of each leaf group: rows sorted by group id, split at the group sizes
+    leaf_order = np.argsort(group_ids, kind='stable')
+    leaf_bounds = np.concatenate(([0], np.cumsum(sizes.to_numpy())))
+
+    # Every path prefix is a run of adjacent leaf groups (sorted key order), so each
+    # level's prefixes are the runs where no code up to that level changes. Rows map to
+    # their prefix at each level through their leaf group, for the tooltip sets below
+    n_leaves = len(leaf_codes)
+    new_run = np.zeros(n_leaves, dtype=bool)
+    new_run[:1] = True
+    present = np.ones(n_leaves, dtype=bool)
+    run_starts, run_stops, run_levels, run_ids = [], [], [], []
+    row_runs_by_level = []
+    for level in range(len(hierarchy)):
+        new_run[1:] |= leaf_codes[1:, level] != leaf_codes[:-1, level]
+        present &= leaf_codes[:, level] >= 0
+        starts = np.flatnonzero(new_run)
+        row_runs_by_level.append((np.cumsum(new_run) - 1)[group_ids])
+        # A missing value ends the path, leaving those rows with the node above it
+        kept = np.flatnonzero(present[starts])
+        run_starts.append(starts[kept])
+        run_stops.append(np.append(starts[1:], n_leaves)[kept])
+        run_levels.append(np.full(len(kept), level))
+        run_ids.append(kept)
+    run_starts, run_stops, run_levels, run_ids = (np.concatenate(r) for r in (run_starts, run_stops, run_levels, run_ids))
+
+    # Distinct tooltip values of every prefix, per level: sorted label indices for most
+    # columns, value codes for dates (pandas picks their string format from the values
+    # being shown, so they're stringified per node)
+    tip_tables = {}
+    for tcol in tip_cols:
+        if pd.api.types.is_datetime64_any_dtype(df[tcol]) or pd.api.types.is_timedelta64_dtype(df[tcol]):
+            codes, uniques = pd.factorize(df[tcol], use_na_sentinel=False)
+            tip_tables[tcol] = (uniques, codes, True)
+        else:
+            labels, codes = _label_codes(df[tcol])
+            tip_tables[tcol] = (labels, codes, False)
+    tips_by_level = []
+    for row_runs in row_runs_by_level:
+        n_runs = int(row_runs.max()) + 1
+        tips_by_level.append({
+            tcol: _distinct_per_group(codes, row_runs, n_runs, len(table))
+            for tcol, (table, codes, _) in tip_tables.items()
+        })
+    # Display strings of each level's values (factorize leaves missing values out of them)
+    val_strs_by_level = [[str(v) for v in values.tolist()] for values in values_by_level]
+
+    # Resolve the color options once: a default per level, then per-node overrides by (column, value)
+    if color_mode == "By Level" and isinstance(level_colors, dict):
+        level_default_colors = [level_colors.get(level, uniform_color) for level in range(len(hierarchy))]
+    else:
+        level_default_colors = [uniform_color] * len(hierarchy)
+    node_colors = per_node_colors if isinstance(per_node_colors, dict) else {}
+
+    root_nodes = []
+    # Nodes kept so far, keyed by their hierarchy path; children attach via key[:-1]
+    nodes_by_key = {(): {"children": root_nodes}}
+    # Deepest kept node of every leaf group, which is the node that carries its rows
+    owner = [None] * n_leaves
+    leaf_keys = leaf_codes.tolist()
+    # Preorder (parents before children, siblings sorted) is start ascending, then shallower first
+    preorder = np.lexsort((run_levels, run_starts))
+    for start, stop, level, run in zip(*(r[preorder].tolist() for r in (run_starts, run_stops, run_levels, run_ids))):
+        key = tuple(leaf_keys[start][:level + 1])
+        parent = nodes_by_key.get(key[:-1])
+        if parent is None:
+            # Parent was hidden by a display filter
+            continue
+        col = hierarchy[level]
+        val_str = val_strs_by_level[level][key[-1]]
+        # Visibility-only filtering: skip nodes not selected for display
         if isinstance(display_filters, dict) and col in display_filters:
             allowed_set = display_filters.get(col)
             if isinstance(allowed_set, set) and allowed_set and val_str not in allowed_set:
                 continue
-        value = int(group[value_col].sum()) if value_col else int(len(group))
-        
-        # Calculate percentage for root nodes
-        percentage_raw = (value / total_count) * 100 if total_count > 0 else 0
-        # Format percentage: always show as whole number
-        percentage = round(percentage_raw)
-        
+        value = int(leaf_totals[stop] - leaf_totals[start])
+
         tooltip_data = {}
-        if tooltip_cols:
-            for tcol in tooltip_cols:
-                if tcol in group.columns:
-                    tdata = group[tcol]
-                    vals = list(sorted(set(tdata.astype(str))))
-                    tooltip_data[tcol] = ", ".join([v for v in vals if v and v != "nan"])
-        for dcol in ["Status","Delay_Days","PIC","Delay_Reason","Planned_OnAir_Date","Actual_OnAir_Date"]:
-            if dcol in group.columns and dcol not in (tooltip_data.keys()):
-                vals = list(sorted(set(group[dcol].astype(str))))
-                tooltip_data[dcol] = ", ".join([v for v in vals if v and v != "nan"])
-        
-        # Add time-based status columns to tooltip based on comparison method
-        if time_comparison == "Week (Monday start)" and 'Week_Status' in group.columns:
-            vals = list(sorted(set(group['Week_Status'].astype(str))))
-            tooltip_data['Week_Status'] = ", ".join([v for v in vals if v and v != "nan"])
-        elif time_comparison == "Month" and 'Month_Status' in group.columns:
-            vals = list(sorted(set(group['Month_Status'].astype(str))))
-            tooltip_data['Month_Status'] = ", ".join([v for v in vals if v and v != "nan"])
-        
-        # Safely get the mode status for root node based on time comparison
-        status_mode = ""
-        if time_comparison == "Week (Monday start)" and 'Week_Status' in group.columns and not group.empty:
-            mode_result = group['Week_Status'].mode()
-            if len(mode_result) > 0:
-                status_mode = mode_result[0]
-        elif time_comparison == "Month" and 'Month_Status' in group.columns and not group.empty:
-            mode_result = group['Month_Status'].mode()
-            if len(mode_result) > 0:
-                status_mode = mode_result[0]
-        elif 'Status' in group.columns and not group.empty:
-            mode_result = group['Status'].mode()
-            if len(mode_result) > 0:
-                status_mode = mode_result[0]
-        
-        # Resolve color for root node
-        root_level = 0
-        root_color_value = uniform_color
-        if color_mode == "By Level" and isinstance(level_colors, dict) and root_level in level_colors:
-            root_color_value = level_colors.get(root_level, uniform_color)
-        if isinstance(per_node_colors, dict) and (col, val_str) in per_node_colors:
-            root_color_value = per_node_colors[(col, val_str)]
-
-        root_node = {
-            "name": f"{col}: {val_str}",
-            "children": [],
-            "value": value,
-            "percentage": percentage,
-            "level": 0,
-            "column": col,
-            "node_value": val_str,
-            "tooltip_data": tooltip_data,
-            "color": root_color_value,
-            "raw_data": convert_pandas_to_json_serializable(group.to_dict('records'))
-        }
-        add_node(1, root_node, group)
-        if not root_node["children"]:
-            root_node.pop("children")
-        root_nodes.append(root_node)
+        tips = tips_by_level[level]
+        for tcol in tip_cols:
+            table, _, is_date = tip_tables[tcol]
+            if is_date:
+                tooltip_data[tcol] = _unique_csv(table[tips[tcol][run]])
+            else:
+                tooltip_data[tcol] = ", ".join(table[tips[tcol][run]].tolist())
+        color = node_colors.get((col, val_str), level_default_colors[level])
+        node = _make_node(col, val_str, level, value, total_count, tooltip_data, color)
+        nodes_by_key[key] = node
+        parent["children"].append(node)
+        owner[start:stop] = [key] * (stop - start)
+
+    # Each node only carries the rows its kept children don't, so every row is
+    # serialized once; the frontend gathers a node's rows from its whole subtree.
+    # Rows stay JSON text inside the payload and are only parsed when a node's data is opened.
+    # The rows are serialized once up front; each node only joins its rows' strings
+    own_leaves = {}
+    for i, key in enumerate(owner):
+        if key is not None:
+            own_leaves.setdefault(key, []).append(i)
+    # Rows no node carries (hidden or missing first-level values) are left to the caller's
+    # Root node, so only the owned rows are serialized here
+    row_owned = np.empty(len(df), dtype=bool)
+    row_owned[leaf_order] = np.repeat(np.array([key is not None for key in owner], dtype=bool), sizes.to_numpy())
+    if row_owned.all():
+        row_json = frame_to_row_json(df)
+    else:
+        row_json = np.empty(len(df), dtype=object)
+        if row_owned.any():
+            row_json[row_owned] = frame_to_row_json(df[row_owned])
+    for key, node in nodes_by_key.items():
+        if not key:
+            continue
+        if key in own_leaves:
+            leaves = own_leaves[key]
+            if len(leaves) == 1:
+                # A single group's positions are already ascending (stable argsort)
+                rows = leaf_order[leaf_bounds[leaves[0]]:leaf_bounds[leaves[0] + 1]]
+            else:
+                rows = np.sort(np.concatenate([leaf_order[leaf_bounds[i]:leaf_bounds[i + 1]] for i in leaves]))
+            node["raw_data"] = "[" + ",".join(row_json[rows]) + "]"
+        if not node["children"]:
+            node.pop("children")
     return root_nodes
 
+def format_dates(dates, fmt):
+    """strftime a date column, formatting each distinct date only once (missing dates stay NaN)"""
+    codes, uniques = pd.factorize(dates)
+    formatted = np.append(pd.DatetimeIndex(uniques).strftime(fmt).to_numpy(dtype=object), np.nan)
+    # Missing dates have code -1, which picks the trailing NaN. Stored as Arrow strings
+    # when available, like the text columns from load_excel
+    return pd.Series(formatted[codes], index=dates.index, dtype=ARROW_STRING_DTYPE)
+
+@st.cache_data(max_entries=8)
+def load_excel(file_bytes):
+    """Read the uploaded workbook, cached on its bytes, with the on-air dates parsed"""
+    df = pd.read_excel(io.BytesIO(file_bytes), engine=EXCEL_ENGINE)
+    # Excel date cells already arrive as datetime64; only text columns need parsing
+    for c in ('Planned_OnAir_Date', 'Actual_OnAir_Date'):
+        if c in df.columns and not pd.api.types.is_datetime64_any_dtype(df[c]):
+            df[c] = pd.to_datetime(df[c], errors='coerce')
+    # Pure-text columns take less memory and hash faster in groupby as Arrow strings
+    if ARROW_STRING_DTYPE is not None:
+        text_cols = [c for c in df.columns if df[c].dtype == object and pd.api.types.infer_dtype(df[c], skipna=True) == 'string']
+        if text_cols:
+            df = df.astype({c: ARROW_STRING_DTYPE for c in text_cols})
+    return df
+
+@st.cache_data(max_entries=8)
+def compute_tree_json(df, hierarchy, value_col, tooltip_cols, time_comparison, color_mode, uniform_color, level_colors, per_node_colors, display_filters):
+    """Build the tree and serialize it for the D3 component; returns (tree_data_json, rows_script, gzipped, error)"""
+    tree_data = build_tree(
+        df,
+        list(hierarchy),
+        value_col,
+        list(tooltip_cols),
+        time_comparison,
+        color_mode=color_mode,
+        uniform_color=uniform_color,
+        level_colors=level_colors,
+        per_node_colors=per_node_colors,
+        display_filters=display_filters
+    )
+    if tree_data and len(tree_data) > 0:
+        if len(tree_data) == 1:
+            d3_tree_data = tree_data[0]
+        else:
+            # Children already carry their rows; Root only keeps the rows no top-level node
+            # covers (missing or hidden first-level values), like every other node
+            codes, values = pd.factorize(df[hierarchy[0]], sort=True)
+            shown = {node["node_value"] for node in tree_data}
+            shown_codes = [i for i, v in enumerate(values) if str(v) in shown]
+            d3_tree_data = {
+                "name": "Root",
+                "children": tree_data,
+                "level": -1,
+                "value": sum(node.get("value", 0) for node in tree_data),
+                "tooltip_data": {},
+                "color": "#3B82F6",
+                "raw_data": frame_to_records_json(df[~np.isin(codes, shown_codes)])
+            }
+    else:
+        d3_tree_data = {"name": "No Data", "children": [], "level": 0, "value": 0, "tooltip_data": {}, "color": "#9CA3AF", "raw_data": []}
+
+    # Convert the entire tree data to JSON serializable format
+    error = None
+    rows_text = ""
+    try:
+        flat = flatten_tree(d3_tree_data)
+        rows_text = pack_raw_rows(flat)
+        tree_data_bytes = dumps_json(flat)
+    except Exception as e:
+        error = f"Error converting data to JSON: {str(e)}"
+        # Fallback to a simple structure without raw_data
+        d3_tree_data_simple = {
+            "name": d3_tree_data.get("name", "Error"),
+            "children": d3_tree_data.get("children", []),
+            "level": d3_tree_data.get("level", 0),
+            "value": d3_tree_data.get("value", 0),
+            "tooltip_data": d3_tree_data.get("tooltip_data", {}),
+            "color": d3_tree_data.get("color", "#9CA3AF"),
+            "raw_data": []
+        }
+        tree_data_bytes = dumps_json(flatten_tree(d3_tree_data_simple))
+
+    # Large payloads shrink several-fold gzipped, so the HTML sent on every rerun stays small.
+    # tree_data_json is the (flat tree, raw rows text) argument pair for inflateTree; the rows
+    # travel as plain text, either after a newline in the gzipped payload or in their own
+    # text/plain <script> element (rows_script)
+    rows_bytes = rows_text.encode('utf-8')
+    tree_data_gzipped = len(tree_data_bytes) + len(rows_bytes) >= TREE_JSON_GZIP_MIN_BYTES
+    if tree_data_gzipped:
+        payload = base64.b64encode(gzip.compress(tree_data_bytes + b'\n' + rows_bytes, compresslevel=6)).decode('ascii')
+        tree_data_json = f'...splitPayload(pako.ungzip(Uint8Array.from(atob("{payload}"), c => c.charCodeAt(0)), {{ to: "string" }}))'
+        rows_script = ''
+    else:
+        tree_data_json = tree_data_bytes.decode('utf-8') + ', document.getElementById("raw-rows").textContent'
+        rows_script = f'<script type="text/plain" id="raw-rows">{rows_text}</script>'
+    return tree_data_json, rows_script, tree_data_gzipped, error
+
 st.sidebar.header("🧩 Advanced Configuration")
 uploaded_file = st.file_uploader("Upload Excel File", type=["xlsx"])
 if uploaded_file:
-    df = pd.read_excel(uploaded_file)
+    df = load_excel(uploaded_file.getvalue())
     all_cols = df.columns.tolist()
     numeric_cols = df.select_dtypes(include='number').columns.tolist()
     
     # Time comparison fixed to Day (options removed)
     time_comparison = "Day"
     
-    # Add time-based columns to the dataframe
-    if 'Planned_OnAir_Date' in df.columns:
-        df['Planned_OnAir_Date'] = pd.to_datetime(df['Planned_OnAir_Date'], errors='coerce')
-        if time_comparison == "Week (Monday start)":
-            df['Planned_Week'] = df['Planned_OnAir_Date'].dt.strftime('%Y-W%U')
-            df['Planned_Week_Label'] = df['Planned_OnAir_Date'].dt.strftime('%Y-W%U (%b %d)')
-        elif time_comparison == "Month":
-            df['Planned_Month'] = df['Planned_OnAir_Date'].dt.strftime('%Y-%m')
-            df['Planned_Month_Label'] = df['Planned_OnAir_Date'].dt.strftime('%Y-%m (%B %Y)')
-    
-    if 'Actual_OnAir_Date' in df.columns:
-        df['Actual_OnAir_Date'] = pd.to_datetime(df['Actual_OnAir_Date'], errors='coerce')
+    # Add time-based columns to the dataframe; each label's leading characters are the period key
+    for prefix in ('Planned', 'Actual'):
+        date_col = f'{prefix}_OnAir_Date'
+        if date_col not in df.columns:
+            continue
         if time_comparison == "Week (Monday start)":
-            df['Actual_Week'] = df['Actual_OnAir_Date'].dt.strftime('%Y-W%U')
-            df['Actual_Week_Label'] = df['Actual_OnAir_Date'].dt.strftime('%Y-W%U (%b %d)')
+            labels = format_dates(df[date_col], '%Y-W%U (%b %d)')
+            df[f'{prefix}_Week'] = labels.str[:8]
+            df[f'{prefix}_Week_Label'] = labels
         elif time_comparison == "Month":
-            df['Actual_Month'] = df['Actual_OnAir_Date'].dt.strftime('%Y-%m')
-            df['Actual_Month_Label'] = df['Actual_OnAir_Date'].dt.strftime('%Y-%m (%B %Y)')
+            labels = format_dates(df[date_col], '%Y-%m (%B %Y)')
+            df[f'{prefix}_Month'] = labels.str[:7]
+            df[f'{prefix}_Month_Label'] = labels
     
     st.sidebar.header("🪜 Hierarchy Configuration")
     
@@ -408,12 +644,7 @@ if uploaded_file:
     display_filters = {}
     for col in hierarchy:
         try:
-            # Unique values as strings with No Data
-            raw_vals = df[col].astype(object).where(pd.notna(df[col]), None)
-            values = []
-            for v in raw_vals.astype(str).unique().tolist():
-                values.append("No Data" if v in ["None", "nan", "NaT"] else v)
-            values = sorted(set(values))
+            values = _display_values(df[col])
             selected = st.sidebar.multiselect(f"Show values for {col}", values, default=values)
             # Only store if user narrowed selection
             if set(selected) != set(values):
@@ -423,150 +654,20 @@ if uploaded_file:
     
     # Node style customization
     st.sidebar.header("🎨 Node Style Customization")
-    
-    # Node shape selection
-    node_shape = st.sidebar.selectbox(
-        "Node Shape:",
-        [
-            "Circle", "Square", "Rounded Rectangle", "Capsule", "Ellipse",
-            "Diamond", "Triangle", "Star", "Pentagon", "Hexagon", "Octagon",
-            "Chevron", "Parallelogram", "Teardrop", "Donut", "Cross", "Plus"
-        ],
-        help="Choose the shape for tree nodes. Different shapes can help distinguish node types or levels."
-    )
-    
-    # Node size customization
-    node_size = st.sidebar.slider(
-        "Node Size:",
-        min_value=8,
-        max_value=40,
-        value=17,
-        help="Adjust the size of all nodes in the tree"
-    )
-    
-    # Connection line customization
-    st.sidebar.header("🔗 Connection Line Settings")
-    line_width = st.sidebar.slider(
-        "Line Width:",
-        min_value=1,
-        max_value=8,
-        value=3,
-        help="Adjust the thickness of connection lines between nodes"
-    )
-    
-    # Line color: allow preset or custom selection
-    line_color_presets = {
-        "Default Gray": "#9CA3AF",
-        "Slate": "#64748B",
-        "Black": "#111827",
-        "Blue": "#3B82F6",
-        "Green": "#10B981",
-        "Amber": "#F59E0B",
-        "Red": "#EF4444",
-        "Violet": "#8B5CF6",
-        "Cyan": "#06B6D4"
-    }
+    # Selectors that decide which style widgets are shown stay outside the form, so switching
+    # them shows the matching widgets straight away
     line_color_source = st.sidebar.selectbox(
         "Line Color Source:",
         ["Preset", "Custom"],
         index=0,
         help="Use a preset color or pick a custom RGB/HEX"
     )
-    if line_color_source == "Preset":
-        chosen_line_preset = st.sidebar.selectbox("Line Color (preset):", list(line_color_presets.keys()), index=0)
-        line_color = line_color_presets[chosen_line_preset]
-    else:
-        line_color = st.sidebar.color_picker(
-            "Line Color:",
-            value="#9CA3AF",
-            help="Choose the color for connection lines"
-        )
-    
-    line_opacity = st.sidebar.slider(
-        "Line Opacity:",
-        min_value=0.1,
-        max_value=1.0,
-        value=0.7,
-        step=0.1,
-        help="Adjust the transparency of connection lines"
-    )
-    
-    # Font size customization
-    st.sidebar.header("📝 Label Font Settings")
-    font_size = st.sidebar.slider(
-        "Font Size:",
-        min_value=10,
-        max_value=20,
-        value=13,
-        help="Adjust the font size of node labels"
-    )
-    
-    font_weight = st.sidebar.selectbox(
-        "Font Weight:",
-        ["400", "500", "600", "700", "800"],
-        index=2,  # Default to 600
-        help="Choose the font weight for labels"
-    )
     font_color_source = st.sidebar.selectbox(
         "Font Color Source:",
         ["Preset", "Custom"],
         index=0,
         help="Use a preset color or pick a custom RGB/HEX"
     )
-    font_color_presets = {
-        "Default Black": "#111111",
-        "Slate": "#334155",
-        "Gray": "#374151",
-        "Blue": "#1F2937",
-        "White (for dark bg)": "#FFFFFF"
-    }
-    if font_color_source == "Preset":
-        chosen_font_preset = st.sidebar.selectbox("Font Color (preset):", list(font_color_presets.keys()), index=0)
-        font_color = font_color_presets[chosen_font_preset]
-    else:
-        font_color = st.sidebar.color_picker(
-            "Font Color:",
-            value="#111111",
-            help="Choose the color for label text"
-        )
-    font_style = st.sidebar.selectbox(
-        "Font Style:",
-        ["normal", "italic", "oblique"],
-        index=0,
-        help="Choose the font style for labels"
-    )
-    font_family = st.sidebar.selectbox(
-        "Font Family:",
-        [
-            "Calibri, Arial, sans-serif",
-            "Arial, Helvetica, sans-serif",
-            "Inter, system-ui, -apple-system, Segoe UI, Roboto, Ubuntu, Cantarell, Noto Sans, sans-serif",
-            "Georgia, serif",
-            "Times New Roman, Times, serif",
-            "Trebuchet MS, Lucida Sans Unicode, Lucida Grande, Lucida Sans, Arial, sans-serif",
-            "Tahoma, Geneva, Verdana, sans-serif",
-            "Courier New, Courier, monospace"
-        ],
-        index=0,
-        help="Choose the typeface / font family for labels"
-    )
-
-    # Label positioning to avoid overlap with node symbols
-    st.sidebar.header("🔤 Label Positioning")
-    label_position = st.sidebar.selectbox(
-        "Label Position:",
-        ["Top", "Bottom", "Left", "Right"],
-        index=0,
-        help="Position of label relative to node"
-    )
-    label_offset = st.sidebar.slider(
-        "Label Offset (px):",
-        min_value=0,
-        max_value=40,
-        value=10,
-        help="Gap between node and label"
-    )
-    
     # Presentation style
     style_theme = st.sidebar.selectbox(
         "Style theme",
@@ -574,29 +675,6 @@ if uploaded_file:
         index=0,
         help="Mind Map adds rounded outlines and presentation styling"
     )
-    show_group_outlines = False
-    group_outline_level = 0
-    minimal_labels = False
-    outline_opacity = 0.25
-    if style_theme == "Mind Map":
-        show_group_outlines = st.sidebar.checkbox("Show dashed group outlines", value=False)
-        group_outline_level = st.sidebar.slider(
-            "Group outline level",
-            min_value=0,
-            max_value=max(0, len(hierarchy) - 1),
-            value=min(2, max(0, len(hierarchy) - 1)),
-            help="Draw a rounded dashed box around each subtree at this depth"
-        )
-        minimal_labels = st.sidebar.checkbox("Minimal labels (name only)", value=False, help="Hide values/percentages on nodes for a clean look")
-        outline_opacity = st.sidebar.slider(
-            "Outline opacity",
-            min_value=0.10,
-            max_value=0.50,
-            value=0.25,
-            step=0.05,
-            help="Subtle outlines keep the style professional and minimalist"
-        )
-    
     # Label content mode
     label_display_mode = st.sidebar.selectbox(
         "Data label content",
@@ -611,6 +689,164 @@ if uploaded_file:
     else:
         label_mode_key = "value_percentage"
 
+    # The remaining styling widgets share one form, so adjusting them reruns the app once, on Apply
+    with st.sidebar.form("style_controls"):
+        # Node shape selection
+        node_shape = st.selectbox(
+            "Node Shape:",
+            [
+                "Circle", "Square", "Rounded Rectangle", "Capsule", "Ellipse",
+                "Diamond", "Triangle", "Star", "Pentagon", "Hexagon", "Octagon",
+                "Chevron", "Parallelogram", "Teardrop", "Donut", "Cross", "Plus"
+            ],
+            help="Choose the shape for tree nodes. Different shapes can help distinguish node types or levels."
+        )
+    
+        # Node size customization
+        node_size = st.slider(
+            "Node Size:",
+            min_value=8,
+            max_value=40,
+            value=17,
+            help="Adjust the size of all nodes in the tree"
+        )
+    
+        # Connection line customization
+        st.header("🔗 Connection Line Settings")
+        line_width = st.slider(
+            "Line Width:",
+            min_value=1,
+            max_value=8,
+            value=3,
+            help="Adjust the thickness of connection lines between nodes"
+        )
+    
+        # Line color: allow preset or custom selection
+        line_color_presets = {
+            "Default Gray": "#9CA3AF",
+            "Slate": "#64748B",
+            "Black": "#111827",
+            "Blue": "#3B82F6",
+            "Green": "#10B981",
+            "Amber": "#F59E0B",
+            "Red": "#EF4444",
+            "Violet": "#8B5CF6",
+            "Cyan": "#06B6D4"
+        }
+        if line_color_source == "Preset":
+            chosen_line_preset = st.selectbox("Line Color (preset):", list(line_color_presets.keys()), index=0)
+            line_color = line_color_presets[chosen_line_preset]
+        else:
+            line_color = st.color_picker(
+                "Line Color:",
+                value="#9CA3AF",
+                help="Choose the color for connection lines"
+            )
+    
+        line_opacity = st.slider(
+            "Line Opacity:",
+            min_value=0.1,
+            max_value=1.0,
+            value=0.7,
+            step=0.1,
+            help="Adjust the transparency of connection lines"
+        )
+    
+        # Font size customization
+        st.header("📝 Label Font Settings")
+        font_size = st.slider(
+            "Font Size:",
+            min_value=10,
+            max_value=20,
+            value=13,
+            help="Adjust the font size of node labels"
+        )
+    
+        font_weight = st.selectbox(
+            "Font Weight:",
+            ["400", "500", "600", "700", "800"],
+            index=2,  # Default to 600
+            help="Choose the font weight for labels"
+        )
+        font_color_presets = {
+            "Default Black": "#111111",
+            "Slate": "#334155",
+            "Gray": "#374151",
+            "Blue": "#1F2937",
+            "White (for dark bg)": "#FFFFFF"
+        }
+        if font_color_source == "Preset":
+            chosen_font_preset = st.selectbox("Font Color (preset):", list(font_color_presets.keys()), index=0)
+            font_color = font_color_presets[chosen_font_preset]
+        else:
+            font_color = st.color_picker(
+                "Font Color:",
+                value="#111111",
+                help="Choose the color for label text"
+            )
+        font_style = st.selectbox(
+            "Font Style:",
+            ["normal", "italic", "oblique"],
+            index=0,
+            help="Choose the font style for labels"
+        )
+        font_family = st.selectbox(
+            "Font Family:",
+            [
+                "Calibri, Arial, sans-serif",
+                "Arial, Helvetica, sans-serif",
+                "Inter, system-ui, -apple-system, Segoe UI, Roboto, Ubuntu, Cantarell, Noto Sans, sans-serif",
+                "Georgia, serif",
+                "Times New Roman, Times, serif",
+                "Trebuchet MS, Lucida Sans Unicode, Lucida Grande, Lucida Sans, Arial, sans-serif",
+                "Tahoma, Geneva, Verdana, sans-serif",
+                "Courier New, Courier, monospace"
+            ],
+            index=0,
+            help="Choose the typeface / font family for labels"
+        )
+
+        # Label positioning to avoid overlap with node symbols
+        st.header("🔤 Label Positioning")
+        label_position = st.selectbox(
+            "Label Position:",
+            ["Top", "Bottom", "Left", "Right"],
+            index=0,
+            help="Position of label relative to node"
+        )
+        label_offset = st.slider(
+            "Label Offset (px):",
+            min_value=0,
+            max_value=40,
+            value=10,
+            help="Gap between node and label"
+        )
+    
+        show_group_outlines = False
+        group_outline_level = 0
+        minimal_labels = False
+        outline_opacity = 0.25
+        if style_theme == "Mind Map":
+            show_group_outlines = st.checkbox("Show dashed group outlines", value=False)
+            group_outline_level = st.slider(
+                "Group outline level",
+                min_value=0,
+                max_value=max(0, len(hierarchy) - 1),
+                value=min(2, max(0, len(hierarchy) - 1)),
+                help="Draw a rounded dashed box around each subtree at this depth"
+            )
+            minimal_labels = st.checkbox("Minimal labels (name only)", value=False, help="Hide values/percentages on nodes for a clean look")
+            outline_opacity = st.slider(
+                "Outline opacity",
+                min_value=0.10,
+                max_value=0.50,
+                value=0.25,
+                step=0.05,
+                help="Subtle outlines keep the style professional and minimalist"
+            )
+    
+        st.form_submit_button("Apply style", use_container_width=True)
+
     # Node color configuration
     st.sidebar.header("🎨 Node Colors")
     color_mode = st.sidebar.selectbox(
@@ -686,16 +922,7 @@ if uploaded_file:
         per_node_colors = dict(st.session_state["per_node_ui_colors"])  # copy
         if hierarchy:
             selected_override_column = st.sidebar.selectbox("Override column", hierarchy)
-            unique_vals = (
-                df[selected_override_column]
-                .astype(object)
-                .where(pd.notna(df[selected_override_column]), None)
-            )
-            # Convert to strings with No Data for None/NaN
-            normalized_vals = []
-            for v in unique_vals.astype(str).unique().tolist():
-                normalized_vals.append("No Data" if v in ["None", "nan", "NaT"] else v)
-            normalized_vals = sorted(set(normalized_vals))
+            normalized_vals = _display_values(df[selected_override_column])
             st.sidebar.write("Set colors for each value:")
             for nval in normalized_vals:
                 key = f"color__{selected_override_column}__{nval}"
@@ -716,13 +943,16 @@ if uploaded_file:
         if per_node_file is not None:
             try:
                 per_df = pd.read_csv(per_node_file)
-                per_node_colors = {}
-                for _, row in per_df.iterrows():
-                    colname = str(row.get("column", "")).strip()
-                    nval = str(row.get("node_value", "")).strip()
-                    colhex = str(row.get("color", "")).strip()
-                    if colname and nval and colhex:
-                        per_node_colors[(colname, nval)] = colhex
+                # Whole-column string ops instead of iterrows; missing columns and cells count as blank
+                fields = {
+                    c: per_df[c].fillna("").astype(str).str.strip() if c in per_df.columns else pd.Series("", index=per_df.index)
+                    for c in ("column", "node_value", "color")
+                }
+                keep = (fields["column"] != "") & (fields["node_value"] != "") & (fields["color"] != "")
+                per_node_colors = dict(zip(
+                    zip(fields["column"][keep], fields["node_value"][keep]),
+                    fields["color"][keep]
+                ))
             except Exception as e:
                 st.sidebar.error(f"Failed to parse per-node color CSV: {e}")
 
@@ -734,16 +964,19 @@ if uploaded_file:
         index=0
     )
     enable_drag_reorder = st.sidebar.checkbox("Enable drag & drop reorder", True)
+    render_mode = st.sidebar.selectbox(
+        "Tree renderer",
+        ["Auto", "SVG", "Canvas"],
+        index=0,
+        help=f"Canvas keeps large trees responsive; Auto uses it above {CANVAS_NODE_THRESHOLD:,} nodes. Drag & drop reorder is only available with SVG."
+    )
     
     agg_method = st.sidebar.selectbox("Aggregation method", ["Count", "Sum", "Average"])
+    # Count leaves value_col unset (build_tree counts rows); Sum/Average pass the source column,
+    # which build_tree coerces itself, so the uploaded frame isn't modified
     value_col = None
-    if agg_method == "Count":
-        df["__value__"] = 1
-        value_col = "__value__"
-    elif agg_method in ["Sum", "Average"]:
+    if agg_method in ["Sum", "Average"]:
         value_col = st.sidebar.selectbox("Select value column", numeric_cols if numeric_cols else all_cols, index=0)
-        df["__value__"] = pd.to_numeric(df[value_col], errors="coerce").fillna(0)
-        value_col = "__value__"
 
     # KPI panel removed
 
@@ -772,61 +1005,34 @@ if uploaded_file:
         else:
             updated_hierarchy.append(col)
     
-    tree_data = build_tree(
+    tree_data_json, raw_rows_script, tree_data_gzipped, tree_json_error = compute_tree_json(
         df,
-        updated_hierarchy,
+        tuple(updated_hierarchy),
         value_col,
-        tooltip_cols,
+        tuple(tooltip_cols),
         time_comparison,
-        color_mode=color_mode,
-        uniform_color=uniform_node_color,
-        level_colors=level_colors,
-        per_node_colors=per_node_colors,
-        display_filters=display_filters
+        color_mode,
+        uniform_node_color,
+        level_colors,
+        per_node_colors,
+        display_filters
     )
-    if tree_data and len(tree_data) > 0:
-        if len(tree_data) == 1:
-            d3_tree_data = tree_data[0]
-        else:
-            d3_tree_data = {
-                "name": "Root",
-                "children": tree_data,
-                "level": -1,
-                "value": sum(node.get("value", 0) for node in tree_data),
-                "tooltip_data": {},
-                "color": "#3B82F6",
-                "raw_data": convert_pandas_to_json_serializable(df.to_dict('records'))
-            }
-    else:
-        d3_tree_data = {"name": "No Data", "children": [], "level": 0, "value": 0, "tooltip_data": {}, "color": "#9CA3AF", "raw_data": []}
-
-    # Convert the entire tree data to JSON serializable format
-    try:
-        d3_tree_data_serializable = convert_pandas_to_json_serializable(d3_tree_data)
-        tree_data_json = json.dumps(d3_tree_data_serializable, ensure_ascii=False).replace('</', r'<\/')
-    except Exception as e:
-        st.error(f"Error converting data to JSON: {str(e)}")
-        # Fallback to a simple structure without raw_data
-        d3_tree_data_simple = {
-            "name": d3_tree_data.get("name", "Error"),
-            "children": d3_tree_data.get("children", []),
-            "level": d3_tree_data.get("level", 0),
-            "value": d3_tree_data.get("value", 0),
-            "tooltip_data": d3_tree_data.get("tooltip_data", {}),
-            "color": d3_tree_data.get("color", "#9CA3AF"),
-            "raw_data": []
-        }
-        tree_data_json = json.dumps(d3_tree_data_simple, ensure_ascii=False).replace('</', r'<\/')
+    if tree_json_error:
+        st.error(tree_json_error)
+    pako_script = '<script src="https://cdn.jsdelivr.net/npm/pako@2.1.0/dist/pako_inflate.min.js"></script>' if tree_data_gzipped else ''
 
     # Export quality settings
     st.sidebar.header("🖼️ Export Settings")
-    export_png_scale = st.sidebar.slider(
+    export_png_scale = st.sidebar.select_slider(
         "PNG export quality (scale)",
-        min_value=1,
-        max_value=6,
-        value=3,
-        help="Increase for sharper images (and larger files)"
+        options=["Auto", 1, 2, 3, 4, 5, 6],
+        value="Auto",
+        help="Increase for sharper images (and larger files). Auto uses 3 on standard screens "
+             "and 2 on high-density ones, which already render exports crisply"
     )
+    # Auto is resolved in the browser, where the device pixel ratio is known
+    if export_png_scale == "Auto":
+        export_png_scale = "Math.max(2, Math.min(3, 3 / (window.devicePixelRatio || 1)))"
 
     d3_html = f"""
     <!DOCTYPE html>
@@ -834,6 +1040,8 @@ if uploaded_file:
     <head>
       <meta charset="utf-8">
       <script src="https://d3js.org/d3.v7.min.js"></script>
+      {pako_script}
+      {raw_rows_script}
       <script>
         // Node shape and size configuration
         const nodeShape = "{node_shape}";
@@ -866,41 +1074,64 @@ if uploaded_file:
         const enableDragReorder = {str(enable_drag_reorder).lower()};
         let manualOrder = false;
         let dragActive = false;
+        // Whether the current drag moved the node at all (a plain click also ends a drag)
+        let dragMoved = false;
 
         // Label display mode from sidebar
         const labelMode = "{label_mode_key}"; // value_only | percentage_only | value_percentage
-        // Export quality scale from sidebar
+        // Export quality scale from sidebar (Auto: fewer oversampled pixels on HiDPI screens)
         const exportScale = {export_png_scale};
+        // Interactive renderer: Auto | SVG | Canvas
+        const renderMode = "{render_mode}";
+        const canvasNodeThreshold = {CANVAS_NODE_THRESHOLD};
 
         // Helpers
+        // Coordinates written into SVG markup are rounded to 2 decimals; more is invisible
+        // and only inflates the markup (and floats like 6.1e-16 from cos/sin)
+        function fmt(v) {{
+          return +v.toFixed(2);
+        }}
+
         function roundedRectPath(x, y, width, height, radius) {{
-          const r = Math.min(radius, width / 2, height / 2);
-          return "M " + (x + r) + "," + y
-               + " H " + (x + width - r)
-               + " A " + r + "," + r + " 0 0 1 " + (x + width) + "," + (y + r)
-               + " V " + (y + height - r)
-               + " A " + r + "," + r + " 0 0 1 " + (x + width - r) + "," + (y + height)
-               + " H " + (x + r)
-               + " A " + r + "," + r + " 0 0 1 " + x + "," + (y + height - r)
-               + " V " + (y + r)
-               + " A " + r + "," + r + " 0 0 1 " + (x + r) + "," + y
+          const r = fmt(Math.min(radius, width / 2, height / 2));
+          x = fmt(x);
+          y = fmt(y);
+          return "M " + fmt(x + r) + "," + y
+               + " H " + fmt(x + width - r)
+               + " A " + r + "," + r + " 0 0 1 " + fmt(x + width) + "," + fmt(y + r)
+               + " V " + fmt(y + height - r)
+               + " A " + r + "," + r + " 0 0 1 " + fmt(x + width - r) + "," + fmt(y + height)
+               + " H " + fmt(x + r)
+               + " A " + r + "," + r + " 0 0 1 " + x + "," + fmt(y + height - r)
+               + " V " + fmt(y + r)
+               + " A " + r + "," + r + " 0 0 1 " + fmt(x + r) + "," + y
                + " Z";
         }}
 
+        // Label text depends only on the node's data and fixed settings, so it is built once
+        // per data object and shared by the live tree, the canvas frames and every export
         function formatLabel(d) {{
-          const name = d.data.name || "";
-          const hasValue = d.data.value !== undefined && d.data.value !== null;
-          const hasPct = d.data.percentage !== undefined && d.data.percentage !== null;
+          let label = d.data.__label;
+          if (label === undefined) {{
+            label = d.data.__label = buildLabel(d.data);
+          }}
+          return label;
+        }}
+
+        function buildLabel(data) {{
+          const name = data.name || "";
+          const hasValue = data.value !== undefined && data.value !== null;
+          const hasPct = data.percentage !== undefined && data.percentage !== null;
           if (styleMode === "Mind Map" && minimalLabels) {{
             return name;
           }}
           if (labelMode === "value_only") {{
-            return hasValue ? `${{name}} (${{d.data.value}})` : name;
+            return hasValue ? `${{name}} (${{data.value}})` : name;
           }} else if (labelMode === "percentage_only") {{
-            return hasPct ? `${{name}} (${{d.data.percentage}}%)` : name;
+            return hasPct ? `${{name}} (${{data.percentage}}%)` : name;
           }}
           // default value + percentage
-          return hasValue && hasPct ? `${{name}} (${{d.data.value}}, ${{d.data.percentage}}%)` : name;
+          return hasValue && hasPct ? `${{name}} (${{data.value}}, ${{data.percentage}}%)` : name;
         }}
 
         // Compute label x/y/anchor based on position and offsets
@@ -916,100 +1147,106 @@ if uploaded_file:
           return {{ x: (nodeSize + labelOffset), y: 4, anchor: 'start' }};
         }}
 
-        function compareNodes(a, b) {{
-          const nameA = (a.data.name || "").toString().toLowerCase();
-          const nameB = (b.data.name || "").toString().toLowerCase();
-          const valA = (a.data.value || 0);
-          const valB = (b.data.value || 0);
-          if (orderMode === "Name A→Z") return nameA.localeCompare(nameB);
-          if (orderMode === "Name Z→A") return nameB.localeCompare(nameA);
-          if (orderMode === "Value Asc") return valA - valB;
-          if (orderMode === "Value Desc") return valB - valA;
-          return 0; // Custom (as-is)
+        // Sibling comparator for the selected initial sort, chosen once (null = Custom, as-is)
+        const sortName = d => (d.data.name || "").toString().toLowerCase();
+        const sortValue = d => (d.data.value || 0);
+        const compareNodes = {{
+          "Name A→Z": (a, b) => sortName(a).localeCompare(sortName(b)),
+          "Name Z→A": (a, b) => sortName(b).localeCompare(sortName(a)),
+          "Value Asc": (a, b) => sortValue(a) - sortValue(b),
+          "Value Desc": (a, b) => sortValue(b) - sortValue(a)
+        }}[orderMode] || null;
+
+        // One offscreen 2D context measures all text on the page, set to the requested font
+        // only when it differs from the last one used
+        // (tracked here, since ctx.font reads back a normalized string)
+        let textMeasureCtx = null;
+        let textMeasureFont = null;
+        function measureText(text, font) {{
+          if (!textMeasureCtx) textMeasureCtx = document.createElement('canvas').getContext('2d');
+          if (font !== textMeasureFont) {{
+            textMeasureCtx.font = font;
+            textMeasureFont = font;
+          }}
+          return textMeasureCtx.measureText(text);
         }}
 
-        // Compute bounds for a node including label in current configuration
-        function getNodeBounds(d, textWidth) {{
-          const halfText = textWidth / 2;
-          let top = d.x - (nodeSize + 8);
-          let bottom = d.x + (nodeSize + 8);
-          let left = d.y - Math.max(halfText, nodeSize);
-          let right = d.y + Math.max(halfText, nodeSize);
-          switch (labelPosition) {{
-            case 'top':
-              top = Math.min(top, d.x - (nodeSize + labelOffset + fontSize));
-              break;
-            case 'bottom':
-              bottom = Math.max(bottom, d.x + (nodeSize + labelOffset + fontSize));
-              break;
-            case 'left':
-              left = Math.min(left, d.y - (nodeSize + labelOffset + textWidth));
-              break;
-            case 'right':
-            default:
-              right = Math.max(right, d.y + (nodeSize + labelOffset + textWidth));
-              break;
+        // Width of a label in the export font (the export <text> font, italic/oblique
+        // included). Labels already measured by an earlier export are not measured again.
+        const exportLabelFont = fontStyle + ' ' + fontWeight + ' ' + fontSize + 'px Calibri, Arial, sans-serif';
+        const labelWidths = new Map();
+        function measureLabel(label) {{
+          let w = labelWidths.get(label);
+          if (w === undefined) {{
+            w = measureText(label, exportLabelFont).width;
+            labelWidths.set(label, w);
           }}
-          return {{ top, bottom, left, right }};
+          return w;
         }}
 
+        // _children is every node's complete child list, and an expanded node's children is
+        // the same array, so each sibling list is sorted exactly once by following _children
         function sortArray(arr) {{
           if (!arr) return;
           arr.sort(compareNodes);
-          arr.forEach(child => {{
-            if (child.children) sortArray(child.children);
-            if (child._children) sortArray(child._children);
-          }});
+          arr.forEach(child => sortArray(child._children));
         }}
 
         function applyInitialSort(root) {{
-          if (orderMode === "Custom (as-is)" || manualOrder) return;
-          sortArray(root.children);
+          // Custom order: nothing to sort, so the tree is not walked at all
+          if (!compareNodes || manualOrder) return;
           sortArray(root._children);
         }}
         
         // Preserve manual drag order for exports of the complete tree
         function buildOrderMapFromCurrent(rootNode) {{
           const orderMap = new Map();
-          function dfs(node, path) {{
-            const key = path.join('>');
+          // Keys are the '>'-joined names from the root, extended one name per level
+          function dfs(node, key) {{
             const container = node.children ? node.children : node._children;
             if (container && container.length) {{
               orderMap.set(key, container.map(ch => ch.data && ch.data.name ? ch.data.name : ''));
-              container.forEach(ch => dfs(ch, path.concat(ch.data && ch.data.name ? ch.data.name : '')));
+              container.forEach(ch => dfs(ch, key + '>' + (ch.data && ch.data.name ? ch.data.name : '')));
             }}
           }}
-          dfs(rootNode, [rootNode.data && rootNode.data.name ? rootNode.data.name : 'root']);
+          dfs(rootNode, rootNode.data && rootNode.data.name ? rootNode.data.name : 'root');
           return orderMap;
         }}
 
         function reorderExportRoot(exportRootNode, orderMap) {{
-          function reorder(node, path) {{
-            const key = path.join('>');
+          function reorder(node, key) {{
             const desired = orderMap.get(key);
             if (desired && node.children && node.children.length) {{
-              node.children.sort((a, b) => {{
-                const ai = desired.indexOf(a.data && a.data.name ? a.data.name : '');
-                const bi = desired.indexOf(b.data && b.data.name ? b.data.name : '');
-                const aIdx = ai === -1 ? Number.MAX_SAFE_INTEGER : ai;
-                const bIdx = bi === -1 ? Number.MAX_SAFE_INTEGER : bi;
-                return aIdx - bIdx;
-              }});
+              // Position lookup by name instead of an indexOf scan inside the comparator
+              const position = new Map();
+              desired.forEach((name, i) => {{ if (!position.has(name)) position.set(name, i); }});
+              const rank = n => {{
+                const i = position.get(n.data && n.data.name ? n.data.name : '');
+                return i === undefined ? Number.MAX_SAFE_INTEGER : i;
+              }};
+              node.children.sort((a, b) => rank(a) - rank(b));
             }}
             if (node.children) {{
-              node.children.forEach(ch => reorder(ch, path.concat(ch.data && ch.data.name ? ch.data.name : '')));
+              node.children.forEach(ch => reorder(ch, key + '>' + (ch.data && ch.data.name ? ch.data.name : '')));
             }}
           }}
-          reorder(exportRootNode, [exportRootNode.data && exportRootNode.data.name ? exportRootNode.data.name : 'root']);
+          reorder(exportRootNode, exportRootNode.data && exportRootNode.data.name ? exportRootNode.data.name : 'root');
+        }}
+        
+        // Node colours are resolved server-side (color mode, level and per-node overrides);
+        // nodes without one fall back to a neutral grey
+        const defaultNodeFill = "#CBD5E1";
+        function nodeFill(d) {{
+          return d.data.color || defaultNodeFill;
         }}
         
         // Node shape functions
-        function createNodeShape(selection, size) {{
+        function buildNodeShape(selection, size) {{
           switch(nodeShape) {{
             case "Circle":
               selection.append("circle")
                 .attr("r", size)
-                .attr("fill", d => d.data.color || "#CBD5E1")
+                .attr("fill", nodeFill)
                 .attr("stroke", "#fff")
                 .attr("stroke-width", 3);
               break;
@@ -1019,7 +1256,7 @@ if uploaded_file:
                 .attr("height", size * 2)
                 .attr("x", -size)
                 .attr("y", -size)
-                .attr("fill", d => d.data.color || "#CBD5E1")
+                .attr("fill", nodeFill)
                 .attr("stroke", "#fff")
                 .attr("stroke-width", 3)
                 .attr("rx", 2);
@@ -1030,7 +1267,7 @@ if uploaded_file:
                 .attr("height", size * 1.6)
                 .attr("x", -(size * 1.2))
                 .attr("y", -(size * 0.8))
-                .attr("fill", d => d.data.color || "#CBD5E1")
+                .attr("fill", nodeFill)
                 .attr("stroke", "#fff")
                 .attr("stroke-width", 3)
                 .attr("rx", size * 0.5)
@@ -1042,7 +1279,7 @@ if uploaded_file:
                 .attr("height", size * 1.4)
                 .attr("x", -(size * 1.5))
                 .attr("y", -(size * 0.7))
-                .attr("fill", d => d.data.color || "#CBD5E1")
+                .attr("fill", nodeFill)
                 .attr("stroke", "#fff")
                 .attr("stroke-width", 3)
                 .attr("rx", size * 0.7)
@@ -1052,7 +1289,7 @@ if uploaded_file:
               selection.append("ellipse")
                 .attr("rx", size * 1.2)
                 .attr("ry", size * 0.8)
-                .attr("fill", d => d.data.color || "#CBD5E1")
+                .attr("fill", nodeFill)
                 .attr("stroke", "#fff")
                 .attr("stroke-width", 3);
               break;
@@ -1062,7 +1299,7 @@ if uploaded_file:
                   const s = size;
                   return `0,-${{s}} ${{s}},0 0,${{s}} -${{s}},0`;
                 }})
-                .attr("fill", d => d.data.color || "#CBD5E1")
+                .attr("fill", nodeFill)
                 .attr("stroke", "#fff")
                 .attr("stroke-width", 3);
               break;
@@ -1072,7 +1309,7 @@ if uploaded_file:
                   const s = size;
                   return `0,-${{s}} -${{s}},${{s}} ${{s}},${{s}}`;
                 }})
-                .attr("fill", d => d.data.color || "#CBD5E1")
+                .attr("fill", nodeFill)
                 .attr("stroke", "#fff")
                 .attr("stroke-width", 3);
               break;
@@ -1084,11 +1321,11 @@ if uploaded_file:
                   for (let i = 0; i < 10; i++) {{
                     const angle = (i * Math.PI) / 5;
                     const r = i % 2 === 0 ? s : s * 0.5;
-                    points.push(`${{Math.cos(angle) * r}},${{Math.sin(angle) * r}}`);
+                    points.push(`${{fmt(Math.cos(angle) * r)}},${{fmt(Math.sin(angle) * r)}}`);
                   }}
                   return `M ${{points.join(' L ')}} Z`;
                 }})
-                .attr("fill", d => d.data.color || "#CBD5E1")
+                .attr("fill", nodeFill)
                 .attr("stroke", "#fff")
                 .attr("stroke-width", 3);
               break;
@@ -1099,11 +1336,11 @@ if uploaded_file:
                   const pts = [];
                   for (let i = 0; i < 5; i++) {{
                     const angle = -Math.PI / 2 + (i * 2 * Math.PI / 5);
-                    pts.push(`${{Math.cos(angle) * s}},${{Math.sin(angle) * s}}`);
+                    pts.push(`${{fmt(Math.cos(angle) * s)}},${{fmt(Math.sin(angle) * s)}}`);
                   }}
                   return pts.join(' ');
                 }})
-                .attr("fill", d => d.data.color || "#CBD5E1")
+                .attr("fill", nodeFill)
                 .attr("stroke", "#fff")
                 .attr("stroke-width", 3);
               break;
@@ -1114,11 +1351,11 @@ if uploaded_file:
                   const points = [];
                   for (let i = 0; i < 6; i++) {{
                     const angle = (i * Math.PI) / 3;
-                    points.push(`${{Math.cos(angle) * s}},${{Math.sin(angle) * s}}`);
+                    points.push(`${{fmt(Math.cos(angle) * s)}},${{fmt(Math.sin(angle) * s)}}`);
                   }}
                   return points.join(' ');
                 }})
-                .attr("fill", d => d.data.color || "#CBD5E1")
+                .attr("fill", nodeFill)
                 .attr("stroke", "#fff")
                 .attr("stroke-width", 3);
               break;
@@ -1129,11 +1366,11 @@ if uploaded_file:
                   const pts = [];
                   for (let i = 0; i < 8; i++) {{
                     const angle = -Math.PI / 8 + (i * 2 * Math.PI / 8);
-                    pts.push(`${{Math.cos(angle) * s}},${{Math.sin(angle) * s}}`);
+                    pts.push(`${{fmt(Math.cos(angle) * s)}},${{fmt(Math.sin(angle) * s)}}`);
                   }}
                   return pts.join(' ');
                 }})
-                .attr("fill", d => d.data.color || "#CBD5E1")
+                .attr("fill", nodeFill)
                 .attr("stroke", "#fff")
                 .attr("stroke-width", 3);
               break;
@@ -1147,7 +1384,7 @@ if uploaded_file:
                   ];
                   return coords.map(c => c[0] + "," + c[1]).join(' ');
                 }})
-                .attr("fill", d => d.data.color || "#CBD5E1")
+                .attr("fill", nodeFill)
                 .attr("stroke", "#fff")
                 .attr("stroke-width", 3);
               break;
@@ -1161,7 +1398,7 @@ if uploaded_file:
                   ];
                   return coords.map(c => c[0] + "," + c[1]).join(' ');
                 }})
-                .attr("fill", d => d.data.color || "#CBD5E1")
+                .attr("fill", nodeFill)
                 .attr("stroke", "#fff")
                 .attr("stroke-width", 3);
               break;
@@ -1172,7 +1409,7 @@ if uploaded_file:
                   const rx = s * 0.9, ry = s * 0.9;
                   return "M 0,-" + ry + " A " + rx + "," + ry + " 0 1,1 0," + ry + " L 0," + (s * 1.6) + " Z";
                 }})
-                .attr("fill", d => d.data.color || "#CBD5E1")
+                .attr("fill", nodeFill)
                 .attr("stroke", "#fff")
                 .attr("stroke-width", 3);
               break;
@@ -1184,7 +1421,7 @@ if uploaded_file:
                 .attr("class", "donut-ring")
                 .attr("r", donutRadius)
                 .attr("fill", "none")
-                .style("stroke", d => d.data.color || "#CBD5E1")
+                .style("stroke", nodeFill)
                 .style("stroke-width", donutThickness)
                 .style("stroke-linecap", "round")
                 .style("stroke-linejoin", "round");
@@ -1194,13 +1431,14 @@ if uploaded_file:
                 .each(function(d) {{
                   const g = d3.select(this);
                   const s = size;
+                  const fill = nodeFill(d);
                   // Vertical line
                   g.append("rect")
                     .attr("x", -2)
                     .attr("y", -s)
                     .attr("width", 4)
                     .attr("height", s * 2)
-                    .attr("fill", d.data.color || "#CBD5E1")
+                    .attr("fill", fill)
                     .attr("stroke", "#fff")
                     .attr("stroke-width", 3);
                   // Horizontal line
@@ -1209,7 +1447,7 @@ if uploaded_file:
                     .attr("y", -2)
                     .attr("width", s * 2)
                     .attr("height", 4)
-                    .attr("fill", d.data.color || "#CBD5E1")
+                    .attr("fill", fill)
                     .attr("stroke", "#fff")
                     .attr("stroke-width", 3);
                 }});
@@ -1219,13 +1457,14 @@ if uploaded_file:
                 .each(function(d) {{
                   const g = d3.select(this);
                   const s = size;
+                  const fill = nodeFill(d);
                   // Vertical line
                   g.append("rect")
                     .attr("x", -2)
                     .attr("y", -s)
                     .attr("width", 4)
                     .attr("height", s * 2)
-                    .attr("fill", d.data.color || "#CBD5E1")
+                    .attr("fill", fill)
                     .attr("stroke", "#fff")
                     .attr("stroke-width", 3);
                   // Horizontal line
@@ -1234,7 +1473,7 @@ if uploaded_file:
                     .attr("y", -2)
                     .attr("width", s * 2)
                     .attr("height", 4)
-                    .attr("fill", d.data.color || "#CBD5E1")
+                    .attr("fill", fill)
                     .attr("stroke", "#fff")
                     .attr("stroke-width", 3);
                 }});
@@ -1242,26 +1481,163 @@ if uploaded_file:
             default:
               selection.append("circle")
                 .attr("r", size)
-                .attr("fill", d => d.data.color || "#CBD5E1")
+                .attr("fill", nodeFill)
                 .attr("stroke", "#fff")
                 .attr("stroke-width", 3);
           }}
         }}
-      </script>
-      <style>
-      .node circle {{ stroke: #fff; stroke-width: 3px; filter: drop-shadow(0 2px 4px rgba(0,0,0,0.10)); }}
-      .node text {{ font-family: {font_family}; font-size: {font_size}px; font-weight: {font_weight}; fill: {font_color}; font-style: {font_style}; }}
-      .link {{ fill: none; stroke: {line_color}; stroke-width: {line_width}px; stroke-opacity: {line_opacity}; }}
-      .tooltip {{
-        position: absolute; background: #1e293b; color: #fff;
-        padding: 12px 16px; border-radius: 8px; font-size: 13px; font-family: Calibri, Arial, sans-serif;
-        pointer-events: none; z-index: 1000; max-width: 320px; line-height: 1.5; box-shadow: 0 8px 32px rgba(0,0,0,0.10);
-      }}
-      .region-outline {{
-        fill: none; stroke: #94A3B8; stroke-width: 2.5px; stroke-dasharray: 8 6;
-      }}
-      .controls {{
-        position: absolute; top: 10px; left: 10px; z-index: 1001;
+
+        // Each shape is built once per size with D3 and then cloned per node, so a node
+        // costs one cloneNode/appendChild and only its fill is written individually
+        const nodeShapeTemplates = new Map();
+        function nodeShapeTemplate(size) {{
+          let template = nodeShapeTemplates.get(size);
+          if (!template) {{
+            const holder = d3.create("svg:g").datum({{ data: {{}} }});
+            buildNodeShape(holder, size);
+            template = holder.node().firstChild;
+            nodeShapeTemplates.set(size, template);
+          }}
+          return template;
+        }}
+
+        // A copy of the size's shape template painted with the node's fill
+        function nodeShapeElement(d, size) {{
+          const shape = nodeShapeTemplate(size).cloneNode(true);
+          const fill = nodeFill(d);
+          if (nodeShape === "Donut") {{
+            shape.style.stroke = fill;
+          }} else if (shape.tagName === "g") {{
+            for (const part of shape.children) part.setAttribute("fill", fill);
+          }} else {{
+            shape.setAttribute("fill", fill);
+          }}
+          return shape;
+        }}
+
+        // Entering node groups are cloned from a template that already carries the class and
+        // the static label attributes; each clone only gets its shape, label text and transform
+        function nodeGroupTemplate(label) {{
+          const group = d3.create("svg:g").attr("class", "node");
+          group.append("text")
+            .attr('x', label.x)
+            .attr('y', label.y)
+            .attr('text-anchor', label.anchor);
+          return group.node();
+        }}
+
+        function nodeGroupElement(d, template, size) {{
+          const group = template.cloneNode(true);
+          const shape = nodeShapeElement(d, size);
+          const text = group.lastChild;
+          // Carry the node datum like selection.append does (Cross/Plus nest a <g>)
+          shape.__data__ = d;
+          text.__data__ = d;
+          text.textContent = formatLabel(d);
+          group.insertBefore(shape, text);
+          return group;
+        }}
+
+        // Exports define the shape once per distinct fill in <defs> and reference it from
+        // each node with <use>, instead of repeating the full shape markup per node.
+        // shapeId maps a node to its definition's id; markup() returns the definitions.
+        function nodeShapeDefs(size) {{
+          const shapeIds = new Map();
+          const defs = [];
+          return {{
+            shapeId: d => {{
+              const fill = nodeFill(d);
+              let id = shapeIds.get(fill);
+              if (id === undefined) {{
+                id = "node-shape-" + shapeIds.size;
+                shapeIds.set(fill, id);
+                defs.push(`<g id="${{id}}">${{nodeShapeElement(d, size).outerHTML}}</g>`);
+              }}
+              return id;
+            }},
+            markup: () => defs.join('')
+          }};
+        }}
+
+        // Export markup: text escaped for XML
+        function escapeXml(text) {{
+          return String(text).replace(/[&<>"]/g, c => ({{ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;' }})[c]);
+        }}
+
+        // d3.linkHorizontal geometry (x is vertical, y horizontal) at export precision
+        function exportLinkPath(source, target) {{
+          const sx = fmt(source.x), sy = fmt(source.y), tx = fmt(target.x), ty = fmt(target.y);
+          const my = fmt((source.y + target.y) / 2);
+          return "M" + sy + "," + sx + "C" + my + "," + sx + " " + my + "," + tx + " " + ty + "," + tx;
+        }}
+
+        // SVG path data of the node shape centred on 0,0 (same geometry as createNodeShape), for Path2D on canvas
+        function nodeShapePathData(size) {{
+          const s = size;
+          const poly = pts => "M " + pts.map(p => p[0] + "," + p[1]).join(" L ") + " Z";
+          const regular = (n, offset) => poly(d3.range(n).map(i => {{
+            const angle = offset + (i * 2 * Math.PI / n);
+            return [Math.cos(angle) * s, Math.sin(angle) * s];
+          }}));
+          const ellipse = (rx, ry) => `M ${{-rx}},0 A ${{rx}},${{ry}} 0 1,0 ${{rx}},0 A ${{rx}},${{ry}} 0 1,0 ${{-rx}},0 Z`;
+          switch(nodeShape) {{
+            case "Square": return roundedRectPath(-s, -s, s * 2, s * 2, 2);
+            case "Rounded Rectangle": return roundedRectPath(-(s * 1.2), -(s * 0.8), s * 2.4, s * 1.6, s * 0.5);
+            case "Capsule": return roundedRectPath(-(s * 1.5), -(s * 0.7), s * 3.0, s * 1.4, s * 0.7);
+            case "Ellipse": return ellipse(s * 1.2, s * 0.8);
+            case "Diamond": return poly([[0, -s], [s, 0], [0, s], [-s, 0]]);
+            case "Triangle": return poly([[0, -s], [-s, s], [s, s]]);
+            case "Star": return poly(d3.range(10).map(i => {{
+              const angle = (i * Math.PI) / 5;
+              const r = i % 2 === 0 ? s : s * 0.5;
+              return [Math.cos(angle) * r, Math.sin(angle) * r];
+            }}));
+            case "Pentagon": return regular(5, -Math.PI / 2);
+            case "Hexagon": return regular(6, 0);
+            case "Octagon": return regular(8, -Math.PI / 8);
+            case "Chevron": {{
+              const w = s * 2.2, h = s * 1.6;
+              return poly([[-w/2, -h/2], [0, 0], [-w/2, h/2], [w/2, h/2], [0, 0], [w/2, -h/2]]);
+            }}
+            case "Parallelogram": {{
+              const w = s * 2.4, h = s * 1.6, skew = s * 0.6;
+              return poly([[-(w/2 + skew), -h/2], [w/2 + skew, -h/2], [w/2 - skew, h/2], [-(w/2 - skew), h/2]]);
+            }}
+            case "Teardrop": {{
+              const r = s * 0.9;
+              return "M 0,-" + r + " A " + r + "," + r + " 0 1,1 0," + r + " L 0," + (s * 1.6) + " Z";
+            }}
+            case "Donut": {{
+              const donutThickness = Math.max(4, s * 0.35);
+              const donutRadius = Math.max(4, s - donutThickness / 2);
+              return ellipse(donutRadius, donutRadius);
+            }}
+            case "Cross":
+            case "Plus":
+              return poly([[-2, -s], [2, -s], [2, s], [-2, s]]) + " " + poly([[-s, -2], [s, -2], [s, 2], [-s, 2]]);
+            default:
+              return ellipse(s, s);
+          }}
+        }}
+      </script>
+      <style>
+      .node circle {{ stroke: #fff; stroke-width: 3px; filter: drop-shadow(0 2px 4px rgba(0,0,0,0.10)); }}
+      /* While zooming or panning, skip re-rasterizing the per-node shadow filter on every frame */
+      svg.panning .node circle {{ filter: none; }}
+      .node {{ pointer-events: all; }}
+      svg.labels-hidden .node text {{ display: none; }}
+      .node text {{ font-family: {font_family}; font-size: {font_size}px; font-weight: {font_weight}; fill: {font_color}; font-style: {font_style}; }}
+      .link {{ fill: none; stroke: {line_color}; stroke-width: {line_width}px; stroke-opacity: {line_opacity}; stroke-linecap: round; stroke-linejoin: round; }}
+      .tooltip {{
+        position: absolute; background: #1e293b; color: #fff;
+        padding: 12px 16px; border-radius: 8px; font-size: 13px; font-family: Calibri, Arial, sans-serif;
+        pointer-events: none; z-index: 1000; max-width: 320px; line-height: 1.5; box-shadow: 0 8px 32px rgba(0,0,0,0.10);
+      }}
+      .region-outline {{
+        fill: none; stroke: #94A3B8; stroke-width: 2.5px; stroke-dasharray: 8 6;
+      }}
+      .controls {{
+        position: absolute; top: 10px; left: 10px; z-index: 1001;
         background: rgba(255,255,255,0.95); padding: 10px; border-radius: 8px;
         box-shadow: 0 4px 12px rgba(0,0,0,0.15); font-family: Calibri, Arial, sans-serif;
       }}
@@ -1297,6 +1673,9 @@ if uploaded_file:
       .download-btn.transparent {{ background: #F59E0B; }}
       .download-btn.transparent:hover {{ background: #D97706; }}
       .download-btn.transparent:active {{ background: #B45309; }}
+      .download-btn.compact {{ background: #0EA5E9; }}
+      .download-btn.compact:hover {{ background: #0284C7; }}
+      .download-btn.compact:active {{ background: #0369A1; }}
       .context-menu {{
         position: absolute; background: #1e293b; color: #fff;
         padding: 8px 0; border-radius: 8px; font-size: 13px; font-family: Calibri, Arial, sans-serif;
@@ -1358,1186 +1737,712 @@ if uploaded_file:
     <div class="zoom-info" id="zoomInfo">Zoom: 100%</div>
     <div class="download-panel">
       <div style="font-size: 11px; font-weight: 600; color: #374151; margin-bottom: 4px;">📥 Download Chart</div>
-      <button class="download-btn" onclick="downloadPNGAllComplete()">🖼️ PNG (Complete Tree • both bg)</button>
-      <button class="download-btn svg" onclick="downloadSVGAllComplete()">📐 SVG (Complete Tree • both bg)</button>
+      <button class="download-btn" onclick="downloadTreeBothBackgrounds('png', 'complete')">🖼️ PNG (Complete Tree • both bg)</button>
+      <button class="download-btn svg" onclick="downloadTreeBothBackgrounds('svg', 'complete')">📐 SVG (Complete Tree • both bg)</button>
+      <button class="download-btn compact" onclick="downloadTree('compact', 'complete', true)">⚡ WebP/JPEG (Complete Tree • white bg)</button>
       <div style="margin-top: 8px; padding-top: 8px; border-top: 1px solid #E5E7EB;">
         <div style="font-size: 10px; color: #6B7280; margin-bottom: 4px;">Current View Export:</div>
-        <button class="download-btn" onclick="downloadCurrentViewPNGAll()" style="font-size: 11px; padding: 6px 10px;">🖼️ PNG (Current View • both bg)</button>
-        <button class="download-btn svg" onclick="downloadCurrentViewSVGAll()" style="font-size: 11px; padding: 6px 10px;">📐 SVG (Current View • both bg)</button>
+        <button class="download-btn" onclick="downloadTreeBothBackgrounds('png', 'current')" style="font-size: 11px; padding: 6px 10px;">🖼️ PNG (Current View • both bg)</button>
+        <button class="download-btn svg" onclick="downloadTreeBothBackgrounds('svg', 'current')" style="font-size: 11px; padding: 6px 10px;">📐 SVG (Current View • both bg)</button>
+        <button class="download-btn compact" onclick="downloadTree('compact', 'current', true)" style="font-size: 11px; padding: 6px 10px;">⚡ WebP/JPEG (Current View • white bg)</button>
       </div>
     </div>
     <script>
-    const data = {tree_data_json};
+    // Gzipped payloads hold the flat tree JSON, a newline, then the raw rows text
+    function splitPayload(text) {{
+      const split = text.indexOf('\\n');
+      return [JSON.parse(text.slice(0, split)), text.slice(split + 1)];
+    }}
+    
+    // Rebuild the nested node objects from the flat per-field columns in a single pass;
+    // raw_rows spans point into rowsText, and each node keeps its slice as unparsed JSON
+    function inflateTree(flat, rowsText) {{
+      const parents = flat.parents;
+      const {{ raw_rows: rowSpans, ...fields }} = flat.columns;
+      const columns = Object.entries(fields);
+      const nodes = new Array(parents.length);
+      for (let i = 0; i < parents.length; i++) {{
+        const node = {{}};
+        for (const [key, column] of columns) {{
+          if (column[i] !== null) node[key] = column[i];
+        }}
+        if (rowSpans && rowSpans[i] !== null) node.raw_data = rowsText.slice(rowSpans[i][0], rowSpans[i][1]);
+        nodes[i] = node;
+        if (parents[i] >= 0) {{
+          const parent = nodes[parents[i]];
+          (parent.children || (parent.children = [])).push(node);
+        }}
+      }}
+      return nodes[0];
+    }}
+    const data = inflateTree({tree_data_json});
     const width = 1100, height = 800, dx = 44, dy = 220;
     const tree = d3.tree().nodeSize([dx, dy]);
-    const diagonal = d3.linkHorizontal().x(d => d.y).y(d => d.x);
     const root = d3.hierarchy(data);
+    // Large trees are drawn on a single canvas instead of one SVG element per node/link
+    // Every node of the data, walked once here for the renderer choice and the setup below
+    let allNodes = root.descendants();
+    const useCanvas = renderMode === "Canvas" || (renderMode === "Auto" && allNodes.length > canvasNodeThreshold);
     
-    // Global variables for context menu
+    // Global variables for context menu; its elements precede this script, so they are
+    // looked up once here, and the open flags let hiding skip panels already hidden
     let selectedNode = null;
-    let contextMenu = null;
-    let nodeDataPanel = null;
+    const contextMenu = document.getElementById('contextMenu');
+    const nodeDataPanel = document.getElementById('nodeDataPanel');
+    const nodeDataContent = document.getElementById('nodeDataContent');
+    let contextMenuOpen = false;
+    let nodeDataPanelOpen = false;
+    
+    // Stable data-join key of a hierarchy node: a small integer assigned on first use and kept
+    // on the node, so joins neither recompute it nor stringify random floats
+    let lastNodeId = 0;
+    function nodeKey(d) {{
+      return d.id || (d.id = ++lastNodeId);
+    }}
     
-    // Initialize all nodes with _children for expand/collapse
-    root.descendants().forEach(d => {{
-      if (d.children) d._children = d.children;
+    // Initialize all nodes with _children for expand/collapse (and their join keys). Keys
+    // are numbered in one pass here, so joins and drags only ever read them
+    for (const d of allNodes) {{
+      nodeKey(d);
+      if (d.children) {{
+        // Complete child list for expandAll; shares the array so sorting applies to it too
+        d._allChildren = d.children;
+        d._children = d.children;
+      }}
       if (d.depth > 1) d.children = null; // Start collapsed for deeper levels
-    }});
+    }}
+    allNodes = null;
     
     // Apply initial sorting if requested
     applyInitialSort(root);
     
-    const svg = d3.select("#tree").append("svg")
+    const svg = useCanvas ? null : d3.select("#tree").append("svg")
       .attr("width", width).attr("height", height)
       .attr("viewBox", [0, 0, width, height])
       .style("font", "15px Calibri");
     
+    // Canvas backing store is scaled by devicePixelRatio so it stays sharp on HiDPI screens
+    const dpr = window.devicePixelRatio || 1;
+    const canvas = useCanvas ? d3.select("#tree").append("canvas")
+      .attr("width", width * dpr).attr("height", height * dpr)
+      .style("width", width + "px").style("height", height + "px")
+      .style("display", "block") : null;
+    const ctx = useCanvas ? canvas.node().getContext("2d") : null;
+    const canvasDiagonal = useCanvas ? d3.linkHorizontal().x(d => d.y).y(d => d.x).context(ctx) : null;
+    const nodeShapePath = useCanvas ? new Path2D(nodeShapePathData(nodeSize)) : null;
+    // Laid-out nodes of the last update; pan/zoom only re-culls them, without a new layout
+    let layoutNodes = [];
+    // Quadtree over layoutNodes for canvas hit-testing, rebuilt lazily after a new layout
+    let nodeIndex = null;
+    let viewTransform = d3.zoomIdentity;
+    let viewUpdatePending = false;
+    // Bumped on every new layout (expand, collapse, reorder); keys the current-view export cache
+    let layoutVersion = 0;
+    // Expanded subtrees shorter than this on screen are drawn as one placeholder block
+    const minFramePx = 16;
+    // Layout changes that bind more nodes than this are applied without animation: with that
+    // many elements the transitions themselves become the slow part
+    const maxAnimatedNodes = 300;
+    // Labels whose on-screen font size is below this are unreadable and are not drawn
+    const minLabelPx = 4;
+    function labelsLegible(scale) {{
+      return fontSize * scale >= minLabelPx;
+    }}
+    // Element that receives zoom/pan for the active renderer
+    const view = useCanvas ? canvas : svg;
+    
     // Add zoom behavior
     const zoom = d3.zoom()
       .scaleExtent([0.1, 3])
+      .on("start", () => {{ if (!useCanvas) svg.classed("panning", true); }})
       .on("zoom", (event) => {{
-        g.attr("transform", event.transform);
-        updateZoomInfo(event.transform.k);
-      }});
+        viewTransform = event.transform;
+        scheduleViewUpdate();
+      }})
+      .on("end", () => {{ if (!useCanvas) svg.classed("panning", false); }});
     
-    svg.call(zoom);
+    view.call(zoom);
     
     // Center the tree by default
-    const g = svg.append("g");
-    const gRegion = g.append("g").attr("class", "regions");
-    const gLink = g.append("g").attr("stroke", lineColor).attr("stroke-opacity", lineOpacity);
-    const gNode = g.append("g").attr("cursor", "pointer");
-    // Ensure proper layer order: regions at bottom, links middle, nodes top
-    gRegion.lower();
-    gLink.raise();
-    gNode.raise();
+    const g = useCanvas ? null : svg.append("g");
+    const gRegion = useCanvas ? null : g.append("g").attr("class", "regions");
+    const gLink = useCanvas ? null : g.append("g").attr("stroke", lineColor).attr("stroke-opacity", lineOpacity);
+    const gPlaceholder = useCanvas ? null : g.append("g").attr("class", "placeholders");
+    const gNode = useCanvas ? null : g.append("g").attr("cursor", "pointer");
+    if (!useCanvas) {{
+      // Ensure proper layer order: regions at bottom, links middle, nodes top
+      gRegion.lower();
+      gLink.raise();
+      gPlaceholder.raise();
+      gNode.raise();
+    }}
     const tooltip = d3.select("body").append("div").attr("class", "tooltip").style("opacity", 0);
     
+    if (!useCanvas) {{
+      // Node clicks, context menus and tooltips are handled by one set of listeners on the
+      // node layer, which finds the node from the event target, instead of four per node
+      const nodeOf = event => {{
+        const el = event.target.closest("g.node");
+        return el ? el.__data__ : null;
+      }};
+      // mouseover/mouseout also fire when the pointer moves between a node's own shape and
+      // label; only entering or leaving the node updates the tooltip
+      let hoveredNode = null;
+      gNode
+        .on("click", event => {{
+          const d = nodeOf(event);
+          // Ignore click if a drag just occurred
+          if (!d || dragActive || event.defaultPrevented) return;
+          if (d._children) {{
+            d.children = d.children ? null : d._children;
+          }}
+          scheduleUpdate(d);
+        }})
+        .on("contextmenu", event => {{
+          const d = nodeOf(event);
+          if (d) showContextMenu(event, d);
+        }})
+        .on("mouseover", event => {{
+          const d = nodeOf(event);
+          if (!d || d === hoveredNode) return;
+          hoveredNode = d;
+          tooltip.transition().duration(200).style("opacity", .95);
+          tooltip.html(tooltipHtml(d)).style("left", (event.pageX+15) + "px").style("top", (event.pageY-20) + "px");
+        }})
+        .on("mouseout", event => {{
+          const to = event.relatedTarget;
+          if (hoveredNode && to && to.closest && to.closest("g.node") === event.target.closest("g.node")) return;
+          hoveredNode = null;
+          tooltip.transition().duration(400).style("opacity", 0);
+        }});
+    }}
+    
+    // Runs once per zoom frame: the label's text node is looked up once and only written
+    // when the shown percentage actually changes, so panning does not touch the DOM at all.
+    // Writing the text node's data replaces no child nodes, unlike setting textContent
+    const zoomInfoText = document.getElementById("zoomInfo").firstChild;
+    let zoomInfoPercent = null;
     function updateZoomInfo(scale) {{
-      document.getElementById("zoomInfo").textContent = `Zoom: ${{Math.round(scale * 100)}}%`;
+      const percent = Math.round(scale * 100);
+      if (percent === zoomInfoPercent) return;
+      zoomInfoPercent = percent;
+      zoomInfoText.data = `Zoom: ${{percent}}%`;
     }}
     
-    function expandAll() {{
-      // Create a fresh complete tree from the original data
-      const completeRoot = d3.hierarchy(data);
-      
-      // Recursively restore all children to the current root
-      function restoreChildren(currentNode, completeNode) {{
-        if (completeNode.children) {{
-          currentNode._children = completeNode.children;
-          currentNode.children = completeNode.children;
-          // Ensure parent pointers are correct for layout/link generation
-          currentNode.children.forEach(c => {{ c.parent = currentNode; }});
-          
-          // Recursively restore children for each child node
-          currentNode.children.forEach((child, index) => {{
-            if (completeNode.children[index]) {{
-              restoreChildren(child, completeNode.children[index]);
-            }}
-          }});
-        }}
+    // Fit the laid-out tree into the viewport (never zooming in past 100%). The layout and its
+    // extent are already computed synchronously by update(), so this can run in the same tick
+    function fitToView(duration = 750) {{
+      // x is vertical, y horizontal; no node sits left of the root
+      const {{ top, bottom, right }} = root.__bbox;
+      const treeWidth = right - root.y;
+      const treeHeight = bottom - top;
+      const k = Math.min(width / (treeWidth + 48), height / (treeHeight + 48), 1);
+      const centerX = width / 2 - k * (root.y + treeWidth / 2);
+      const centerY = height / 2 - k * (top + treeHeight / 2);
+      const transform = d3.zoomIdentity.translate(centerX, centerY).scale(k);
+      if (duration > 0) {{
+        view.transition().duration(duration).call(zoom.transform, transform);
+      }} else {{
+        view.call(zoom.transform, transform);
       }}
-      
-      // Restore the complete structure
-      restoreChildren(root, completeRoot);
-      
-      update(root);
-      // Center the expanded tree
-      setTimeout(() => {{
-        const nodes = root.descendants();
-        if (nodes.length > 0) {{
-          const minX = d3.min(nodes, d => d.x);
-          const maxX = d3.max(nodes, d => d.x);
-          const minY = d3.min(nodes, d => d.y);
-          const maxY = d3.max(nodes, d => d.y);
-          const treeWidth = maxY - minY;
-          const treeHeight = maxX - minX;
-          const centerX = width / 2 - (minY + treeWidth / 2);
-          const centerY = height / 2 - (minX + treeHeight / 2);
-          svg.transition().duration(750).call(
-            zoom.transform,
-            d3.zoomIdentity.translate(centerX, centerY).scale(1)
-          );
+    }}
+    
+    // Expand All opens the tree level by level, reattaching each node's complete child list
+    // cached at init (no hierarchy rebuild). Trees that grow by more than expandChunk nodes
+    // are laid out and drawn between idle slices, so a huge tree shows progress instead of
+    // freezing the page. A collapse or node toggle cancels the remaining levels.
+    const expandChunk = 2000;
+    const whenIdle = window.requestIdleCallback || (cb => requestAnimationFrame(() => cb()));
+    let expandJob = 0;
+    function expandAll() {{
+      const job = ++expandJob;
+      let frontier = [root];
+      (function step() {{
+        if (job !== expandJob) return;
+        let opened = 0;
+        while (frontier.length && opened < expandChunk) {{
+          const next = [];
+          for (const d of frontier) {{
+            if (!d._allChildren) continue;
+            d.children = d._allChildren;
+            d._children = d._allChildren;
+            for (const c of d.children) next.push(c);
+          }}
+          opened += next.length;
+          frontier = next;
         }}
-      }}, 100);
+        update(root);
+        fitToView();
+        if (frontier.length) whenIdle(step);
+      }})();
     }}
     
     function collapseAll() {{
-      root.descendants().forEach(d => {{
+      expandJob++;
+      root.each(d => {{
         if (d.children) {{
           d._children = d.children;
           d.children = null;
         }}
       }});
       update(root);
-      // Center the collapsed tree
-      setTimeout(() => {{
-        const nodes = root.descendants();
-        if (nodes.length > 0) {{
-          const minX = d3.min(nodes, d => d.x);
-          const maxX = d3.max(nodes, d => d.x);
-          const minY = d3.min(nodes, d => d.y);
-          const maxY = d3.max(nodes, d => d.y);
-          const treeWidth = maxY - minY;
-          const treeHeight = maxX - minX;
-          const centerX = width / 2 - (minY + treeWidth / 2);
-          const centerY = height / 2 - (minX + treeHeight / 2);
-          svg.transition().duration(750).call(
-            zoom.transform,
-            d3.zoomIdentity.translate(centerX, centerY).scale(1)
-          );
-        }}
-      }}, 100);
+      fitToView();
     }}
     
     function resetZoom() {{
-      const nodes = root.descendants();
-      if (nodes.length > 0) {{
-        const minX = d3.min(nodes, d => d.x);
-        const maxX = d3.max(nodes, d => d.x);
-        const minY = d3.min(nodes, d => d.y);
-        const maxY = d3.max(nodes, d => d.y);
-        const treeWidth = maxY - minY;
-        const treeHeight = maxX - minX;
-        const centerX = width / 2 - (minY + treeWidth / 2);
-        const centerY = height / 2 - (minX + treeHeight / 2);
-        svg.transition().duration(750).call(
-          zoom.transform,
-          d3.zoomIdentity.translate(centerX, centerY).scale(1)
-        );
-      }}
-    }}
-    
-    function downloadPNG() {{
-      // Create a complete tree with all nodes expanded for export
-      const exportRoot = d3.hierarchy(data);
-      exportRoot.descendants().forEach(d => {{
-        if (d._children) d.children = d._children;
-      }});
-      
-      // Reorder export tree to follow manual drag order if any
-      const currentOrderMap = buildOrderMapFromCurrent(root);
-      reorderExportRoot(exportRoot, currentOrderMap);
-      // Calculate tree layout for export
-      const exportTree = d3.tree().nodeSize([dx, dy]);
-      exportTree(exportRoot);
-      
-      const nodes = exportRoot.descendants();
-      if (nodes.length === 0) return;
-      
-      // Compute precise bounds including node shapes and labels
-      const measure = document.createElement('canvas').getContext('2d');
-      measure.font = fontWeight + ' ' + fontSize + 'px Calibri, Arial, sans-serif';
-      let minXBound = Infinity, maxXBound = -Infinity, minYBound = Infinity, maxYBound = -Infinity;
-      nodes.forEach(d => {{
-        const label = formatLabel(d);
-        const textWidth = measure.measureText(label).width;
-        const b = getNodeBounds(d, textWidth);
-        if (b.top < minXBound) minXBound = b.top;
-        if (b.bottom > maxXBound) maxXBound = b.bottom;
-        if (b.left < minYBound) minYBound = b.left;
-        if (b.right > maxYBound) maxYBound = b.right;
-      }});
+      fitToView();
+    }}
+    
+    // Complete hierarchy for the "Complete Tree" exports, built once on the first export.
+    // It is re-sorted and laid out again only when the sibling order of the live tree has
+    // changed.
+    let fullHierarchy = null;
+    const exportTree = d3.tree().nodeSize([dx, dy]);
+    let orderVersion = 0;
+    let completeLayout = null;
+    
+    // Nodes of the complete tree, in the current sibling order (links are parent to node)
+    function getCompleteExportLayout() {{
+      if (!completeLayout || completeLayout.version !== orderVersion) {{
+        if (!fullHierarchy) fullHierarchy = d3.hierarchy(data);
+        // Reorder export tree to follow manual drag order if any
+        reorderExportRoot(fullHierarchy, buildOrderMapFromCurrent(root));
+        exportTree(fullHierarchy);
+        computeSubtreeBounds(fullHierarchy);
+        completeLayout = {{ nodes: fullHierarchy.descendants(), version: orderVersion }};
+      }}
+      return completeLayout;
+    }}
+    
+    // Export page for a laid-out hierarchy: size, and the offset that moves its nodes and
+    // labels (plus padding) into view
+    function exportFrame(nodes) {{
+      // Compute precise bounds including node shapes and labels, in one pass with no
+      // per-node allocation. Vertical extents don't depend on the label width, so they are
+      // fixed offsets from the node's x; horizontal ones use the measured label width
+      const extentX = nodeSize + 8;
+      const labelExtent = nodeSize + labelOffset;
+      const topOffset = labelPosition === 'top' ? Math.max(extentX, labelExtent + fontSize) : extentX;
+      const bottomOffset = labelPosition === 'bottom' ? Math.max(extentX, labelExtent + fontSize) : extentX;
+      let minX = Infinity, maxX = -Infinity, minYBound = Infinity, maxYBound = -Infinity;
+      for (const d of nodes) {{
+        const textWidth = measureLabel(formatLabel(d));
+        const half = Math.max(textWidth / 2, nodeSize);
+        let left = d.y - half;
+        let right = d.y + half;
+        if (labelPosition === 'left') {{
+          left = Math.min(left, d.y - (labelExtent + textWidth));
+        }} else if (labelPosition !== 'top' && labelPosition !== 'bottom') {{
+          right = Math.max(right, d.y + (labelExtent + textWidth));
+        }}
+        if (d.x < minX) minX = d.x;
+        if (d.x > maxX) maxX = d.x;
+        if (left < minYBound) minYBound = left;
+        if (right > maxYBound) maxYBound = right;
+      }}
+      const minXBound = minX - topOffset;
+      const maxXBound = maxX + bottomOffset;
       const basePadding = 40;
       const outlineExtraPadding = (styleMode === "Mind Map" && showGroupOutlines) ? Math.ceil(nodeSize * 3) : 0;
       const padding = basePadding + outlineExtraPadding;
-      const treeWidth = Math.ceil((maxYBound - minYBound) + padding * 2);
-      const treeHeight = Math.ceil((maxXBound - minXBound) + padding * 2);
-      
-      // Create high-resolution canvas
-      const canvas = document.createElement('canvas');
-      canvas.width = treeWidth * exportScale;
-      canvas.height = treeHeight * exportScale;
-      const ctx = canvas.getContext('2d');
-      
-      // Clear canvas (transparent background)
-      ctx.clearRect(0, 0, canvas.width, canvas.height);
-      
-      // Create temporary SVG for rendering
-      const tempSvg = d3.create('svg')
-        .attr('width', treeWidth * exportScale)
-        .attr('height', treeHeight * exportScale)
-        .attr('viewBox', `0 0 ${{treeWidth}} ${{treeHeight}}`);
-      
-      // Clone the tree structure
-      const tempG = tempSvg.append('g')
-        .attr('transform', `translate(${{ -minYBound + padding }}, ${{ -minXBound + padding }})`);
-      
-      // Use the already calculated export tree
-      const tempLinks = exportRoot.links();
-      tempG.selectAll('path')
-        .data(tempLinks)
-        .enter().append('path')
-        .attr('d', diagonal)
-        .attr('fill', 'none')
-        .attr('stroke', lineColor)
-        .attr('stroke-width', lineWidth)
-        .attr('stroke-opacity', lineOpacity);
-      
-      // Render nodes
-      const tempNodes = exportRoot.descendants();
-      const nodeGroups = tempG.selectAll('g')
-        .data(tempNodes)
-        .enter().append('g')
-        .attr('transform', d => `translate(${{d.y}}, ${{d.x}})`);
-      
-      // Use custom node shapes for export
-      nodeGroups.each(function(d) {{
-        createNodeShape(d3.select(this), nodeSize);
-      }});
-      
-      // Add text with clean styling and proper positioning
-      nodeGroups.append('text')
-        .attr('x', getLabelAttrs().x)
-        .attr('y', getLabelAttrs().y)
-        .attr('text-anchor', getLabelAttrs().anchor)
-        .attr('font-family', 'Calibri, Arial, sans-serif')
-        .attr('font-size', fontSize + 'px')
-        .attr('font-weight', fontWeight)
-        .attr('fill', fontColor)
-        .attr('font-style', fontStyle)
-        .text(d => formatLabel(d));
-      
-      // Add region outlines for Mind Map exports
-      if (styleMode === "Mind Map" && showGroupOutlines) {{
-        const groups = exportRoot.descendants().filter(n => ((n.data && typeof n.data.level === 'number') ? n.data.level : n.depth) === groupOutlineLevel);
-        const padX = nodeSize * 2.5;
-        const padY = nodeSize * 2.0;
-        const regions = groups.map(gNode => {{
-          const desc = gNode.descendants();
-          let minX = Infinity, maxX = -Infinity, minY = Infinity, maxY = -Infinity;
-          desc.forEach(d => {{
-            if (d.x < minX) minX = d.x;
-            if (d.x > maxX) maxX = d.x;
-            if (d.y < minY) minY = d.y;
-            if (d.y > maxY) maxY = d.y;
-          }});
-          const x = minY - padX;
-          const y = minX - padY;
-          const width = (maxY - minY) + padX * 2;
-          const height = (maxX - minX) + padY * 2;
-          return {{ key: gNode.id || (gNode.id = Math.random()), x, y, width, height, stroke: gNode.data.color || '#94A3B8' }};
-        }});
-        tempG.append('g')
-          .selectAll('path')
-          .data(regions, d => d.key)
-          .enter().append('path')
-          .attr('d', d => roundedRectPath(d.x, d.y, d.width, d.height, 18))
-          .attr('fill', 'none')
-          .attr('stroke', d => d.stroke)
-          .attr('stroke-width', 2.5)
-          .attr('stroke-dasharray', '8 6')
-          .attr('opacity', outlineOpacity);
-      }}
-
-      // Convert SVG to data URL and download
-      const svgData = new XMLSerializer().serializeToString(tempSvg.node());
-      const svgBlob = new Blob([svgData], {{type: 'image/svg+xml;charset=utf-8'}});
-      const url = URL.createObjectURL(svgBlob);
-      
-      const img = new Image();
-      img.onload = function() {{
-        // Draw at native high-res size to avoid interpolation blur
-        ctx.drawImage(img, 0, 0, canvas.width, canvas.height);
-        canvas.toBlob(function(blob) {{
-          const link = document.createElement('a');
-          link.download = `decomposition_tree_transparent_${{new Date().toISOString().slice(0,10)}}.png`;
-          link.href = URL.createObjectURL(blob);
-          link.click();
-          URL.revokeObjectURL(url);
-          URL.revokeObjectURL(link.href);
-        }}, 'image/png', 1.0);
+      return {{
+        offsetX: -minYBound + padding,
+        offsetY: -minXBound + padding,
+        treeWidth: Math.ceil((maxYBound - minYBound) + padding * 2),
+        treeHeight: Math.ceil((maxXBound - minXBound) + padding * 2)
       }};
-      img.src = url;
     }}
     
-    // Wrapper to download both transparent and white background PNG (complete tree)
-    function downloadPNGAllComplete() {{
-      try {{ downloadPNG(); }} catch (e) {{ console.error(e); }}
-      setTimeout(() => {{ try {{ downloadPNGTransparent(); }} catch (e) {{ console.error(e); }} }}, 250);
+    // Frame of a layout object, computed once and shared by its SVG render and every PNG
+    // scene (the label and outline settings it depends on are fixed for the page)
+    function layoutFrame(layout) {{
+      return layout.frame || (layout.frame = exportFrame(layout.nodes));
     }}
     
-    function downloadPNGTransparent() {{
-      // Create a complete tree with all nodes expanded for export
-      const exportRoot = d3.hierarchy(data);
-      exportRoot.descendants().forEach(d => {{
-        if (d._children) d.children = d._children;
-      }});
-      
-      // Reorder export tree to follow manual drag order if any
-      const currentOrderMap2 = buildOrderMapFromCurrent(root);
-      reorderExportRoot(exportRoot, currentOrderMap2);
-      // Calculate tree layout for export
-      const exportTree = d3.tree().nodeSize([dx, dy]);
-      exportTree(exportRoot);
-      
-      const nodes = exportRoot.descendants();
-      if (nodes.length === 0) return;
-      
-      // Compute precise bounds including node shapes and labels
-      const measure2 = document.createElement('canvas').getContext('2d');
-      measure2.font = fontWeight + ' ' + fontSize + 'px Calibri, Arial, sans-serif';
-      let minXBound2 = Infinity, maxXBound2 = -Infinity, minYBound2 = Infinity, maxYBound2 = -Infinity;
-      nodes.forEach(d => {{
-        const label = formatLabel(d);
-        const textWidth = measure2.measureText(label).width;
-        const b = getNodeBounds(d, textWidth);
-        if (b.top < minXBound2) minXBound2 = b.top;
-        if (b.bottom > maxXBound2) maxXBound2 = b.bottom;
-        if (b.left < minYBound2) minYBound2 = b.left;
-        if (b.right > maxYBound2) maxYBound2 = b.right;
-      }});
-      const basePadding2 = 40;
-      const outlineExtraPadding2 = (styleMode === "Mind Map" && showGroupOutlines) ? Math.ceil(nodeSize * 3) : 0;
-      const padding2 = basePadding2 + outlineExtraPadding2;
-      const treeWidth = Math.ceil((maxYBound2 - minYBound2) + padding2 * 2);
-      const treeHeight = Math.ceil((maxXBound2 - minXBound2) + padding2 * 2);
-      
-      // Create high-resolution canvas with white background
-      const canvas = document.createElement('canvas');
-      canvas.width = treeWidth * exportScale;
-      canvas.height = treeHeight * exportScale;
-      const ctx = canvas.getContext('2d');
-      
-      // Set white background
-      ctx.fillStyle = '#ffffff';
-      ctx.fillRect(0, 0, canvas.width, canvas.height);
-      
-      // Create temporary SVG for rendering
-      const tempSvg = d3.create('svg')
-        .attr('width', treeWidth * exportScale)
-        .attr('height', treeHeight * exportScale)
-        .attr('viewBox', `0 0 ${{treeWidth}} ${{treeHeight}}`)
-        .style('background', '#ffffff');
-      
-      // Clone the tree structure
-      const tempG = tempSvg.append('g')
-        .attr('transform', `translate(${{ -minYBound2 + padding2 }}, ${{ -minXBound2 + padding2 }})`);
-      
-      // Use the already calculated export tree
-      const tempLinks = exportRoot.links();
-      tempG.selectAll('path')
-        .data(tempLinks)
-        .enter().append('path')
-        .attr('d', diagonal)
-        .attr('fill', 'none')
-        .attr('stroke', lineColor)
-        .attr('stroke-width', lineWidth)
-        .attr('stroke-opacity', lineOpacity);
-      
-      // Render nodes
-      const tempNodes = exportRoot.descendants();
-      const nodeGroups = tempG.selectAll('g')
-        .data(tempNodes)
-        .enter().append('g')
-        .attr('transform', d => `translate(${{d.y}}, ${{d.x}})`);
-      
-      // Use custom node shapes for export
-      nodeGroups.each(function(d) {{
-        createNodeShape(d3.select(this), nodeSize);
-      }});
+    // Export SVG markup for laid-out nodes and links, sized to the nodes and their labels.
+    // The drawing is assembled as strings and never materialized as DOM; the <svg> wrapper
+    // is added per download by exportSvgParts. Label styling is set once on the node layer.
+    function renderExportSvg(layout) {{
+      const {{ nodes }} = layout;
+      const {{ offsetX, offsetY, treeWidth, treeHeight }} = layoutFrame(layout);
+      const {{ shapeId, markup }} = nodeShapeDefs(nodeSize);
+      const label = getLabelAttrs();
+      const parts = [`<g transform="translate(${{fmt(offsetX)}},${{fmt(offsetY)}})">`];
+      
+      // All links share one stroke, so they are exported as a single compound path
+      if (nodes.length > 1) {{
+        parts.push(`<path fill="none" stroke="${{lineColor}}" stroke-width="${{lineWidth}}"${{lineOpacity == 1 ? '' : ` stroke-opacity="${{lineOpacity}}"`}} d="`);
+        for (const d of nodes) {{
+          if (d.parent) parts.push(exportLinkPath(d.parent, d));
+        }}
+        parts.push('"/>');
+      }}
       
-      // Add text with clean styling and proper positioning
-      nodeGroups.append('text')
-        .attr('x', getLabelAttrs().x)
-        .attr('y', getLabelAttrs().y)
-        .attr('text-anchor', getLabelAttrs().anchor)
-        .attr('font-family', fontFamily)
-        .attr('font-size', fontSize + 'px')
-        .attr('font-weight', fontWeight)
-        .attr('fill', fontColor)
-        .text(d => formatLabel(d));
+      // Attributes at their SVG defaults are left out
+      parts.push(`<g font-family="Calibri, Arial, sans-serif" font-size="${{fontSize}}px"`
+        + (fontWeight === '400' || fontWeight === 'normal' ? '' : ` font-weight="${{fontWeight}}"`)
+        + ` fill="${{fontColor}}"`
+        + (fontStyle === 'normal' ? '' : ` font-style="${{fontStyle}}"`)
+        + (label.anchor === 'start' ? '' : ` text-anchor="${{label.anchor}}"`) + '>');
+      // Shape and label are positioned directly rather than through a <g> per node. The shape
+      // reference is written as SVG 2 href and xlink:href, which SVG 1.1 tools still need
+      for (const d of nodes) {{
+        const ref = '#' + shapeId(d);
+        parts.push(`<use href="${{ref}}" xlink:href="${{ref}}" x="${{fmt(d.y)}}" y="${{fmt(d.x)}}"/><text x="${{fmt(d.y + label.x)}}" y="${{fmt(d.x + label.y)}}">${{escapeXml(formatLabel(d))}}</text>`);
+      }}
+      parts.push('</g>');
       
-      // Add region outlines for Mind Map exports
+      // Region outlines for Mind Map exports
       if (styleMode === "Mind Map" && showGroupOutlines) {{
-        const groups = exportRoot.descendants().filter(n => ((n.data && typeof n.data.level === 'number') ? n.data.level : n.depth) === groupOutlineLevel);
-        const padX = nodeSize * 2.5;
-        const padY = nodeSize * 2.0;
-        const regions = groups.map(gNode => {{
-          const desc = gNode.descendants();
-          let minX = Infinity, maxX = -Infinity, minY = Infinity, maxY = -Infinity;
-          desc.forEach(d => {{
-            if (d.x < minX) minX = d.x;
-            if (d.x > maxX) maxX = d.x;
-            if (d.y < minY) minY = d.y;
-            if (d.y > maxY) maxY = d.y;
-          }});
-          const x = minY - padX;
-          const y = minX - padY;
-          const width = (maxY - minY) + padX * 2;
-          const height = (maxX - minX) + padY * 2;
-          return {{ key: gNode.id || (gNode.id = Math.random()), x, y, width, height, stroke: gNode.data.color || '#94A3B8' }};
+        parts.push('<g fill="none" stroke-width="2.5" stroke-dasharray="8 6">');
+        groupRegions(nodes).forEach(r => {{
+          parts.push(`<path stroke="${{r.stroke}}" opacity="${{outlineOpacity}}" d="${{roundedRectPath(r.x, r.y, r.width, r.height, 18)}}"/>`);
         }});
-        tempG.append('g')
-          .selectAll('path')
-          .data(regions, d => d.key)
-          .enter().append('path')
-          .attr('d', d => roundedRectPath(d.x, d.y, d.width, d.height, 18))
-          .attr('fill', 'none')
-          .attr('stroke', d => d.stroke)
-          .attr('stroke-width', 2.5)
-          .attr('stroke-dasharray', '8 6')
-          .attr('opacity', outlineOpacity);
+        parts.push('</g>');
       }}
-
-      // Convert SVG to data URL and download
-      const svgData = new XMLSerializer().serializeToString(tempSvg.node());
-      const svgBlob = new Blob([svgData], {{type: 'image/svg+xml;charset=utf-8'}});
-      const url = URL.createObjectURL(svgBlob);
+      parts.push('</g>');
       
-      const img = new Image();
-      img.onload = function() {{
-        // Draw at native high-res size to avoid interpolation blur
-        ctx.drawImage(img, 0, 0, canvas.width, canvas.height);
-        canvas.toBlob(function(blob) {{
-          const link = document.createElement('a');
-          link.download = `decomposition_tree_white_bg_${{new Date().toISOString().slice(0,10)}}.png`;
-          link.href = URL.createObjectURL(blob);
-          link.click();
-          URL.revokeObjectURL(url);
-          URL.revokeObjectURL(link.href);
-        }}, 'image/png', 1.0);
+      return {{ defs: markup(), body: parts.join(''), treeWidth, treeHeight }};
+    }}
+    
+    // Everything a PNG export draws, as plain data (structured-cloneable), so it can be
+    // painted either here or in the export worker
+    function exportScene(layout, whiteBackground, scale) {{
+      const {{ nodes }} = layout;
+      const {{ offsetX, offsetY, treeWidth, treeHeight }} = layoutFrame(layout);
+      const label = getLabelAttrs();
+      // Link endpoints as flat (source y, source x, target y, target x) quadruples, one per
+      // node below the root
+      const linkCoords = new Float64Array(Math.max(0, nodes.length - 1) * 4);
+      let j = 0;
+      for (const target of nodes) {{
+        const source = target.parent;
+        if (!source) continue;
+        linkCoords[j] = source.y;
+        linkCoords[j + 1] = source.x;
+        linkCoords[j + 2] = target.y;
+        linkCoords[j + 3] = target.x;
+        j += 4;
+      }}
+      // Nodes as parallel columns: (y, x) pairs in one typed array (transferable, no per-node
+      // objects to clone into the worker), plus fill and label strings
+      const nodeCoords = new Float64Array(nodes.length * 2);
+      const nodeFills = new Array(nodes.length);
+      const nodeLabels = new Array(nodes.length);
+      for (let i = 0; i < nodes.length; i++) {{
+        const d = nodes[i];
+        nodeCoords[i * 2] = d.y;
+        nodeCoords[i * 2 + 1] = d.x;
+        nodeFills[i] = nodeFill(d);
+        nodeLabels[i] = formatLabel(d);
+      }}
+      return {{
+        width: treeWidth * scale, height: treeHeight * scale, scale, offsetX, offsetY, whiteBackground,
+        links: linkCoords, lineColor, lineWidth, lineOpacity,
+        nodeCoords, nodeFills, nodeLabels,
+        shapePath: nodeShapePathData(nodeSize),
+        donutWidth: nodeShape === "Donut" ? Math.max(4, nodeSize * 0.35) : 0,
+        font: `${{fontStyle}} ${{fontWeight}} ${{fontSize}}px Calibri, Arial, sans-serif`, fontColor,
+        labelX: label.x, labelY: label.y,
+        textAlign: label.anchor === 'middle' ? 'center' : (label.anchor === 'end' ? 'right' : 'left'),
+        regions: (styleMode === "Mind Map" && showGroupOutlines)
+          ? groupRegions(nodes).map(r => ({{ path: roundedRectPath(r.x, r.y, r.width, r.height, 18), stroke: r.stroke }}))
+          : [],
+        outlineOpacity
       }};
-      img.src = url;
     }}
     
-    function downloadSVG() {{
-      // Create a complete tree with all nodes expanded for export
-      const exportRoot = d3.hierarchy(data);
-      exportRoot.descendants().forEach(d => {{
-        if (d._children) d.children = d._children;
-      }});
-      
-      // Reorder export tree to follow manual drag order if any
-      const currentOrderMap3 = buildOrderMapFromCurrent(root);
-      reorderExportRoot(exportRoot, currentOrderMap3);
-      // Calculate tree layout for export
-      const exportTree = d3.tree().nodeSize([dx, dy]);
-      exportTree(exportRoot);
-      
-      const nodes = exportRoot.descendants();
-      if (nodes.length === 0) return;
-      
-      // Compute precise bounds including node shapes and labels
-      const measure3 = document.createElement('canvas').getContext('2d');
-      measure3.font = fontWeight + ' ' + fontSize + 'px Calibri, Arial, sans-serif';
-      let minXBound3 = Infinity, maxXBound3 = -Infinity, minYBound3 = Infinity, maxYBound3 = -Infinity;
-      nodes.forEach(d => {{
-        const label = formatLabel(d);
-        const textWidth = measure3.measureText(label).width;
-        const b = getNodeBounds(d, textWidth);
-        if (b.top < minXBound3) minXBound3 = b.top;
-        if (b.bottom > maxXBound3) maxXBound3 = b.bottom;
-        if (b.left < minYBound3) minYBound3 = b.left;
-        if (b.right > maxYBound3) maxYBound3 = b.right;
-      }});
-      const basePadding3 = 40;
-      const outlineExtraPadding3 = (styleMode === "Mind Map" && showGroupOutlines) ? Math.ceil(nodeSize * 3) : 0;
-      const padding3 = basePadding3 + outlineExtraPadding3;
-      const treeWidth = Math.ceil((maxYBound3 - minYBound3) + padding3 * 2);
-      const treeHeight = Math.ceil((maxXBound3 - minXBound3) + padding3 * 2);
-      
-      // Create SVG with transparent background
-      const svg = d3.create('svg')
-        .attr('width', treeWidth)
-        .attr('height', treeHeight)
-        .attr('xmlns', 'http://www.w3.org/2000/svg');
-      
-      // Clone the tree structure
-      const g = svg.append('g')
-        .attr('transform', `translate(${{ -minYBound3 + padding3 }}, ${{ -minXBound3 + padding3 }})`);
-      
-      // Use the already calculated export tree
-      const links = exportRoot.links();
-      g.selectAll('path')
-        .data(links)
-        .enter().append('path')
-        .attr('d', diagonal)
-        .attr('fill', 'none')
-        .attr('stroke', lineColor)
-        .attr('stroke-width', lineWidth)
-        .attr('stroke-opacity', lineOpacity);
-      
-      // Render nodes
-      const tempNodes = exportRoot.descendants();
-      const nodeGroups = g.selectAll('g')
-        .data(tempNodes)
-        .enter().append('g')
-        .attr('transform', d => `translate(${{d.y}}, ${{d.x}})`);
-      
-      // Use custom node shapes for export
-      nodeGroups.each(function(d) {{
-        createNodeShape(d3.select(this), nodeSize);
-      }});
-      
-      // Add text with clean styling and proper positioning
-      nodeGroups.append('text')
-        .attr('x', getLabelAttrs().x)
-        .attr('y', getLabelAttrs().y)
-        .attr('text-anchor', getLabelAttrs().anchor)
-        .attr('font-family', 'Calibri, Arial, sans-serif')
-        .attr('font-size', fontSize + 'px')
-        .attr('font-weight', fontWeight)
-        .attr('fill', '#111')
-        .text(d => formatLabel(d));
+    // Paint an export scene with the same geometry and paint order as renderExportSvg. Uses no
+    // page globals: its source is also loaded into the export worker.
+    function paintExportScene(ctx, scene) {{
+      if (scene.whiteBackground) {{
+        ctx.fillStyle = '#ffffff';
+        ctx.fillRect(0, 0, scene.width, scene.height);
+      }}
+      const scale = scene.scale;
+      ctx.setTransform(scale, 0, 0, scale, scale * scene.offsetX, scale * scene.offsetY);
+      
+      // Links: one path, with the d3.linkHorizontal control points inlined
+      const c = scene.links;
+      ctx.save();
+      ctx.globalAlpha = scene.lineOpacity;
+      ctx.lineWidth = scene.lineWidth;
+      ctx.strokeStyle = scene.lineColor;
+      ctx.beginPath();
+      for (let i = 0; i < c.length; i += 4) {{
+        const midY = (c[i] + c[i + 2]) / 2;
+        ctx.moveTo(c[i], c[i + 1]);
+        ctx.bezierCurveTo(midY, c[i + 1], midY, c[i + 3], c[i + 2], c[i + 3]);
+      }}
+      ctx.stroke();
+      ctx.restore();
+      
+      // Nodes and labels
+      const shape = new Path2D(scene.shapePath);
+      ctx.font = scene.font;
+      ctx.textAlign = scene.textAlign;
+      const p = scene.nodeCoords;
+      for (let i = 0; i < scene.nodeLabels.length; i++) {{
+        const y = p[i * 2], x = p[i * 2 + 1];
+        ctx.translate(y, x);
+        if (scene.donutWidth) {{
+          ctx.strokeStyle = scene.nodeFills[i];
+          ctx.lineWidth = scene.donutWidth;
+          ctx.stroke(shape);
+        }} else {{
+          ctx.fillStyle = scene.nodeFills[i];
+          ctx.fill(shape);
+          ctx.strokeStyle = "#fff";
+          ctx.lineWidth = 3;
+          ctx.stroke(shape);
+        }}
+        ctx.fillStyle = scene.fontColor;
+        ctx.fillText(scene.nodeLabels[i], scene.labelX, scene.labelY);
+        ctx.translate(-y, -x);
+      }}
       
-      // Add region outlines for Mind Map exports
-      if (styleMode === "Mind Map" && showGroupOutlines) {{
-        const groups = exportRoot.descendants().filter(n => ((n.data && typeof n.data.level === 'number') ? n.data.level : n.depth) === groupOutlineLevel);
-        const padX = nodeSize * 2.5;
-        const padY = nodeSize * 2.0;
-        const regions = groups.map(gNode => {{
-          const desc = gNode.descendants();
-          let minX = Infinity, maxX = -Infinity, minY = Infinity, maxY = -Infinity;
-          desc.forEach(d => {{
-            if (d.x < minX) minX = d.x;
-            if (d.x > maxX) maxX = d.x;
-            if (d.y < minY) minY = d.y;
-            if (d.y > maxY) maxY = d.y;
-          }});
-          const x = minY - padX;
-          const y = minX - padY;
-          const width = (maxY - minY) + padX * 2;
-          const height = (maxX - minX) + padY * 2;
-          return {{ key: gNode.id || (gNode.id = Math.random()), x, y, width, height, stroke: gNode.data.color || '#94A3B8' }};
-        }});
-        g.append('g')
-          .selectAll('path')
-          .data(regions, d => d.key)
-          .enter().append('path')
-          .attr('d', d => roundedRectPath(d.x, d.y, d.width, d.height, 18))
-          .attr('fill', 'none')
-          .attr('stroke', d => d.stroke)
-          .attr('stroke-width', 2.5)
-          .attr('stroke-dasharray', '8 6')
-          .attr('opacity', outlineOpacity);
+      // Region outlines for Mind Map exports
+      if (scene.regions.length) {{
+        ctx.globalAlpha = scene.outlineOpacity;
+        ctx.lineWidth = 2.5;
+        ctx.setLineDash([8, 6]);
+        for (const r of scene.regions) {{
+          ctx.strokeStyle = r.stroke;
+          ctx.stroke(new Path2D(r.path));
+        }}
       }}
-
-      // Download SVG
-      const svgData = new XMLSerializer().serializeToString(svg.node());
-      const blob = new Blob([svgData], {{type: 'image/svg+xml;charset=utf-8'}});
-      const url = URL.createObjectURL(blob);
-      const link = document.createElement('a');
-      link.download = `decomposition_tree_${{new Date().toISOString().slice(0,10)}}.svg`;
-      link.href = url;
-      link.click();
-      URL.revokeObjectURL(url);
     }}
     
-    // Wrapper to download both transparent and white background SVG (complete tree)
-    function downloadSVGAllComplete() {{
-      try {{ downloadSVG(); }} catch (e) {{ console.error(e); }}
-      setTimeout(() => {{ try {{ downloadSVGTransparent(); }} catch (e) {{ console.error(e); }} }}, 250);
+    // Complete-tree export SVG, rendered once per sibling order and shared by both SVG downloads
+    let exportSvgCache = null;
+    
+    function getCompleteExportSvg() {{
+      if (!exportSvgCache || exportSvgCache.version !== orderVersion) {{
+        exportSvgCache = renderExportSvg(getCompleteExportLayout());
+        exportSvgCache.version = orderVersion;
+      }}
+      return exportSvgCache;
     }}
     
-    function downloadSVGTransparent() {{
-      // Create a complete tree with all nodes expanded for export
-      const exportRoot = d3.hierarchy(data);
-      exportRoot.descendants().forEach(d => {{
-        if (d._children) d.children = d._children;
-      }});
-      
-      // Reorder export tree to follow manual drag order if any
-      const currentOrderMap4 = buildOrderMapFromCurrent(root);
-      reorderExportRoot(exportRoot, currentOrderMap4);
-      // Calculate tree layout for export
-      const exportTree = d3.tree().nodeSize([dx, dy]);
-      exportTree(exportRoot);
-      
-      const nodes = exportRoot.descendants();
-      if (nodes.length === 0) return;
-      
-      // Compute precise bounds including node shapes and labels
-      const measure4 = document.createElement('canvas').getContext('2d');
-      measure4.font = fontWeight + ' ' + fontSize + 'px Calibri, Arial, sans-serif';
-      let minXBound4 = Infinity, maxXBound4 = -Infinity, minYBound4 = Infinity, maxYBound4 = -Infinity;
-      nodes.forEach(d => {{
-        const label = formatLabel(d);
-        const textWidth = measure4.measureText(label).width;
-        const b = getNodeBounds(d, textWidth);
-        if (b.top < minXBound4) minXBound4 = b.top;
-        if (b.bottom > maxXBound4) maxXBound4 = b.bottom;
-        if (b.left < minYBound4) minYBound4 = b.left;
-        if (b.right > maxYBound4) maxYBound4 = b.right;
-      }});
-      const basePadding4 = 40;
-      const outlineExtraPadding4 = (styleMode === "Mind Map" && showGroupOutlines) ? Math.ceil(nodeSize * 3) : 0;
-      const padding4 = basePadding4 + outlineExtraPadding4;
-      const treeWidth = Math.ceil((maxYBound4 - minYBound4) + padding4 * 2);
-      const treeHeight = Math.ceil((maxXBound4 - minXBound4) + padding4 * 2);
-      
-      // Create SVG with white background
-      const svg = d3.create('svg')
-        .attr('width', treeWidth)
-        .attr('height', treeHeight)
-        .attr('xmlns', 'http://www.w3.org/2000/svg')
-        .style('background', '#ffffff');
-      
-      // Add white background rectangle
-      svg.append('rect')
-        .attr('width', '100%')
-        .attr('height', '100%')
-        .attr('fill', '#ffffff');
-      
-      // Clone the tree structure
-      const g = svg.append('g')
-        .attr('transform', `translate(${{ -minYBound4 + padding4 }}, ${{ -minXBound4 + padding4 }})`);
-      
-      // Use the already calculated export tree
-      const links = exportRoot.links();
-      g.selectAll('path')
-        .data(links)
-        .enter().append('path')
-        .attr('d', diagonal)
-        .attr('fill', 'none')
-        .attr('stroke', lineColor)
-        .attr('stroke-width', lineWidth)
-        .attr('stroke-opacity', lineOpacity);
-      
-      // Render nodes
-      const tempNodes = exportRoot.descendants();
-      const nodeGroups = g.selectAll('g')
-        .data(tempNodes)
-        .enter().append('g')
-        .attr('transform', d => `translate(${{d.y}}, ${{d.x}})`);
-      
-      // Use custom node shapes for export
-      nodeGroups.each(function(d) {{
-        createNodeShape(d3.select(this), nodeSize);
-      }});
-      
-      // Add text with clean styling and proper positioning
-      nodeGroups.append('text')
-        .attr('x', getLabelAttrs().x)
-        .attr('y', getLabelAttrs().y)
-        .attr('text-anchor', getLabelAttrs().anchor)
-        .attr('font-family', 'Calibri, Arial, sans-serif')
-        .attr('font-size', fontSize + 'px')
-        .attr('font-weight', fontWeight)
-        .attr('fill', '#111')
-        .text(d => formatLabel(d));
-      
-      // Add region outlines for Mind Map exports
-      if (styleMode === "Mind Map" && showGroupOutlines) {{
-        const groups = exportRoot.descendants().filter(n => ((n.data && typeof n.data.level === 'number') ? n.data.level : n.depth) === groupOutlineLevel);
-        const padX = nodeSize * 2.5;
-        const padY = nodeSize * 2.0;
-        const regions = groups.map(gNode => {{
-          const desc = gNode.descendants();
-          let minX = Infinity, maxX = -Infinity, minY = Infinity, maxY = -Infinity;
-          desc.forEach(d => {{
-            if (d.x < minX) minX = d.x;
-            if (d.x > maxX) maxX = d.x;
-            if (d.y < minY) minY = d.y;
-            if (d.y > maxY) maxY = d.y;
-          }});
-          const x = minY - padX;
-          const y = minX - padY;
-          const width = (maxY - minY) + padX * 2;
-          const height = (maxX - minX) + padY * 2;
-          return {{ key: gNode.id || (gNode.id = Math.random()), x, y, width, height, stroke: gNode.data.color || '#94A3B8' }};
-        }});
-        g.append('g')
-          .selectAll('path')
-          .data(regions, d => d.key)
-          .enter().append('path')
-          .attr('d', d => roundedRectPath(d.x, d.y, d.width, d.height, 18))
-          .attr('fill', 'none')
-          .attr('stroke', d => d.stroke)
-          .attr('stroke-width', 2.5)
-          .attr('stroke-dasharray', '8 6')
-          .attr('opacity', outlineOpacity);
+    // Complete SVG document for an export, optionally on a white background, as Blob parts:
+    // the cached body is handed to the Blob as is rather than copied into one document string
+    function exportSvgParts(exportSvg, whiteBackground) {{
+      const {{ defs, body, treeWidth, treeHeight }} = exportSvg;
+      return [
+        `<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" viewBox="0 0 ${{treeWidth}} ${{treeHeight}}" width="${{treeWidth}}" height="${{treeHeight}}"`
+          + (whiteBackground ? '><rect width="100%" height="100%" fill="#fff"/>' : '>')
+          + `<defs>${{defs}}</defs>`,
+        body,
+        '</svg>'
+      ];
+    }}
+    
+    // Download file names: prefix, today's date (YYYY-MM-DD) and extension
+    function datedFileName(prefix, extension) {{
+      return `${{prefix}}_${{new Date().toISOString().slice(0, 10)}}.${{extension}}`;
+    }}
+    
+    // A node's name reduced to characters that are safe in a file name, kept on its data
+    function safeNodeName(node) {{
+      let name = node.data.__fileName;
+      if (name === undefined) {{
+        name = String(node.data.name).replace(/[^a-zA-Z0-9]/g, '_');
+        node.data.__fileName = name;
       }}
-
-      // Download SVG
-      const svgData = new XMLSerializer().serializeToString(svg.node());
-      const blob = new Blob([svgData], {{type: 'image/svg+xml;charset=utf-8'}});
-      const url = URL.createObjectURL(blob);
-      const link = document.createElement('a');
-      link.download = `decomposition_tree_white_bg_${{new Date().toISOString().slice(0,10)}}.svg`;
-      link.href = url;
-      link.click();
-      URL.revokeObjectURL(url);
+      return name;
     }}
     
-    // New functions for current view export
-    function downloadCurrentViewPNG() {{
-      // Use the current tree state (with collapsed/expanded nodes as they are)
-      const currentRoot = root.copy();
-      
-      // Calculate tree layout for current view
-      const currentTree = d3.tree().nodeSize([dx, dy]);
-      currentTree(currentRoot);
-      
-      const nodes = currentRoot.descendants();
-      if (nodes.length === 0) return;
-      
-      // Compute precise bounds including node shapes and labels
-      const measure5 = document.createElement('canvas').getContext('2d');
-      measure5.font = fontWeight + ' ' + fontSize + 'px Calibri, Arial, sans-serif';
-      let minXBound5 = Infinity, maxXBound5 = -Infinity, minYBound5 = Infinity, maxYBound5 = -Infinity;
-      nodes.forEach(d => {{
-        const label = formatLabel(d);
-        const textWidth = measure5.measureText(label).width;
-        const b = getNodeBounds(d, textWidth);
-        if (b.top < minXBound5) minXBound5 = b.top;
-        if (b.bottom > maxXBound5) maxXBound5 = b.bottom;
-        if (b.left < minYBound5) minYBound5 = b.left;
-        if (b.right > maxYBound5) maxYBound5 = b.right;
-      }});
-      const basePadding5 = 40;
-      const outlineExtraPadding5 = (styleMode === "Mind Map" && showGroupOutlines) ? Math.ceil(nodeSize * 3) : 0;
-      const padding5 = basePadding5 + outlineExtraPadding5;
-      const treeWidth = Math.ceil((maxYBound5 - minYBound5) + padding5 * 2);
-      const treeHeight = Math.ceil((maxXBound5 - minXBound5) + padding5 * 2);
-      
-      // Create high-resolution canvas
-      const canvas = document.createElement('canvas');
-      canvas.width = treeWidth * exportScale;
-      canvas.height = treeHeight * exportScale;
-      const ctx = canvas.getContext('2d');
-      
-      // Clear canvas (transparent background)
-      ctx.clearRect(0, 0, canvas.width, canvas.height);
-      
-      // Create temporary SVG for rendering
-      const tempSvg = d3.create('svg')
-        .attr('width', treeWidth * exportScale)
-        .attr('height', treeHeight * exportScale)
-        .attr('viewBox', `0 0 ${{treeWidth}} ${{treeHeight}}`);
-      
-      // Clone the tree structure
-      const tempG = tempSvg.append('g')
-        .attr('transform', `translate(${{ -minYBound5 + padding5 }}, ${{ -minXBound5 + padding5 }})`);
-      
-      // Use the current tree links
-      const currentLinks = currentRoot.links();
-      tempG.selectAll('path')
-        .data(currentLinks)
-        .enter().append('path')
-        .attr('d', diagonal)
-        .attr('fill', 'none')
-        .attr('stroke', lineColor)
-        .attr('stroke-width', lineWidth)
-        .attr('stroke-opacity', lineOpacity);
-      
-      // Render nodes
-      const nodeGroups = tempG.selectAll('g')
-        .data(nodes)
-        .enter().append('g')
-        .attr('transform', d => `translate(${{d.y}}, ${{d.x}})`);
-      
-      // Use custom node shapes for export
-      nodeGroups.each(function(d) {{
-        createNodeShape(d3.select(this), nodeSize);
-      }});
-      
-      // Add text with clean styling and proper positioning
-      nodeGroups.append('text')
-        .attr('dy', '-0.5em')  // Position text above the node
-        .attr('x', 0)           // Center align horizontally
-        .attr('text-anchor', 'middle')  // Center align the text
-        .attr('font-family', 'Calibri, Arial, sans-serif')
-        .attr('font-size', fontSize + 'px')
-        .attr('font-weight', fontWeight)
-        .attr('fill', fontColor)
-        .attr('font-style', fontStyle)
-        .text(d => formatLabel(d));
-      
-      // Add region outlines for Mind Map exports
-      if (styleMode === "Mind Map" && showGroupOutlines) {{
-        const groups = currentRoot.descendants().filter(n => ((n.data && typeof n.data.level === 'number') ? n.data.level : n.depth) === groupOutlineLevel);
-        const padX = nodeSize * 2.5;
-        const padY = nodeSize * 2.0;
-        const regions = groups.map(gNode => {{
-          const desc = gNode.descendants();
-          let minX = Infinity, maxX = -Infinity, minY = Infinity, maxY = -Infinity;
-          desc.forEach(d => {{
-            if (d.x < minX) minX = d.x;
-            if (d.x > maxX) maxX = d.x;
-            if (d.y < minY) minY = d.y;
-            if (d.y > maxY) maxY = d.y;
-          }});
-          const x = minY - padX;
-          const y = minX - padY;
-          const width = (maxY - minY) + padX * 2;
-          const height = (maxX - minX) + padY * 2;
-          return {{ key: gNode.id || (gNode.id = Math.random()), x, y, width, height, stroke: gNode.data.color || '#94A3B8' }};
-        }});
-        tempG.append('g')
-          .selectAll('path')
-          .data(regions, d => d.key)
-          .enter().append('path')
-          .attr('d', d => roundedRectPath(d.x, d.y, d.width, d.height, 18))
-          .attr('fill', 'none')
-          .attr('stroke', d => d.stroke)
-          .attr('stroke-width', 2.5)
-          .attr('stroke-dasharray', '8 6')
-          .attr('opacity', outlineOpacity);
+    // Every download goes through one reused, detached anchor; each Blob URL is revoked as
+    // soon as its click has been dispatched, so repeated exports do not keep blobs alive
+    const downloadLink = document.createElement('a');
+    function downloadBlob(blob, filename) {{
+      const url = URL.createObjectURL(blob);
+      try {{
+        downloadLink.href = url;
+        downloadLink.download = filename;
+        downloadLink.click();
+      }} finally {{
+        URL.revokeObjectURL(url);
       }}
-
-      // Convert SVG to data URL and download
-      const svgData = new XMLSerializer().serializeToString(tempSvg.node());
-      const svgBlob = new Blob([svgData], {{type: 'image/svg+xml;charset=utf-8'}});
-      const url = URL.createObjectURL(svgBlob);
-      
-      const img = new Image();
-      img.onload = function() {{
-        // Draw at native high-res size to avoid interpolation blur
-        ctx.drawImage(img, 0, 0, canvas.width, canvas.height);
-        canvas.toBlob(function(blob) {{
-          const link = document.createElement('a');
-          link.download = `decomposition_tree_current_view_${{new Date().toISOString().slice(0,10)}}.png`;
-          link.href = URL.createObjectURL(blob);
-          link.click();
-          URL.revokeObjectURL(url);
-          URL.revokeObjectURL(link.href);
-        }}, 'image/png', 1.0);
+    }}
+    
+    // Drawing and PNG-encoding a full-resolution export is slow, so both run in a worker on
+    // an OffscreenCanvas when the browser supports it; the page only builds the scene data
+    const pngWorkerSource = `
+      ${{paintExportScene}}
+      let canvas = null;
+      self.onmessage = async (event) => {{
+        const {{ id, scene, type, quality }} = event.data;
+        try {{
+          // One canvas for every job; resizing it also clears it and resets the context.
+          // convertToBlob snapshots the bitmap, so the next job may reuse it right away
+          if (!canvas) canvas = new OffscreenCanvas(scene.width, scene.height);
+          canvas.width = scene.width;
+          canvas.height = scene.height;
+          paintExportScene(canvas.getContext('2d'), scene);
+          self.postMessage({{ id, blob: await canvas.convertToBlob({{ type, quality }}) }});
+        }} catch (err) {{
+          self.postMessage({{ id, error: String(err) }});
+        }}
       }};
-      img.src = url;
-    }}
-    
-    // White background version of current view PNG
-    function downloadCurrentViewPNGWhite() {{
-      const currentRoot = root.copy();
-      const currentTree = d3.tree().nodeSize([dx, dy]);
-      currentTree(currentRoot);
-      const nodes = currentRoot.descendants();
-      if (nodes.length === 0) return;
-      const measure5 = document.createElement('canvas').getContext('2d');
-      measure5.font = fontWeight + ' ' + fontSize + 'px Calibri, Arial, sans-serif';
-      let minXBound5 = Infinity, maxXBound5 = -Infinity, minYBound5 = Infinity, maxYBound5 = -Infinity;
-      nodes.forEach(d => {{
-        const label = formatLabel(d);
-        const textWidth = measure5.measureText(label).width;
-        const halfText = textWidth / 2;
-        const top = d.x - (nodeSize + fontSize + 8);
-        const bottom = d.x + (nodeSize + 8);
-        const left = d.y - Math.max(halfText, nodeSize);
-        const right = d.y + Math.max(halfText, nodeSize);
-        if (top < minXBound5) minXBound5 = top;
-        if (bottom > maxXBound5) maxXBound5 = bottom;
-        if (left < minYBound5) minYBound5 = left;
-        if (right > maxYBound5) maxYBound5 = right;
-      }});
-      const basePadding5 = 40;
-      const outlineExtraPadding5 = (styleMode === "Mind Map" && showGroupOutlines) ? Math.ceil(nodeSize * 3) : 0;
-      const padding5 = basePadding5 + outlineExtraPadding5;
-      const treeWidth = Math.ceil((maxYBound5 - minYBound5) + padding5 * 2);
-      const treeHeight = Math.ceil((maxXBound5 - minXBound5) + padding5 * 2);
-      const canvas = document.createElement('canvas');
-      canvas.width = treeWidth * exportScale;
-      canvas.height = treeHeight * exportScale;
-      const ctx = canvas.getContext('2d');
-      ctx.fillStyle = '#ffffff';
-      ctx.fillRect(0, 0, canvas.width, canvas.height);
-      const tempSvg = d3.create('svg')
-        .attr('width', treeWidth * exportScale)
-        .attr('height', treeHeight * exportScale)
-        .attr('viewBox', `0 0 ${{treeWidth}} ${{treeHeight}}`)
-        .style('background', '#ffffff');
-      const tempG = tempSvg.append('g')
-        .attr('transform', `translate(${{ -minYBound5 + padding5 }}, ${{ -minXBound5 + padding5 }})`);
-      const currentLinks = currentRoot.links();
-      tempG.selectAll('path')
-        .data(currentLinks)
-        .enter().append('path')
-        .attr('d', diagonal)
-        .attr('fill', 'none')
-        .attr('stroke', lineColor)
-        .attr('stroke-width', lineWidth)
-        .attr('stroke-opacity', lineOpacity);
-      const nodeGroups = tempG.selectAll('g')
-        .data(nodes)
-        .enter().append('g')
-        .attr('transform', d => `translate(${{d.y}}, ${{d.x}})`);
-      nodeGroups.each(function(d) {{ createNodeShape(d3.select(this), nodeSize); }});
-      nodeGroups.append('text')
-        .attr('x', getLabelAttrs().x)
-        .attr('y', getLabelAttrs().y)
-        .attr('text-anchor', getLabelAttrs().anchor)
-        .attr('font-family', 'Calibri, Arial, sans-serif')
-        .attr('font-size', fontSize + 'px')
-        .attr('font-weight', fontWeight)
-        .attr('fill', fontColor)
-        .attr('font-style', fontStyle)
-        .text(d => formatLabel(d));
-      // Region outlines if needed
-      if (styleMode === "Mind Map" && showGroupOutlines) {{
-        const groups = currentRoot.descendants().filter(n => ((n.data && typeof n.data.level === 'number') ? n.data.level : n.depth) === groupOutlineLevel);
-        const padX = nodeSize * 2.5;
-        const padY = nodeSize * 2.0;
-        const regions = groups.map(gNode => {{
-          const desc = gNode.descendants();
-          let minX = Infinity, maxX = -Infinity, minY = Infinity, maxY = -Infinity;
-          desc.forEach(d => {{
-            if (d.x < minX) minX = d.x;
-            if (d.x > maxX) maxX = d.x;
-            if (d.y < minY) minY = d.y;
-            if (d.y > maxY) maxY = d.y;
-          }});
-          const x = minY - padX;
-          const y = minX - padY;
-          const width = (maxY - minY) + padX * 2;
-          const height = (maxX - minX) + padY * 2;
-          return {{ key: gNode.id || (gNode.id = Math.random()), x, y, width, height, stroke: gNode.data.color || '#94A3B8' }};
-        }});
-        tempG.append('g')
-          .selectAll('path')
-          .data(regions, d => d.key)
-          .enter().append('path')
-          .attr('d', d => roundedRectPath(d.x, d.y, d.width, d.height, 18))
-          .attr('fill', 'none')
-          .attr('stroke', d => d.stroke)
-          .attr('stroke-width', 2.5)
-          .attr('stroke-dasharray', '8 6')
-          .attr('opacity', outlineOpacity);
+    `;
+    let pngWorker = null;
+    let pngJobId = 0;
+    const pngJobs = new Map();
+    
+    // Some browsers ship OffscreenCanvas without a 2D context; the worker can't paint there
+    function offscreen2dSupported() {{
+      try {{
+        return typeof OffscreenCanvas !== 'undefined' && !!new OffscreenCanvas(1, 1).getContext('2d');
+      }} catch (e) {{
+        return false;
       }}
-      const svgData = new XMLSerializer().serializeToString(tempSvg.node());
-      const svgBlob = new Blob([svgData], {{type: 'image/svg+xml;charset=utf-8'}});
-      const url = URL.createObjectURL(svgBlob);
-      const img = new Image();
-      img.onload = function() {{
-        ctx.drawImage(img, 0, 0, canvas.width, canvas.height);
-        canvas.toBlob(function(blob) {{
-          const link = document.createElement('a');
-          link.download = `decomposition_tree_current_view_white_bg_${{new Date().toISOString().slice(0,10)}}.png`;
-          link.href = URL.createObjectURL(blob);
-          link.click();
-          URL.revokeObjectURL(url);
-          URL.revokeObjectURL(link.href);
-        }}, 'image/png', 1.0);
-      }};
-      img.src = url;
     }}
     
-    // Wrapper to download current view PNGs (transparent + white)
-    function downloadCurrentViewPNGAll() {{
-      try {{ downloadCurrentViewPNG(); }} catch (e) {{ console.error(e); }}
-      setTimeout(() => {{ try {{ downloadCurrentViewPNGWhite(); }} catch (e) {{ console.error(e); }} }}, 250);
+    function getPngWorker() {{
+      if (pngWorker === null) {{
+        pngWorker = false;
+        if (!offscreen2dSupported()) return null;
+        try {{
+          const workerUrl = URL.createObjectURL(new Blob([pngWorkerSource], {{type: 'application/javascript'}}));
+          try {{
+            pngWorker = new Worker(workerUrl);
+          }} finally {{
+            // The script blob is resolved when the Worker is constructed
+            URL.revokeObjectURL(workerUrl);
+          }}
+          pngWorker.onmessage = (event) => {{
+            const job = pngJobs.get(event.data.id);
+            pngJobs.delete(event.data.id);
+            if (event.data.error) job.reject(new Error(event.data.error));
+            else job.resolve(event.data.blob);
+          }};
+          pngWorker.onerror = (event) => {{
+            // Worker unusable here (e.g. blocked by the page sandbox): fail over for good
+            pngJobs.forEach(job => job.reject(new Error(event.message || 'PNG worker error')));
+            pngJobs.clear();
+            pngWorker = false;
+          }};
+        }} catch (e) {{
+          pngWorker = false;
+        }}
+      }}
+      return pngWorker || null;
     }}
     
-    function downloadCurrentViewSVG() {{
-      // Use the current tree state (with collapsed/expanded nodes as they are)
-      const currentRoot = root.copy();
-      
-      // Calculate tree layout for current view
-      const currentTree = d3.tree().nodeSize([dx, dy]);
-      currentTree(currentRoot);
-      
-      const nodes = currentRoot.descendants();
-      if (nodes.length === 0) return;
-      
-      // Compute precise bounds including node shapes and labels
-      const measure6 = document.createElement('canvas').getContext('2d');
-      measure6.font = fontWeight + ' ' + fontSize + 'px Calibri, Arial, sans-serif';
-      let minXBound6 = Infinity, maxXBound6 = -Infinity, minYBound6 = Infinity, maxYBound6 = -Infinity;
-      nodes.forEach(d => {{
-        const label = formatLabel(d);
-        const textWidth = measure6.measureText(label).width;
-        const b = getNodeBounds(d, textWidth);
-        if (b.top < minXBound6) minXBound6 = b.top;
-        if (b.bottom > maxXBound6) maxXBound6 = b.bottom;
-        if (b.left < minYBound6) minYBound6 = b.left;
-        if (b.right > maxYBound6) maxYBound6 = b.right;
-      }});
-      const basePadding6 = 40;
-      const outlineExtraPadding6 = (styleMode === "Mind Map" && showGroupOutlines) ? Math.ceil(nodeSize * 3) : 0;
-      const padding6 = basePadding6 + outlineExtraPadding6;
-      const treeWidth = Math.ceil((maxYBound6 - minYBound6) + padding6 * 2);
-      const treeHeight = Math.ceil((maxXBound6 - minXBound6) + padding6 * 2);
-      
-      // Create SVG with transparent background
-      const svg = d3.create('svg')
-        .attr('width', treeWidth)
-        .attr('height', treeHeight)
-        .attr('xmlns', 'http://www.w3.org/2000/svg');
-      
-      // Clone the tree structure
-      const g = svg.append('g')
-        .attr('transform', `translate(${{ -minYBound6 + padding6 }}, ${{ -minXBound6 + padding6 }})`);
-      
-      // Use the current tree links
-      const links = currentRoot.links();
-      g.selectAll('path')
-        .data(links)
-        .enter().append('path')
-        .attr('d', diagonal)
-        .attr('fill', 'none')
-        .attr('stroke', lineColor)
-        .attr('stroke-width', lineWidth)
-        .attr('stroke-opacity', lineOpacity);
-      
-      // Render nodes
-      const nodeGroups = g.selectAll('g')
-        .data(nodes)
-        .enter().append('g')
-        .attr('transform', d => `translate(${{d.y}}, ${{d.x}})`);
-      
-      // Use custom node shapes for export
-      nodeGroups.each(function(d) {{
-        createNodeShape(d3.select(this), nodeSize);
+    function encodePngInWorker(worker, scene, format) {{
+      return new Promise((resolve, reject) => {{
+        const id = ++pngJobId;
+        pngJobs.set(id, {{ resolve, reject }});
+        worker.postMessage({{ id, scene, type: format.type, quality: format.quality }}, [scene.links.buffer, scene.nodeCoords.buffer]);
       }});
+    }}
+    
+    // Shared by all main-thread PNG exports; resizing clears it and resets the context. An
+    // OffscreenCanvas where one can paint in 2D (e.g. when the page may not start workers):
+    // no element is created and nothing is ever read back, so the context is write-only
+    let exportCanvas = null;
+    
+    function encodePngOnMainThread(scene, format, save) {{
+      if (!exportCanvas) {{
+        exportCanvas = offscreen2dSupported() ? new OffscreenCanvas(1, 1) : document.createElement('canvas');
+      }}
+      const canvas = exportCanvas;
+      canvas.width = scene.width;
+      canvas.height = scene.height;
+      paintExportScene(canvas.getContext('2d', {{ willReadFrequently: false }}), scene);
+      if (canvas.convertToBlob) {{
+        canvas.convertToBlob({{ type: format.type, quality: format.quality }}).then(save, err => console.error(err));
+      }} else {{
+        canvas.toBlob(save, format.type, format.quality);
+      }}
+    }}
+    
+    const PNG_FORMAT = {{ type: 'image/png', extension: 'png' }};
+    let compactFormat = null;
+    
+    // WebP (or JPEG where the browser can't encode WebP): far cheaper to encode than PNG
+    // for large exports. Neither keeps a transparent background here, so they export on white
+    function getCompactFormat() {{
+      if (!compactFormat) {{
+        const probe = document.createElement('canvas');
+        probe.width = probe.height = 1;
+        compactFormat = probe.toDataURL('image/webp').startsWith('data:image/webp')
+          ? {{ type: 'image/webp', quality: 0.92, extension: 'webp' }}
+          : {{ type: 'image/jpeg', quality: 0.92, extension: 'jpg' }};
+      }}
+      return compactFormat;
+    }}
+    
+    // Draw a laid-out tree straight to a canvas and download it as an image (no SVG round-trip)
+    function downloadExportImage(layout, whiteBackground, filePrefix, format = PNG_FORMAT) {{
+      const scene = exportScene(layout, whiteBackground, exportScale);
       
-      // Add text with clean styling and proper positioning
-      nodeGroups.append('text')
-        .attr('x', getLabelAttrs().x)
-        .attr('y', getLabelAttrs().y)
-        .attr('text-anchor', getLabelAttrs().anchor)
-        .attr('font-family', 'Calibri, Arial, sans-serif')
-        .attr('font-size', fontSize + 'px')
-        .attr('font-weight', fontWeight)
-        .attr('fill', fontColor)
-        .attr('font-style', fontStyle)
-        .text(d => formatLabel(d));
+      function save(blob) {{
+        downloadBlob(blob, datedFileName(filePrefix, format.extension));
+      }}
       
-      // Add region outlines for Mind Map exports
-      if (styleMode === "Mind Map" && showGroupOutlines) {{
-        const groups = currentRoot.descendants().filter(n => ((n.data && typeof n.data.level === 'number') ? n.data.level : n.depth) === groupOutlineLevel);
-        const padX = nodeSize * 2.5;
-        const padY = nodeSize * 2.0;
-        const regions = groups.map(gNode => {{
-          const desc = gNode.descendants();
-          let minX = Infinity, maxX = -Infinity, minY = Infinity, maxY = -Infinity;
-          desc.forEach(d => {{
-            if (d.x < minX) minX = d.x;
-            if (d.x > maxX) maxX = d.x;
-            if (d.y < minY) minY = d.y;
-            if (d.y > maxY) maxY = d.y;
-          }});
-          const x = minY - padX;
-          const y = minX - padY;
-          const width = (maxY - minY) + padX * 2;
-          const height = (maxX - minX) + padY * 2;
-          return {{ key: gNode.id || (gNode.id = Math.random()), x, y, width, height, stroke: gNode.data.color || '#94A3B8' }};
-        }});
-        g.append('g')
-          .selectAll('path')
-          .data(regions, d => d.key)
-          .enter().append('path')
-          .attr('d', d => roundedRectPath(d.x, d.y, d.width, d.height, 18))
-          .attr('fill', 'none')
-          .attr('stroke', d => d.stroke)
-          .attr('stroke-width', 2.5)
-          .attr('stroke-dasharray', '8 6')
-          .attr('opacity', outlineOpacity);
+      const worker = getPngWorker();
+      if (!worker) {{
+        encodePngOnMainThread(scene, format, save);
+        return;
       }}
-
-      // Download SVG
-      const svgData = new XMLSerializer().serializeToString(svg.node());
-      const blob = new Blob([svgData], {{type: 'image/svg+xml;charset=utf-8'}});
-      const url = URL.createObjectURL(blob);
-      const link = document.createElement('a');
-      link.download = `decomposition_tree_current_view_${{new Date().toISOString().slice(0,10)}}.svg`;
-      link.href = url;
-      link.click();
-      URL.revokeObjectURL(url);
-    }}
-    
-    // White background version of current view SVG
-    function downloadCurrentViewSVGWhite() {{
-      const currentRoot = root.copy();
-      const currentTree = d3.tree().nodeSize([dx, dy]);
-      currentTree(currentRoot);
-      const nodes = currentRoot.descendants();
-      if (nodes.length === 0) return;
-      const measure6 = document.createElement('canvas').getContext('2d');
-      measure6.font = fontWeight + ' ' + fontSize + 'px Calibri, Arial, sans-serif';
-      let minXBound6 = Infinity, maxXBound6 = -Infinity, minYBound6 = Infinity, maxYBound6 = -Infinity;
-      nodes.forEach(d => {{
-        const label = formatLabel(d);
-        const textWidth = measure6.measureText(label).width;
-        const halfText = textWidth / 2;
-        const top = d.x - (nodeSize + fontSize + 8);
-        const bottom = d.x + (nodeSize + 8);
-        const left = d.y - Math.max(halfText, nodeSize);
-        const right = d.y + Math.max(halfText, nodeSize);
-        if (top < minXBound6) minXBound6 = top;
-        if (bottom > maxXBound6) maxXBound6 = bottom;
-        if (left < minYBound6) minYBound6 = left;
-        if (right > maxYBound6) maxYBound6 = right;
-      }});
-      const basePadding6 = 40;
-      const outlineExtraPadding6 = (styleMode === "Mind Map" && showGroupOutlines) ? Math.ceil(nodeSize * 3) : 0;
-      const padding6 = basePadding6 + outlineExtraPadding6;
-      const treeWidth = Math.ceil((maxYBound6 - minYBound6) + padding6 * 2);
-      const treeHeight = Math.ceil((maxXBound6 - minXBound6) + padding6 * 2);
-      const svg = d3.create('svg')
-        .attr('width', treeWidth)
-        .attr('height', treeHeight)
-        .attr('xmlns', 'http://www.w3.org/2000/svg')
-        .style('background', '#ffffff');
-      svg.append('rect').attr('width', '100%').attr('height', '100%').attr('fill', '#ffffff');
-      const g = svg.append('g')
-        .attr('transform', `translate(${{ -minYBound6 + padding6 }}, ${{ -minXBound6 + padding6 }})`);
-      const links = currentRoot.links();
-      g.selectAll('path')
-        .data(links)
-        .enter().append('path')
-        .attr('d', diagonal)
-        .attr('fill', 'none')
-        .attr('stroke', lineColor)
-        .attr('stroke-width', lineWidth)
-        .attr('stroke-opacity', lineOpacity);
-      const nodeGroups = g.selectAll('g')
-        .data(nodes)
-        .enter().append('g')
-        .attr('transform', d => `translate(${{d.y}}, ${{d.x}})`);
-      nodeGroups.each(function(d) {{ createNodeShape(d3.select(this), nodeSize); }});
-      nodeGroups.append('text')
-        .attr('dy', '-0.5em')
-        .attr('x', 0)
-        .attr('text-anchor', 'middle')
-        .attr('font-family', 'Calibri, Arial, sans-serif')
-        .attr('font-size', fontSize + 'px')
-        .attr('font-weight', fontWeight)
-        .attr('fill', fontColor)
-        .attr('font-style', fontStyle)
-        .text(d => formatLabel(d));
-      if (styleMode === "Mind Map" && showGroupOutlines) {{
-        const groups = currentRoot.descendants().filter(n => ((n.data && typeof n.data.level === 'number') ? n.data.level : n.depth) === groupOutlineLevel);
-        const padX = nodeSize * 2.5;
-        const padY = nodeSize * 2.0;
-        const regions = groups.map(gNode => {{
-          const desc = gNode.descendants();
-          let minX = Infinity, maxX = -Infinity, minY = Infinity, maxY = -Infinity;
-          desc.forEach(d => {{
-            if (d.x < minX) minX = d.x;
-            if (d.x > maxX) maxX = d.x;
-            if (d.y < minY) minY = d.y;
-            if (d.y > maxY) maxY = d.y;
-          }});
-          const x = minY - padX;
-          const y = minX - padY;
-          const width = (maxY - minY) + padX * 2;
-          const height = (maxX - minX) + padY * 2;
-          return {{ key: gNode.id || (gNode.id = Math.random()), x, y, width, height, stroke: gNode.data.color || '#94A3B8' }};
+      encodePngInWorker(worker, scene, format)
+        .then(save)
+        .catch(err => {{
+          console.warn('PNG worker failed, drawing on the main thread instead:', err);
+          // The coordinate buffers were transferred to the worker, so rebuild the scene
+          encodePngOnMainThread(exportScene(layout, whiteBackground, exportScale), format, save);
         }});
-        g.append('g')
-          .selectAll('path')
-          .data(regions, d => d.key)
-          .enter().append('path')
-          .attr('d', d => roundedRectPath(d.x, d.y, d.width, d.height, 18))
-          .attr('fill', 'none')
-          .attr('stroke', d => d.stroke)
-          .attr('stroke-width', 2.5)
-          .attr('stroke-dasharray', '8 6')
-          .attr('opacity', outlineOpacity);
+    }}
+    
+    function downloadExportSVG(exportSvg, whiteBackground, filePrefix) {{
+      const blob = new Blob(exportSvgParts(exportSvg, whiteBackground), {{type: 'image/svg+xml;charset=utf-8'}});
+      downloadBlob(blob, datedFileName(filePrefix, 'svg'));
+    }}
+    
+    // Current-view export (the tree as expanded/collapsed on screen). It reuses the layout
+    // update() already computed instead of copying and laying out the tree again; its SVG is
+    // rendered once per layout and shared by the two SVG downloads
+    let currentViewLayout = null;
+    let currentViewSvgCache = null;
+    
+    function getCurrentViewLayout() {{
+      if (!currentViewLayout || currentViewLayout.version !== layoutVersion) {{
+        currentViewLayout = {{ nodes: layoutNodes, version: layoutVersion }};
       }}
-      const svgData = new XMLSerializer().serializeToString(svg.node());
-      const blob = new Blob([svgData], {{type: 'image/svg+xml;charset=utf-8'}});
-      const url = URL.createObjectURL(blob);
-      const link = document.createElement('a');
-      link.download = `decomposition_tree_current_view_white_bg_${{new Date().toISOString().slice(0,10)}}.svg`;
-      link.href = url;
-      link.click();
-      URL.revokeObjectURL(url);
+      return currentViewLayout;
     }}
-
-    // Wrapper to download current view SVGs (transparent + white)
-    function downloadCurrentViewSVGAll() {{
-      try {{ downloadCurrentViewSVG(); }} catch (e) {{ console.error(e); }}
-      setTimeout(() => {{ try {{ downloadCurrentViewSVGWhite(); }} catch (e) {{ console.error(e); }} }}, 250);
+    
+    function getCurrentViewExportSvg() {{
+      if (!currentViewSvgCache || currentViewSvgCache.version !== layoutVersion) {{
+        currentViewSvgCache = renderExportSvg(getCurrentViewLayout());
+        currentViewSvgCache.version = layoutVersion;
+      }}
+      return currentViewSvgCache;
+    }}
+    
+    // Every chart download: format is 'png', 'svg' or 'compact' (WebP/JPEG, always on white),
+    // source is 'complete' or 'current'
+    const exportSources = {{
+      complete: {{ layout: getCompleteExportLayout, svg: getCompleteExportSvg, prefix: 'decomposition_tree' }},
+      current: {{ layout: getCurrentViewLayout, svg: getCurrentViewExportSvg, prefix: 'decomposition_tree_current_view' }}
+    }};
+    
+    function downloadTree(format, source, whiteBackground) {{
+      const src = exportSources[source];
+      if (format === 'svg') {{
+        downloadExportSVG(src.svg(), whiteBackground, src.prefix + (whiteBackground ? '_white_bg' : ''));
+      }} else {{
+        const imageFormat = format === 'png' ? PNG_FORMAT : getCompactFormat();
+        downloadExportImage(src.layout(), whiteBackground, src.prefix + (whiteBackground ? '_white_bg' : '_transparent'), imageFormat);
+      }}
+    }}
+    
+    // Transparent and white background downloads of one format, the second a moment later
+    function downloadTreeBothBackgrounds(format, source) {{
+      try {{ downloadTree(format, source, false); }} catch (e) {{ console.error(e); }}
+      setTimeout(() => {{ try {{ downloadTree(format, source, true); }} catch (e) {{ console.error(e); }} }}, 250);
     }}
     
     // Context menu functions
@@ -2545,22 +2450,24 @@ if uploaded_file:
       event.preventDefault();
       selectedNode = node;
       
-      if (!contextMenu) {{
-        contextMenu = document.getElementById('contextMenu');
-        nodeDataPanel = document.getElementById('nodeDataPanel');
-      }}
-      
       contextMenu.style.display = 'block';
       contextMenu.style.left = event.pageX + 'px';
       contextMenu.style.top = event.pageY + 'px';
+      contextMenuOpen = true;
     }}
     
     function hideContextMenu() {{
-      if (contextMenu) {{
+      if (contextMenuOpen) {{
         contextMenu.style.display = 'none';
+        contextMenuOpen = false;
       }}
-      if (nodeDataPanel) {{
+      hideNodeDataPanel();
+    }}
+    
+    function hideNodeDataPanel() {{
+      if (nodeDataPanelOpen) {{
         nodeDataPanel.style.display = 'none';
+        nodeDataPanelOpen = false;
       }}
     }}
     
@@ -2570,16 +2477,9 @@ if uploaded_file:
       // Get all data for this node and its descendants
       const nodeData = getNodeData(selectedNode);
       
-      // Convert to CSV
-      const csvContent = convertToCSV(nodeData);
-      
       // Download CSV
-      const blob = new Blob([csvContent], {{ type: 'text/csv;charset=utf-8;' }});
-      const link = document.createElement('a');
-      link.href = URL.createObjectURL(blob);
-      link.download = `node_data_${{selectedNode.data.name.replace(/[^a-zA-Z0-9]/g, '_')}}_${{new Date().toISOString().slice(0,10)}}.csv`;
-      link.click();
-      URL.revokeObjectURL(link.href);
+      const blob = new Blob(csvBlobParts(nodeData), {{ type: 'text/csv;charset=utf-8;' }});
+      downloadBlob(blob, datedFileName('node_data_' + safeNodeName(selectedNode), 'csv'));
       
       hideContextMenu();
     }}
@@ -2591,183 +2491,654 @@ if uploaded_file:
       const nodeData = getNodeData(selectedNode);
       
       // Convert to Excel format (CSV with BOM for Excel compatibility)
-      const csvContent = '\ufeff' + convertToCSV(nodeData);
+      const parts = csvBlobParts(nodeData);
+      parts.unshift('\ufeff');
       
       // Download Excel
-      const blob = new Blob([csvContent], {{ type: 'text/csv;charset=utf-8;' }});
-      const link = document.createElement('a');
-      link.href = URL.createObjectURL(blob);
-      link.download = `node_data_${{selectedNode.data.name.replace(/[^a-zA-Z0-9]/g, '_')}}_${{new Date().toISOString().slice(0,10)}}.xlsx`;
-      link.click();
-      URL.revokeObjectURL(link.href);
+      const blob = new Blob(parts, {{ type: 'text/csv;charset=utf-8;' }});
+      downloadBlob(blob, datedFileName('node_data_' + safeNodeName(selectedNode), 'xlsx'));
       
       hideContextMenu();
     }}
     
     function showNodeDetails() {{
-      if (!selectedNode || !nodeDataPanel) return;
+      if (!selectedNode) return;
       
-      const nodeData = getNodeData(selectedNode);
-      const content = document.getElementById('nodeDataContent');
+      hideContextMenu();
       
-      let html = `<div class="data-item"><span class="data-label">Node:</span> <span class="data-value">${{selectedNode.data.name}}</span></div>`;
-      html += `<div class="data-item"><span class="data-label">Value:</span> <span class="data-value">${{selectedNode.data.value || 0}}</span></div>`;
-      html += `<div class="data-item"><span class="data-label">Records:</span> <span class="data-value">${{nodeData.length}}</span></div>`;
+      const parts = [
+        `<div class="data-item"><span class="data-label">Node:</span> <span class="data-value">${{selectedNode.data.name}}</span></div>`,
+        `<div class="data-item"><span class="data-label">Value:</span> <span class="data-value">${{selectedNode.data.value || 0}}</span></div>`,
+        `<div class="data-item"><span class="data-label">Records:</span> <span class="data-value">${{countNodeRecords(selectedNode)}}</span></div>`
+      ];
       
       // Show tooltip data
-      if (selectedNode.data.tooltip_data) {{
-        for (const [key, value] of Object.entries(selectedNode.data.tooltip_data)) {{
-          html += `<div class="data-item"><span class="data-label">${{key}}:</span> <span class="data-value">${{value}}</span></div>`;
+      const td = selectedNode.data.tooltip_data;
+      if (td) {{
+        for (const key in td) {{
+          parts.push(`<div class="data-item"><span class="data-label">${{key}}:</span> <span class="data-value">${{td[key]}}</span></div>`);
         }}
       }}
       
-      content.innerHTML = html;
+      nodeDataContent.innerHTML = parts.join('');
       nodeDataPanel.style.display = 'block';
+      nodeDataPanelOpen = true;
       
       // Auto-hide after 5 seconds
-      setTimeout(() => {{
-        nodeDataPanel.style.display = 'none';
-      }}, 5000);
-      
-      hideContextMenu();
+      setTimeout(hideNodeDataPanel, 5000);
     }}
     
     function downloadNodeTree() {{
       if (!selectedNode) return;
       
-      // Get the subtree structure
-      const subtree = getNodeSubtree(selectedNode);
-      
-      // Download JSON
-      const jsonContent = JSON.stringify(subtree, null, 2);
-      const blob = new Blob([jsonContent], {{ type: 'application/json;charset=utf-8;' }});
-      const link = document.createElement('a');
-      link.href = URL.createObjectURL(blob);
-      link.download = `node_tree_${{selectedNode.data.name.replace(/[^a-zA-Z0-9]/g, '_')}}_${{new Date().toISOString().slice(0,10)}}.json`;
-      link.click();
-      URL.revokeObjectURL(link.href);
+      // Download the subtree structure as JSON
+      const blob = new Blob(subtreeJsonParts(selectedNode), {{ type: 'application/json;charset=utf-8;' }});
+      downloadBlob(blob, datedFileName('node_tree_' + safeNodeName(selectedNode), 'json'));
       
       hideContextMenu();
     }}
     
-    function getNodeData(node) {{
-      // This function would need to be implemented based on your data structure
-      // For now, we'll return a placeholder that shows the node's aggregated data
-      const data = [];
-      
-      // Add the node's own data
-      if (node.data.raw_data) {{
-        data.push(...node.data.raw_data);
+    // Rows a data node stores itself. They arrive as unparsed JSON text; parse once, on first use
+    function ownRows(item) {{
+      if (typeof item.raw_data === 'string') {{
+        item.raw_data = JSON.parse(item.raw_data);
       }}
-      
-      // Add data from all descendants
-      node.descendants().forEach(descendant => {{
-        if (descendant !== node && descendant.data.raw_data) {{
-          data.push(...descendant.data.raw_data);
+      return item.raw_data;
+    }}
+    
+    function getNodeData(node) {{
+      // Each node only stores the rows not covered by its children, so collect
+      // them from the whole data subtree (collapsed branches included), preorder,
+      // into an array sized up front from the record count
+      const data = new Array(countNodeRecords(node));
+      let filled = 0;
+      const stack = [node.data];
+      while (stack.length) {{
+        const item = stack.pop();
+        const rows = ownRows(item);
+        if (rows) {{
+          for (let i = 0; i < rows.length; i++) data[filled++] = rows[i];
         }}
-      }});
+        if (item.children) {{
+          for (let i = item.children.length - 1; i >= 0; i--) stack.push(item.children[i]);
+        }}
+      }}
       
       return data;
     }}
     
-    function getNodeSubtree(node) {{
-      // Create a clean subtree structure for JSON export
-      const subtree = {{
-        name: node.data.name,
-        value: node.data.value,
-        level: node.data.level,
-        column: node.data.column,
-        node_value: node.data.node_value,
-        color: node.data.color,
-        tooltip_data: node.data.tooltip_data,
-        children: []
-      }};
-      
-      if (node.children) {{
-        node.children.forEach(child => {{
-          subtree.children.push(getNodeSubtree(child));
-        }});
+    // Same rows as getNodeData(node).length, without gathering them into one array
+    function countNodeRecords(node) {{
+      let count = 0;
+      const stack = [node.data];
+      while (stack.length) {{
+        const item = stack.pop();
+        const rows = ownRows(item);
+        if (rows) count += rows.length;
+        if (item.children) {{
+          for (const child of item.children) stack.push(child);
+        }}
       }}
-      
-      return subtree;
+      return count;
     }}
     
-    function convertToCSV(data) {{
+    // JSON of a node's expanded subtree for download, as Blob parts written node by node.
+    // The text is what JSON.stringify(entry, null, 2) gives for the nested entries (fields
+    // left undefined are omitted), but neither the entry tree nor one giant string is built
+    const subtreeFields = ['name', 'value', 'level', 'column', 'node_value', 'color', 'tooltip_data'];
+    function subtreeJsonParts(node, parts = [], indent = '') {{
+      const inner = indent + '  ';
+      let head = '{{';
+      for (const key of subtreeFields) {{
+        const value = node.data[key];
+        if (value === undefined) continue;
+        head += '\\n' + inner + '"' + key + '": ' + JSON.stringify(value, null, 2).replace(/\\n/g, '\\n' + inner) + ',';
+      }}
+      const kids = node.children;
+      if (!kids || kids.length === 0) {{
+        parts.push(head + '\\n' + inner + '"children": []\\n' + indent + '}}');
+        return parts;
+      }}
+      const item = inner + '  ';
+      parts.push(head + '\\n' + inner + '"children": [\\n' + item);
+      for (let i = 0; i < kids.length; i++) {{
+        if (i) parts.push(',\\n' + item);
+        subtreeJsonParts(kids[i], parts, item);
+      }}
+      parts.push('\\n' + inner + ']\\n' + indent + '}}');
+      return parts;
+    }}
+    
+    // Fields that need quoting in CSV
+    const csvQuoteRe = /[,"\\r\\n]/;
+    
+    // CSV text as Blob parts: rows are joined a chunk at a time, so a large export is never
+    // held as one giant string on top of its rows
+    const csvChunkRows = 5000;
+    
+    function csvBlobParts(data) {{
       if (!data || data.length === 0) {{
-        return "No data available for this node";
+        return ["No data available for this node"];
       }}
       
       // Get all unique keys from the data
       const keys = new Set();
-      data.forEach(item => {{
-        Object.keys(item).forEach(key => keys.add(key));
-      }});
+      for (const item of data) {{
+        for (const key in item) keys.add(key);
+      }}
       
       const headers = Array.from(keys);
-      const csvRows = [headers.join(',')];
+      const parts = [headers.join(',')];
+      // One scratch row and one pre-sized chunk are reused for every row
+      const row = new Array(headers.length);
+      const chunk = new Array(Math.min(csvChunkRows, data.length));
+      let filled = 0;
+      
+      for (let r = 0; r < data.length; r++) {{
+        const item = data[r];
+        for (let i = 0; i < headers.length; i++) {{
+          const value = item[headers[i]] || '';
+          // Escape commas, quotes and line breaks in CSV; only cells with a quote need the replace
+          if (typeof value !== 'string' || !csvQuoteRe.test(value)) {{
+            row[i] = value;
+          }} else {{
+            row[i] = '"' + (value.indexOf('"') === -1 ? value : value.replace(/"/g, '""')) + '"';
+          }}
+        }}
+        chunk[filled++] = row.join(',');
+        if (filled === chunk.length || r === data.length - 1) {{
+          if (filled < chunk.length) chunk.length = filled;
+          parts.push('\\n' + chunk.join('\\n'));
+          filled = 0;
+        }}
+      }}
       
-      data.forEach(item => {{
-        const row = headers.map(header => {{
-          const value = item[header] || '';
-          // Escape commas and quotes in CSV
-          if (typeof value === 'string' && (value.includes(',') || value.includes('"'))) {{
-            return `"${{value.replace(/"/g, '""')}}"`;
+      return parts;
+    }}
+    
+    // Hide context menu when clicking elsewhere. Capturing runs this before a menu item's own
+    // handler, so "Show Node Details" opens its panel after the menu is hidden
+    document.addEventListener('click', hideContextMenu, {{ capture: true }});
+    
+    // Built on first hover and kept on the data, like the label text
+    function tooltipHtml(d) {{
+      let t = d.data.__tooltip;
+      if (t === undefined) {{
+        const parts = ['<b>', d.data.name, '</b><br>'];
+        const td = d.data.tooltip_data;
+        if (td) {{
+          for (const k in td) parts.push(k, ": <span style='color:#38bdf8;font-weight:600'>", td[k], "</span><br>");
+        }}
+        t = parts.join('');
+        d.data.__tooltip = t;
+      }}
+      return t;
+    }}
+    
+    // Dashed outline boxes around each group at groupOutlineLevel (Mind Map style)
+    function groupRegions(nodes) {{
+      const padX = nodeSize * 2.5;
+      const padY = nodeSize * 2.0;
+      const regions = [];
+      for (const g of nodes) {{
+        if ((g.data && typeof g.data.level === 'number' ? g.data.level : g.depth) !== groupOutlineLevel) continue;
+        // Subtree extent from computeSubtreeBounds, instead of rescanning g.descendants()
+        const b = g.__bbox;
+        const x = g.y - padX;
+        const y = b.top - padY;
+        const width = (b.right - g.y) + padX * 2;
+        const height = (b.bottom - b.top) + padY * 2;
+        regions.push({{ key: nodeKey(g), x, y, width, height, stroke: g.data.color || '#94A3B8' }});
+      }}
+      return regions;
+    }}
+    
+    // Visible part of the tree in layout coordinates (x = vertical, y = horizontal), padded by
+    // one level so labels and links entering from just outside the viewport are kept
+    function visibleWindow() {{
+      const t = viewTransform;
+      const pad = dy;
+      return {{
+        left: -t.x / t.k - pad, right: (width - t.x) / t.k + pad,
+        top: -t.y / t.k - pad, bottom: (height - t.y) / t.k + pad
+      }};
+    }}
+    
+    function nodeInWindow(d, w) {{
+      return d.y >= w.left && d.y <= w.right && d.x >= w.top && d.x <= w.bottom;
+    }}
+    
+    // Takes the two endpoints, so culled links never get a link object allocated
+    function linkInWindow(source, target, w) {{
+      return Math.max(source.y, target.y) >= w.left && Math.min(source.y, target.y) <= w.right
+        && Math.max(source.x, target.x) >= w.top && Math.min(source.x, target.x) <= w.bottom;
+    }}
+    
+    // Layout extent of every expanded subtree (x is vertical, y horizontal), filled bottom-up
+    // in a single pass once per layout
+    function computeSubtreeBounds(hierarchyRoot) {{
+      hierarchyRoot.eachAfter(d => {{
+        let top = d.x, bottom = d.x, right = d.y;
+        if (d.children) {{
+          for (const c of d.children) {{
+            const b = c.__bbox;
+            if (b.top < top) top = b.top;
+            if (b.bottom > bottom) bottom = b.bottom;
+            if (b.right > right) right = b.right;
+          }}
+        }}
+        d.__bbox = {{ top, bottom, right }};
+      }});
+    }}
+    
+    // Nodes, links and placeholder blocks to draw: subtrees entirely outside the window are
+    // skipped without visiting them, and subtrees too short to read collapse into one block
+    function visibleTree() {{
+      const w = visibleWindow();
+      const k = viewTransform.k;
+      const nodes = [], links = [], placeholders = [];
+      (function visit(d) {{
+        const b = d.__bbox;
+        if (b.bottom < w.top || b.top > w.bottom || b.right < w.left || d.y > w.right) return;
+        if (nodeInWindow(d, w)) nodes.push(d);
+        if (!d.children) return;
+        if ((b.bottom - b.top + dx) * k < minFramePx) {{
+          let top = Infinity, bottom = -Infinity, right = -Infinity;
+          for (const c of d.children) {{
+            const cb = c.__bbox;
+            if (cb.top < top) top = cb.top;
+            if (cb.bottom > bottom) bottom = cb.bottom;
+            if (cb.right > right) right = cb.right;
           }}
-          return value;
+          placeholders.push({{
+            node: d,
+            x: d.y + dy - nodeSize, y: top - nodeSize,
+            width: right - (d.y + dy) + nodeSize * 2, height: bottom - top + nodeSize * 2
+          }});
+          return;
+        }}
+        for (const c of d.children) {{
+          if (linkInWindow(d, c, w)) links.push({{ source: d, target: c }});
+          visit(c);
+        }}
+      }})(root);
+      return {{ nodes, links, placeholders, window: w }};
+    }}
+    
+    // Window and zoom scale of the last SVG bind. A pan that keeps the viewport inside the
+    // padded window it bound shows nothing new, so it only needs the transform moved
+    let boundWindow = null;
+    let boundScale = null;
+    function viewStillBound() {{
+      const t = viewTransform;
+      const w = boundWindow;
+      return w !== null && t.k === boundScale
+        && -t.x / t.k >= w.left && (width - t.x) / t.k <= w.right
+        && -t.y / t.k >= w.top && (height - t.y) / t.k <= w.bottom;
+    }}
+    
+    // Relayout for a node toggle or drag drop at most once per animation frame: several in a
+    // row would each start 700ms transitions that the next one immediately overrides.
+    // Expand/Collapse All call update() directly, since they fit the new layout right away.
+    let layoutUpdatePending = false;
+    let pendingUpdateSource = null;
+    function scheduleUpdate(source) {{
+      expandJob++;
+      pendingUpdateSource = source;
+      if (layoutUpdatePending) return;
+      layoutUpdatePending = true;
+      requestAnimationFrame(() => {{
+        layoutUpdatePending = false;
+        const next = pendingUpdateSource;
+        pendingUpdateSource = null;
+        update(next);
+      }});
+    }}
+    
+    // Apply the latest zoom/pan at most once per animation frame: wheels and trackpads fire
+    // zoom events faster than the screen refreshes, and only the last transform matters.
+    // While a toggle's relayout is pending, the hierarchy already shows children that have no
+    // position yet, so the draw/re-cull is left to that update(), which runs in this frame too
+    function scheduleViewUpdate() {{
+      if (viewUpdatePending) return;
+      viewUpdatePending = true;
+      requestAnimationFrame(() => {{
+        viewUpdatePending = false;
+        updateZoomInfo(viewTransform.k);
+        if (useCanvas) {{
+          if (!layoutUpdatePending) drawCanvas();
+        }} else {{
+          g.attr("transform", viewTransform);
+          svg.classed("labels-hidden", !labelsLegible(viewTransform.k));
+          // Re-bind the SVG view to the nodes now in the viewport
+          if (!layoutUpdatePending && !viewStillBound()) update(root, true);
+        }}
+      }});
+    }}
+    
+    // Draw the last laid-out tree onto the canvas at the current zoom/pan
+    // Canvas labels are rasterized once per text at the current zoom bucket and then
+    // blitted with drawImage; the cache is dropped when the bucket changes or grows too big
+    const labelBitmaps = new Map();
+    const maxLabelBitmaps = 2000;
+    let labelBitmapScale = 0;
+    const labelBitmapFont = `${{fontStyle}} ${{fontWeight}} ${{fontSize}}px ${{fontFamily}}`;
+    function labelBitmap(text, scale) {{
+      if (scale !== labelBitmapScale || labelBitmaps.size >= maxLabelBitmaps) {{
+        labelBitmaps.clear();
+        labelBitmapScale = scale;
+      }}
+      let bmp = labelBitmaps.get(text);
+      if (!bmp) {{
+        // Measure on the shared context, so each bitmap canvas is sized once before use
+        const m = measureText(text, labelBitmapFont);
+        const left = Math.ceil(m.actualBoundingBoxLeft) + 1;
+        const ascent = Math.ceil(m.actualBoundingBoxAscent) + 1;
+        const w = left + Math.ceil(Math.max(m.width, m.actualBoundingBoxRight)) + 1;
+        const h = ascent + Math.ceil(m.actualBoundingBoxDescent) + 1;
+        const c = document.createElement('canvas');
+        c.width = Math.ceil(w * scale);
+        c.height = Math.ceil(h * scale);
+        const cx = c.getContext('2d');
+        cx.scale(scale, scale);
+        cx.font = labelBitmapFont;
+        cx.fillStyle = fontColor;
+        cx.fillText(text, left, ascent);
+        bmp = {{ image: c, width: m.width, left, ascent, w: c.width / scale, h: c.height / scale }};
+        labelBitmaps.set(text, bmp);
+      }}
+      return bmp;
+    }}
+    
+    function drawCanvas() {{
+      const t = viewTransform;
+      const {{ nodes, links, placeholders }} = visibleTree();
+      ctx.setTransform(1, 0, 0, 1, 0, 0);
+      ctx.clearRect(0, 0, width * dpr, height * dpr);
+      ctx.setTransform(dpr * t.k, 0, 0, dpr * t.k, dpr * t.x, dpr * t.y);
+      
+      if (styleMode === "Mind Map" && showGroupOutlines) {{
+        ctx.save();
+        ctx.globalAlpha = outlineOpacity;
+        ctx.lineWidth = 2.5;
+        ctx.setLineDash([8, 6]);
+        groupRegions(layoutNodes).forEach(r => {{
+          ctx.strokeStyle = r.stroke;
+          ctx.stroke(new Path2D(roundedRectPath(r.x, r.y, r.width, r.height, 18)));
+        }});
+        ctx.restore();
+      }}
+      
+      // Links: one path for all of them unless Mind Map colours them per branch
+      ctx.save();
+      ctx.globalAlpha = lineOpacity;
+      ctx.lineWidth = lineWidth;
+      ctx.lineCap = "round";
+      ctx.lineJoin = "round";
+      ctx.strokeStyle = lineColor;
+      if (styleMode === "Mind Map") {{
+        links.forEach(l => {{
+          ctx.beginPath();
+          canvasDiagonal(l);
+          ctx.strokeStyle = l.target.data.color || lineColor;
+          ctx.stroke();
         }});
-        csvRows.push(row.join(','));
+      }} else {{
+        ctx.beginPath();
+        links.forEach(l => canvasDiagonal(l));
+        ctx.stroke();
+      }}
+      ctx.restore();
+      
+      ctx.fillStyle = "#CBD5E1";
+      placeholders.forEach(p => {{
+        ctx.fill(new Path2D(roundedRectPath(p.x, p.y, p.width, p.height, 2)));
       }});
       
-      return csvRows.join('\\n');
+      // Nodes and labels
+      const label = getLabelAttrs();
+      const align = label.anchor === 'middle' ? 0.5 : (label.anchor === 'end' ? 1 : 0);
+      // Rasterize labels at the next power of two of the device scale, so they stay sharp
+      const labelScale = Math.pow(2, Math.ceil(Math.log2(dpr * t.k)));
+      const showLabels = labelsLegible(t.k);
+      nodes.forEach(d => {{
+        const fill = nodeFill(d);
+        ctx.translate(d.y, d.x);
+        if (nodeShape === "Donut") {{
+          ctx.strokeStyle = fill;
+          ctx.lineWidth = Math.max(4, nodeSize * 0.35);
+          ctx.stroke(nodeShapePath);
+        }} else {{
+          ctx.fillStyle = fill;
+          ctx.fill(nodeShapePath);
+          ctx.strokeStyle = "#fff";
+          ctx.lineWidth = 3;
+          ctx.stroke(nodeShapePath);
+        }}
+        if (showLabels) {{
+          const bmp = labelBitmap(formatLabel(d), labelScale);
+          ctx.drawImage(bmp.image, label.x - bmp.width * align - bmp.left, label.y - bmp.ascent, bmp.w, bmp.h);
+        }}
+        ctx.translate(-d.y, -d.x);
+      }});
     }}
     
-    // Hide context menu when clicking elsewhere
-    document.addEventListener('click', hideContextMenu);
+    // Nearest drawn node within reach of the pointer (canvas mode has no per-node DOM listeners)
+    function nodeAtPointer(event) {{
+      const [px, py] = viewTransform.invert(d3.pointer(event, canvas.node()));
+      // Widest shapes (Capsule/Parallelogram) reach about 1.5x nodeSize from the centre
+      const reach = nodeSize * 1.5 + 2;
+      if (!nodeIndex) nodeIndex = d3.quadtree(layoutNodes, d => d.y, d => d.x);
+      return nodeIndex.find(px, py, reach) || null;
+    }}
     
-    function update(source) {{
-      tree(root);
-      const nodes = root.descendants();
-      const links = root.links();
+    if (useCanvas) {{
+      let hoveredNode = null;
+      canvas
+        .on("click", (event) => {{
+          // d3.zoom prevents the click that ends a pan
+          if (event.defaultPrevented) return;
+          const d = nodeAtPointer(event);
+          if (!d) return;
+          if (d._children) {{
+            d.children = d.children ? null : d._children;
+          }}
+          scheduleUpdate(d);
+        }})
+        .on("contextmenu", (event) => {{
+          const d = nodeAtPointer(event);
+          if (d) showContextMenu(event, d);
+        }})
+        .on("mousemove", (event) => {{
+          const d = nodeAtPointer(event);
+          if (d !== hoveredNode) {{
+            hoveredNode = d;
+            canvas.style("cursor", d ? "pointer" : null);
+            tooltip.transition().duration(d ? 200 : 400).style("opacity", d ? .95 : 0);
+            if (d) tooltip.html(tooltipHtml(d));
+          }}
+          if (d) tooltip.style("left", (event.pageX+15) + "px").style("top", (event.pageY-20) + "px");
+        }})
+        .on("mouseleave", () => {{
+          hoveredNode = null;
+          tooltip.transition().duration(400).style("opacity", 0);
+        }});
+    }}
+    
+    // The SVG draws all links of one colour as a single compound path: a single group unless
+    // Mind Map colours links by branch
+    function linkGroups(links) {{
+      if (styleMode !== "Mind Map") return links.length ? [{{ color: lineColor, links }}] : [];
+      const byColor = new Map();
+      for (const l of links) {{
+        const color = l.target.data.color || lineColor;
+        const grp = byColor.get(color);
+        if (grp) grp.links.push(l);
+        else byColor.set(color, {{ color, links: [l] }});
+      }}
+      return Array.from(byColor.values());
+    }}
+    
+    // Progress (eased, 0..1) of the running layout transition of the links. Links whose
+    // nodes were both in the previous layout move from their old positions; new ones are
+    // drawn in place, as the nodes that enter slide in from their parent
+    let linkProgress = 1;
+    function linkPath(l, t) {{
+      const s = l.source, c = l.target;
+      let sx = s.x, sy = s.y, tx = c.x, ty = c.y;
+      if (t < 1 && s.__pv === layoutVersion - 1 && c.__pv === layoutVersion - 1) {{
+        sx = s.px + (sx - s.px) * t;
+        sy = s.py + (sy - s.py) * t;
+        tx = c.px + (tx - c.px) * t;
+        ty = c.py + (ty - c.py) * t;
+      }}
+      const my = fmt((sy + ty) / 2);
+      sx = fmt(sx);
+      tx = fmt(tx);
+      return "M" + fmt(sy) + "," + sx + "C" + my + "," + sx + " " + my + "," + tx + " " + fmt(ty) + "," + tx;
+    }}
+    
+    // Path data is only written when it changed, e.g. not for a re-cull that kept every link
+    function drawLinks() {{
+      const t = linkProgress;
+      gLink.selectAll("path").each(function(grp) {{
+        const parts = new Array(grp.links.length);
+        for (let i = 0; i < parts.length; i++) parts[i] = linkPath(grp.links[i], t);
+        const d = parts.join("");
+        if (this.__d !== d) {{
+          this.setAttribute("d", d);
+          this.__d = d;
+        }}
+      }});
+    }}
+    
+    // Writes a node's transform only when it differs from the last one written here.
+    // Transitions and drags move nodes without it, so they clear the record
+    function placeNode(el, d) {{
+      const t = `translate(${{d.y}},${{d.x}})`;
+      if (el.__transform !== t) {{
+        el.setAttribute("transform", t);
+        el.__transform = t;
+      }}
+    }}
+    
+    // Drag & drop reorder among siblings. Built once and attached to each node as it enters
+    // the view; its listeners stay on the element across updates
+    const dragBehavior = d3.drag()
+      .on("start", function(event, d) {{
+        if (!enableDragReorder) return;
+        // Prevent zoom/pan from interfering while dragging
+        if (event.sourceEvent) {{ event.sourceEvent.stopPropagation(); }}
+        dragActive = true;
+        dragMoved = false;
+        d3.select(this).raise().classed("dragging", true);
+      }})
+      .on("drag", function(event, d) {{
+        if (!enableDragReorder) return;
+        const [, py] = d3.pointer(event, g.node());
+        dragMoved = true;
+        this.__transform = null;
+        d3.select(this).attr("transform", `translate(${{d.y}}, ${{py}})`);
+      }})
+      .on("end", function(event, d) {{
+        if (!enableDragReorder) return;
+        // Mark the preceding click as prevented so it won't toggle
+        event.sourceEvent && (event.sourceEvent.preventDefault(), event.sourceEvent.stopPropagation());
+        dragActive = false;
+        d3.select(this).classed("dragging", false);
+        const parent = d.parent;
+        if (!parent || !dragMoved) return;
+        const container = parent.children ? parent.children : parent._children;
+        if (!container) return;
+        const siblings = container.filter(s => s !== d).sort((a, b) => a.x - b.x);
+        const [, py] = d3.pointer(event, g.node());
+        // Find index to insert based on vertical position relative to siblings
+        let dropIndex = siblings.findIndex(s => py < s.x);
+        if (dropIndex === -1) dropIndex = siblings.length;
+        // Build a new ordered array: insert dragged node at dropIndex among sorted siblings
+        const newOrder = [];
+        for (let i = 0; i < siblings.length; i++) {{
+          if (i === dropIndex) newOrder.push(d);
+          newOrder.push(siblings[i]);
+        }}
+        if (dropIndex === siblings.length) newOrder.push(d);
+        // Only a real reorder invalidates the sibling order the export layout is cached for;
+        // a drop back in place just snaps the node back
+        if (newOrder.some((s, i) => s !== container[i])) {{
+          manualOrder = true;
+          orderVersion++;
+          if (parent.children) {{ parent.children = newOrder; }} else {{ parent._children = newOrder; }}
+          parent._allChildren = newOrder;
+        }}
+        scheduleUpdate(parent);
+      }});
+    
+    // fromZoom: the layout is unchanged and only the set of visible nodes/links is refreshed
+    function update(source, fromZoom = false) {{
+      if (!fromZoom) {{
+        if (!useCanvas) {{
+          // Remember where the outgoing layout put its nodes, for the transitions. Its node
+          // list is kept, so this needs no tree walk, and nodes a toggle has just revealed
+          // are correctly left out
+          for (const d of layoutNodes) {{ d.px = d.x; d.py = d.y; d.__pv = layoutVersion; }}
+        }}
+        tree(root);
+        layoutVersion++;
+        layoutNodes = root.descendants();
+        nodeIndex = null;
+        computeSubtreeBounds(root);
+      }}
+      
+      if (useCanvas) {{
+        drawCanvas();
+        return;
+      }}
       
-      // Update links (color per-branch in Mind Map mode)
-      const link = gLink.selectAll("path").data(links, d => d.target.id || (d.target.id = Math.random()));
-      link.enter().append("path")
-        .attr("class", "link")
-        .attr("d", diagonal)
-        .attr("fill", "none")
-        .attr("stroke-width", lineWidth)
-        .attr("stroke-linecap", "round")
-        .attr("stroke-linejoin", "round")
-        .attr("stroke", d => styleMode === "Mind Map" ? (d.target.data.color || lineColor) : lineColor)
-        .merge(link)
-        .transition().duration(750)
-        .attr("d", diagonal)
-        .attr("stroke-width", lineWidth)
-        .attr("stroke-linecap", "round")
-        .attr("stroke-linejoin", "round")
-        .attr("stroke", d => styleMode === "Mind Map" ? (d.target.data.color || lineColor) : lineColor);
+      // Only bind what is inside the viewport; the rest is added when panned into view
+      const {{ nodes, links, placeholders, window: w }} = visibleTree();
+      boundWindow = w;
+      boundScale = viewTransform.k;
+      const animate = nodes.length <= maxAnimatedNodes;
+      
+      // Update links: one compound path per stroke colour. Their stroke comes from the
+      // .link rule; only Mind Map colours them per branch, inline so it wins over the rule
+      const link = gLink.selectAll("path").data(linkGroups(links), grp => grp.color);
+      const linkEnter = link.enter().append("path")
+        .attr("class", "link");
+      if (styleMode === "Mind Map") {{
+        linkEnter.style("stroke", grp => grp.color);
+      }}
       link.exit().remove();
+      if (fromZoom) {{
+        // A zoom re-cull draws at the point a running expand/collapse transition has reached
+        drawLinks();
+      }} else if (animate) {{
+        linkProgress = 0;
+        drawLinks();
+        gLink.transition("links").duration(750)
+          .tween("links", () => t => {{ linkProgress = t; drawLinks(); }});
+      }} else {{
+        gLink.interrupt("links");
+        linkProgress = 1;
+        drawLinks();
+      }}
 
-      // Region outlines for Mind Map style
-      if (styleMode === "Mind Map" && showGroupOutlines) {{
-        const groups = nodes.filter(n => (n.data && typeof n.data.level === 'number' ? n.data.level : n.depth) === groupOutlineLevel);
-        const padX = nodeSize * 2.5;
-        const padY = nodeSize * 2.0;
-        const regions = groups.map(g => {{
-          const desc = g.descendants();
-          let minX = Infinity, maxX = -Infinity, minY = Infinity, maxY = -Infinity;
-          desc.forEach(d => {{
-            if (d.x < minX) minX = d.x;
-            if (d.x > maxX) maxX = d.x;
-            if (d.y < minY) minY = d.y;
-            if (d.y > maxY) maxY = d.y;
-          }});
-          const x = minY - padX;
-          const y = minX - padY;
-          const width = (maxY - minY) + padX * 2;
-          const height = (maxX - minX) + padY * 2;
-          return {{ key: g.id || (g.id = Math.random()), x, y, width, height, stroke: g.data.color || '#94A3B8' }};
-        }});
+      const placeholderSel = gPlaceholder.selectAll("rect").data(placeholders, p => nodeKey(p.node));
+      placeholderSel.enter().append("rect")
+        .attr("fill", "#CBD5E1")
+        .attr("rx", 2)
+        .merge(placeholderSel)
+        .attr("x", p => p.x)
+        .attr("y", p => p.y)
+        .attr("width", p => p.width)
+        .attr("height", p => p.height);
+      placeholderSel.exit().remove();
+
+      // Region outlines for Mind Map style (a handful of paths, so they are not culled)
+      if (fromZoom) {{
+        // Layout unchanged: outlines are already in place
+      }} else if (styleMode === "Mind Map" && showGroupOutlines) {{
+        const regions = groupRegions(layoutNodes);
         const regionSel = gRegion.selectAll('path').data(regions, d => d.key);
         regionSel.enter().append('path')
           .attr('class', 'region-outline')
@@ -2785,134 +3156,43 @@ if uploaded_file:
       }}
       
       // Update nodes
-      const node = gNode.selectAll("g").data(nodes, d => d.id || (d.id = Math.random()));
-      
-      // Enter new nodes
-      const nodeEnter = node.enter().append("g")
-        .attr("class", "node")
-        .attr("transform", d => `translate(${{source.y0 || 0}},${{source.x0 || 0}})`)
-        .on("click", (event, d) => {{
-          // Ignore click if a drag just occurred
-          if (dragActive || event.defaultPrevented) return;
-          if (d._children) {{
-            d.children = d.children ? null : d._children;
-          }}
-          update(d);
-        }})
-        .on("contextmenu", (event, d) => {{
-          showContextMenu(event, d);
-        }})
-        .on("mouseover", (event, d) => {{
-          let t = `<b>${{d.data.name}}</b><br>`;
-          for (const [k,v] of Object.entries(d.data.tooltip_data||{{}}))
-            t += `${{k}}: <span style='color:#38bdf8;font-weight:600'>${{v}}</span><br>`;
-          tooltip.transition().duration(200).style("opacity", .95);
-          tooltip.html(t).style("left", (event.pageX+15) + "px").style("top", (event.pageY-20) + "px");
-        }})
-        .on("mouseout", () => tooltip.transition().duration(400).style("opacity", 0));
-      
-      // Add shapes to new nodes using the custom shape function
-      nodeEnter.each(function(d) {{
-        createNodeShape(d3.select(this), nodeSize);
-      }});
+      const node = gNode.selectAll("g").data(nodes, nodeKey);
       
-      // Add text to new nodes with clean styling and proper positioning
-      nodeEnter.append("text")
-        .attr('x', getLabelAttrs().x)
-        .attr('y', getLabelAttrs().y)
-        .attr('text-anchor', getLabelAttrs().anchor)
-        .attr("font-family", "Calibri, Arial, sans-serif")
-        .attr("font-size", fontSize + "px")
-        .attr("font-weight", fontWeight)
-        .attr("fill", fontColor)
-        .attr("font-style", fontStyle)
-        .text(d => formatLabel(d));
+      // Enter new nodes as clones of one group template holding the label attributes;
+      // font and colour come from the .node text rule
+      const nodeTemplate = nodeGroupTemplate(getLabelAttrs());
+      const nodeEnter = node.enter().append(d => nodeGroupElement(d, nodeTemplate, nodeSize))
+        .attr("transform", d => fromZoom ? `translate(${{d.y}},${{d.x}})` : `translate(${{source.py || 0}},${{source.px || 0}})`);
       
-      // Drag & drop reorder among siblings
-      const dragBehavior = d3.drag()
-        .on("start", function(event, d) {{
-          if (!enableDragReorder) return;
-          // Prevent zoom/pan from interfering while dragging
-          if (event.sourceEvent) {{ event.sourceEvent.stopPropagation(); }}
-          dragActive = true;
-          d3.select(this).raise().classed("dragging", true);
-        }})
-        .on("drag", function(event, d) {{
-          if (!enableDragReorder) return;
-          const [, py] = d3.pointer(event, g.node());
-          d3.select(this).attr("transform", `translate(${{d.y}}, ${{py}})`);
-        }})
-        .on("end", function(event, d) {{
-          if (!enableDragReorder) return;
-          // Mark the preceding click as prevented so it won't toggle
-          event.sourceEvent && (event.sourceEvent.preventDefault(), event.sourceEvent.stopPropagation());
-          dragActive = false;
-          d3.select(this).classed("dragging", false);
-          const parent = d.parent;
-          if (!parent) return;
-          manualOrder = true;
-          const container = parent.children ? parent.children : parent._children;
-          if (!container) return;
-          const siblings = container.filter(s => s !== d).sort((a, b) => a.x - b.x);
-          const [, py] = d3.pointer(event, g.node());
-          // Find index to insert based on vertical position relative to siblings
-          let dropIndex = siblings.findIndex(s => py < s.x);
-          if (dropIndex === -1) dropIndex = siblings.length;
-          // Build a new ordered array: insert dragged node at dropIndex among sorted siblings
-          const newOrder = [];
-          for (let i = 0; i < siblings.length; i++) {{
-            if (i === dropIndex) newOrder.push(d);
-            newOrder.push(siblings[i]);
-          }}
-          if (dropIndex === siblings.length) newOrder.push(d);
-          if (parent.children) {{ parent.children = newOrder; }} else {{ parent._children = newOrder; }}
-          update(parent);
-        }});
-
       if (enableDragReorder) {{
         nodeEnter.call(dragBehavior);
       }}
 
       // Update existing nodes
-      const nodeUpdate = node.merge(nodeEnter)
-        .attr("pointer-events", "all");
+      const nodeUpdate = node.merge(nodeEnter);
 
-      nodeUpdate
-        .transition().duration(700)
-        .attr("transform", d => `translate(${{d.y}},${{d.x}})`);
-      
-      if (enableDragReorder) {{
-        nodeUpdate.call(dragBehavior);
-      }}
-      if (enableDragReorder) {{
-        node.merge(nodeEnter).call(dragBehavior);
+      if (fromZoom) {{
+        // Layout unchanged: bound nodes keep their place or running transition
+      }} else if (animate) {{
+        nodeUpdate
+          .each(function() {{ this.__transform = null; }})
+          .transition().duration(700)
+          .attr("transform", d => `translate(${{d.y}},${{d.x}})`);
+      }} else {{
+        nodeUpdate
+          .interrupt()
+          .each(function(d) {{ placeNode(this, d); }});
       }}
       
       // Remove old nodes
       node.exit().remove();
-      
-      // Store positions for next update
-      root.each(d => {{ d.x0 = d.x; d.y0 = d.y; }});
     }}
     
     // Initial update
     update(root);
     
-    // Center the tree initially
-    setTimeout(() => {{
-      const nodes = root.descendants();
-      if (nodes.length > 0) {{
-        const minX = d3.min(nodes, d => d.x);
-        const maxX = d3.max(nodes, d => d.x);
-        const minY = d3.min(nodes, d => d.y);
-        const maxY = d3.max(nodes, d => d.y);
-        const treeWidth = maxY - minY;
-        const treeHeight = maxX - minX;
-        const centerX = width / 2 - (minY + treeWidth / 2);
-        const centerY = height / 2 - (minX + treeHeight / 2);
-        svg.call(zoom.transform, d3.zoomIdentity.translate(centerX, centerY).scale(1));
-      }}
-    }}, 100);
+    // Fit the tree into view initially
+    fitToView(0);
     </script>
     </body>
     </html>
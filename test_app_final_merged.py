@@ -0,0 +1,15 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("streamlit")
+
+from app_final_merged import calculate_period_status
+
+
+def test_period_status_missing_label_next_to_nonstandard_label():
+    planned = pd.Series(['W02 2024', 'W01', None, 'W01 x'])
+    actual = pd.Series(['W01 2024', None, 'Foo x', 'W01 y'])
+
+    status = calculate_period_status(planned, actual)
+
+    assert status.tolist() == ['Early', 'Pending', 'Pending', 'On-Time']